@@ -0,0 +1,315 @@
+from fatx.analysis.orphan import FatXOrphan
+
+import hashlib
+import logging
+import struct
+import array
+import json
+import zlib
+import sys
+import os
+
+
+LOG = logging.getLogger('FATX.Analyzer')
+
+# Amount of the file area read at a time while hashing.
+HASH_CHUNK_SIZE = 0x100000
+
+# What extraction does with a file whose content was already extracted.
+DEDUPE_LINK = 'link'
+DEDUPE_SKIP = 'skip'
+
+# Cluster hashes are saved little endian whatever the machine is.
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+
+class FatXClusterHashes(object):
+    """Fast hash of every cluster in a volume's file area.
+
+    Each cluster is hashed with both CRC-32 and Adler-32, which together make
+    a 64 bit hash that is cheap enough to compute for the whole volume in one
+    streaming pass. A file's content is identified by the hashes of its
+    clusters, so finding duplicate files needs no more reading than the
+    partial cluster at the end of each file.
+
+    The hashes can be saved and loaded back, and are only loaded for the
+    volume they were computed from, as long as neither the image file nor the
+    file allocation table changed since.
+
+    Args:
+        volume (FatXVolume): Mounted volume to hash.
+    """
+    def __init__(self, volume):
+        self.volume = volume
+        self.crc = array.array('I')
+        self.adler = array.array('I')
+
+    def get_identity(self):
+        """Returns (dict): What the hashes are only valid for."""
+        return self.volume.get_identity()
+
+    def get_cache_path(self, directory):
+        """Names the file that the hashes of this volume are kept in.
+
+        Images of the same drive are often named alike, e.g. before/disk.img
+        and after/disk.img, so the name holds a digest of the image's full
+        path as well as its base name.
+
+        Args:
+            directory (str): Directory the hashes are kept in.
+
+        Returns (str): Path of the file.
+        """
+        image = os.path.abspath(getattr(self.volume.infile, 'name', ''))
+        return os.path.join(directory, '{}.{}.{:x}.hashes'.format(
+            os.path.basename(image), hashlib.sha1(image).hexdigest()[:12],
+            self.volume.offset))
+
+    def build(self, progress=None):
+        """Hashes every cluster in one pass over the file area.
+
+        Args:
+            progress (FatXProgress): Reports the bytes hashed.
+        """
+        volume = self.volume
+        bpc = volume.bytes_per_cluster
+        clusters = volume.max_clusters - 1
+        per_chunk = max(1, HASH_CHUNK_SIZE // bpc)
+        crc32 = zlib.crc32
+        adler32 = zlib.adler32
+        self.crc = crc = array.array('I', [0]) * clusters
+        self.adler = adler = array.array('I', [0]) * clusters
+
+        with volume.metrics.phase('cluster_hash'):
+            if progress is not None:
+                progress.start('cluster_hash', total_bytes=clusters * bpc)
+
+            volume.seek_to_cluster(1)
+            index = 0
+            while index < clusters:
+                count = min(per_chunk, clusters - index)
+                data = volume.infile.read(count * bpc)
+                if not data:
+                    break
+                view = buffer(data)
+                for offset in xrange(0, len(data), bpc):
+                    cluster = view[offset:offset + bpc]
+                    crc[index] = crc32(cluster) & 0xffffffff
+                    adler[index] = adler32(cluster) & 0xffffffff
+                    index += 1
+                if progress is not None:
+                    progress.update(len(data))
+
+            volume.metrics.count('clusters_hashed', index)
+            if progress is not None:
+                progress.finish()
+
+    def save(self, path):
+        """Writes the hashes to path, with what they are valid for in a JSON
+        file next to it."""
+        with open(path, 'wb') as f:
+            for hashes in (self.crc, self.adler):
+                hashes = array.array('I', hashes)
+                if _BIG_ENDIAN:
+                    hashes.byteswap()
+                hashes.tofile(f)
+        with open(path + '.json', 'w') as f:
+            json.dump(dict(self.get_identity(), clusters=len(self.crc)), f,
+                      indent=1, sort_keys=True, separators=(',', ': '))
+
+    def load(self, path):
+        """Reads hashes written by save().
+
+        Returns (bool): Whether they were computed from this volume and were
+            loaded.
+        """
+        if not os.path.exists(path) or not os.path.exists(path + '.json'):
+            return False
+        with open(path + '.json', 'r') as f:
+            identity = json.load(f)
+        clusters = identity.pop('clusters')
+        if identity != self.get_identity():
+            LOG.warning('Cluster hashes in %s are of another volume or out of '
+                        'date.', path)
+            return False
+
+        crc = array.array('I')
+        adler = array.array('I')
+        with open(path, 'rb') as f:
+            crc.fromfile(f, clusters)
+            adler.fromfile(f, clusters)
+        if _BIG_ENDIAN:
+            crc.byteswap()
+            adler.byteswap()
+        self.crc = crc
+        self.adler = adler
+        return True
+
+    def build_or_load(self, path=None, progress=None):
+        """Loads the hashes from path if they are there, otherwise builds them
+        and saves them there.
+
+        Args:
+            path (str): Where the hashes are kept. If None they are always
+                built and not saved.
+            progress (FatXProgress): Reports the bytes hashed.
+        """
+        if path is not None and self.load(path):
+            return
+        self.build(progress)
+        if path is not None:
+            self.save(path)
+
+    def get_file_key(self, clusters, size):
+        """Identifies a file's content.
+
+        Whole clusters are identified by their hashes. The end of the last
+        cluster is not part of the file, so what the file uses of it is read
+        and hashed instead.
+
+        Args:
+            clusters (int[]): Clusters holding the file, in order.
+            size (int): Size of the file.
+
+        Returns (str): Digest of the content, or None if the clusters cannot
+            hold the file.
+        """
+        bpc = self.volume.bytes_per_cluster
+        whole, tail = divmod(size, bpc)
+        needed = whole + (1 if tail else 0)
+        if size == 0 or len(clusters) < needed:
+            return None
+
+        crc = self.crc
+        adler = self.adler
+        try:
+            indexes = [cluster - 1 for cluster in clusters[:whole]]
+            digest = hashlib.md5(struct.pack('<Q', size))
+            digest.update(array.array('I', [crc[i] for i in indexes])
+                          .tostring())
+            digest.update(array.array('I', [adler[i] for i in indexes])
+                          .tostring())
+        except IndexError:
+            return None
+        if tail:
+            digest.update(self.volume.read_cluster(clusters[whole])[:tail])
+        return digest.digest()
+
+    def get_dirent_key(self, dirent):
+        """Identifies the content of a file found through the file allocation
+        table or by the orphan scanner, whose clusters are taken to follow one
+        another.
+
+        Returns (str): Digest of the content, or None if it is unknown.
+        """
+        volume = self.volume
+        if not dirent.is_file() or dirent.first_cluster == 0 or \
+                not volume.is_valid_cluster(dirent.first_cluster):
+            return None
+        if isinstance(dirent, FatXOrphan):
+            count = -(-dirent.file_size // volume.bytes_per_cluster)
+            clusters = range(dirent.first_cluster, dirent.first_cluster + count)
+        else:
+            clusters = volume.get_cluster_chain(dirent.first_cluster)
+        return self.get_file_key(clusters, dirent.file_size)
+
+    def get_tree_keys(self, dirents, undelete=False):
+        """Identifies the content of every file in a tree.
+
+        Args:
+            dirents (FatXDirent[]): Dirents at the root of the tree.
+            undelete (bool): Whether to include deleted files.
+
+        Returns (generator): (dirent, key) of each file whose content is
+            known.
+        """
+        stack = list(reversed(dirents))
+        while stack:
+            dirent = stack.pop()
+            if dirent.is_deleted() and not undelete:
+                continue
+            if dirent.is_directory():
+                stack.extend(reversed(dirent.children))
+                continue
+            key = self.get_dirent_key(dirent)
+            if key is not None:
+                yield dirent, key
+
+
+class FatXDeduplicator(object):
+    """Remembers the content extracted so far, so that files with the same
+    content are only written once.
+
+    Args:
+        hashes (FatXClusterHashes): Hashes of the volume being extracted.
+        mode (str): DEDUPE_LINK to hard link duplicates to the file first
+            extracted, or DEDUPE_SKIP to leave them out.
+    """
+    def __init__(self, hashes, mode=DEDUPE_LINK):
+        self.hashes = hashes
+        self.mode = mode
+        self.extracted = {}     # key -> (path, manifest entry)
+        self.duplicates = 0
+        self.bytes_saved = 0
+
+    def get_key(self, dirent):
+        """Returns (str): Key of a dirent's content, or None if it is
+        unknown."""
+        return self.hashes.get_dirent_key(dirent)
+
+    def add(self, key, path, entry=None):
+        """Records that content was extracted to path."""
+        if key is not None:
+            self.extracted[key] = (path, entry)
+
+    def _is_same_content(self, path, dirent):
+        """Compares a file already extracted with a dirent's data byte for
+        byte."""
+        try:
+            with open(path, 'rb') as f:
+                for data in dirent.iter_data():
+                    if f.read(len(data)) != data:
+                        return False
+                return f.read(1) == ''
+        except (OSError, IOError):
+            return False
+
+    def write_duplicate(self, key, path, dirent, manifest=None):
+        """Links or skips a file whose content was already extracted.
+
+        Args:
+            key (str): Key of the file's content.
+            path (str): Path the file would be extracted to.
+            dirent (FatXDirent): The file.
+            manifest (FatXManifest): Records a linked duplicate with the
+                hashes of the original.
+
+        Returns (bool): Whether the file was a duplicate and was handled.
+        """
+        if key is None:
+            return False
+        original = self.extracted.get(key)
+        if original is None:
+            return False
+
+        original_path, entry = original
+        # equal keys only make equal content likely
+        if not self._is_same_content(original_path, dirent):
+            LOG.warning('%s has the key of %s but not its content, writing '
+                        'a copy.', path, original_path)
+            self.hashes.volume.metrics.count('duplicates_mismatched')
+            return False
+
+        if self.mode == DEDUPE_LINK:
+            try:
+                os.link(original_path, path)
+            except (OSError, IOError, AttributeError):
+                LOG.warning('Could not link %s to %s, writing a copy.',
+                            path, original_path)
+                return False
+            if manifest is not None:
+                manifest.add_duplicate(path, entry, dirent)
+        self.duplicates += 1
+        self.bytes_saved += dirent.file_size
+        self.hashes.volume.metrics.count('duplicates_' + self.mode)
+        return True
@@ -0,0 +1,180 @@
+import logging
+import array
+
+
+LOG = logging.getLogger('FATX.Analyzer')
+
+# Number of bytes compared at once before narrowing down to single entries.
+COMPARE_BLOCK_SIZE = 0x10000
+
+# What a file was found to be in the newer volume.
+DIFF_ADDED = 'added'
+DIFF_REMOVED = 'removed'
+DIFF_MODIFIED = 'modified'
+
+
+def get_changed_indexes(old, new, itemsize, block_size=COMPARE_BLOCK_SIZE):
+    """Finds the items that differ between two packed arrays.
+
+    Whole blocks are compared first, so only blocks that differ are looked at
+    item by item. Items past the end of the shorter array count as changed.
+
+    Args:
+        old (str): Packed items of the first array.
+        new (str): Packed items of the second array.
+        itemsize (int): Size of each item.
+        block_size (int): Bytes compared at once, a multiple of itemsize.
+
+    Returns (int[]): Indexes of the items that differ.
+    """
+    changed = []
+    length = min(len(old), len(new))
+    for start in xrange(0, length, block_size):
+        end = min(start + block_size, length)
+        if old[start:end] == new[start:end]:
+            continue
+        for offset in xrange(start, end, itemsize):
+            if old[offset:offset + itemsize] != new[offset:offset + itemsize]:
+                changed.append(offset // itemsize)
+    changed.extend(xrange(length // itemsize,
+                          max(len(old), len(new)) // itemsize))
+    return changed
+
+
+def _pack_fat(volume):
+    return array.array('H' if volume.fat16x else 'I',
+                       volume.file_allocation_table).tostring()
+
+
+class FatXDiff(object):
+    """Compares two images of the same volume, such as before and after an
+    event, and finds the files added, removed and modified.
+
+    The file allocation tables are compared first. Files keep their path, so
+    a file is modified if its dirent changed, or if any cluster of its chain
+    has a different FAT entry or, when cluster hashes are given, different
+    content. Only the clusters of files whose dirents are unchanged are
+    looked up, and no file data is read.
+
+    Args:
+        old (FatXVolume): Mounted volume of the earlier image.
+        new (FatXVolume): Mounted volume of the later image.
+        old_hashes (FatXClusterHashes): Cluster hashes of the earlier volume.
+        new_hashes (FatXClusterHashes): Cluster hashes of the later volume.
+            Content is only compared if both are given.
+        undelete (bool): Whether to include files marked as deleted.
+    """
+    def __init__(self, old, new, old_hashes=None, new_hashes=None,
+                 undelete=False):
+        if old.bytes_per_cluster != new.bytes_per_cluster:
+            raise ValueError("Volumes have different cluster sizes.")
+        self.old = old
+        self.new = new
+        self.old_hashes = old_hashes
+        self.new_hashes = new_hashes
+        self.undelete = undelete
+        self.changed_fat_entries = []
+        self.changed_clusters = []
+
+    def compare_fats(self):
+        """Returns (int[]): Clusters whose FAT entries differ."""
+        entry_size = 2 if self.new.fat16x else 4
+        with self.new.metrics.phase('diff_fat'):
+            self.changed_fat_entries = get_changed_indexes(
+                _pack_fat(self.old), _pack_fat(self.new), entry_size)
+        return self.changed_fat_entries
+
+    def compare_clusters(self):
+        """Returns (int[]): Clusters whose content differs, by their hashes."""
+        if self.old_hashes is None or self.new_hashes is None:
+            return []
+        with self.new.metrics.phase('diff_clusters'):
+            changed = set(get_changed_indexes(
+                self.old_hashes.crc.tostring(),
+                self.new_hashes.crc.tostring(), 4))
+            changed.update(get_changed_indexes(
+                self.old_hashes.adler.tostring(),
+                self.new_hashes.adler.tostring(), 4))
+            self.changed_clusters = sorted(index + 1 for index in changed)
+        return self.changed_clusters
+
+    def _get_files(self, volume):
+        files = {}
+        stack = list(reversed(volume.get_root()))
+        while stack:
+            dirent = stack.pop()
+            if dirent.is_deleted() and not self.undelete:
+                continue
+            path = dirent.get_full_path()
+            # a live file takes the place of a deleted one of the same name
+            if path not in files or files[path].is_deleted():
+                files[path] = dirent
+            if dirent.is_directory():
+                stack.extend(reversed(dirent.children))
+        return files
+
+    def _get_changed_dirent_fields(self, old, new):
+        changed = []
+        if old.file_size != new.file_size:
+            changed.append('size')
+        if old.file_attributes != new.file_attributes:
+            changed.append('attributes')
+        if old.first_cluster != new.first_cluster:
+            changed.append('first_cluster')
+        if old.last_write_time_i != new.last_write_time_i:
+            changed.append('last_write_time')
+        if old.file_name_length != new.file_name_length:
+            changed.append('deleted')
+        return changed
+
+    def _touches(self, dirent, clusters):
+        """Whether the chain of a file in the newer volume goes through any
+        of clusters."""
+        if dirent.first_cluster in clusters:
+            return True
+        if dirent.first_cluster == 0 or \
+                not self.new.is_valid_cluster(dirent.first_cluster):
+            return False
+        for cluster in self.new.get_cluster_chain(dirent.first_cluster):
+            if cluster in clusters:
+                return True
+        return False
+
+    def compare(self):
+        """Compares the two volumes.
+
+        Returns (generator): (change, path, reasons) of each file that
+            differs, where change is DIFF_ADDED, DIFF_REMOVED or
+            DIFF_MODIFIED and reasons lists what was found to differ.
+        """
+        fat_changes = set(self.compare_fats())
+        content_changes = set(self.compare_clusters())
+        LOG.info('%d FAT entries and %d clusters differ.',
+                 len(fat_changes), len(content_changes))
+
+        with self.new.metrics.phase('diff_tree'):
+            old_files = self._get_files(self.old)
+            new_files = self._get_files(self.new)
+
+        for path in sorted(old_files):
+            if path not in new_files:
+                yield DIFF_REMOVED, path, []
+
+        for path in sorted(new_files):
+            new = new_files[path]
+            old = old_files.get(path)
+            if old is None:
+                yield DIFF_ADDED, path, []
+                continue
+            # directory clusters change whenever what they hold does
+            if new.is_directory():
+                continue
+
+            reasons = self._get_changed_dirent_fields(old, new)
+            if not reasons:
+                if fat_changes and self._touches(new, fat_changes):
+                    reasons.append('chain')
+                if content_changes and self._touches(new, content_changes):
+                    reasons.append('content')
+            if reasons:
+                yield DIFF_MODIFIED, path, reasons
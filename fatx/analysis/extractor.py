@@ -0,0 +1,103 @@
+from threading import Thread
+from Queue import Queue
+import logging
+import os
+
+
+LOG = logging.getLogger('FATX.Analyzer')
+
+
+class FatXExtractor(object):
+    """Recovers carved signatures on worker threads while the search goes on.
+
+    Signatures are submitted as they are found and written out by a pool of
+    threads. Each thread reads through its own handle to the image so that
+    they do not disturb the handle that the carver is searching with. The
+    queue between them is bounded, so when writing falls behind the search
+    blocks instead of piling up signatures in memory.
+
+    Args:
+        volume (FatXVolume): Volume that signatures are recovered from.
+        path (str): Directory to recover signatures into.
+        workers (int): Number of threads to recover with. With zero threads,
+            signatures are recovered as they are submitted.
+        queue_size (int): Maximum number of signatures waiting to be written.
+        progress (FatXProgress): Reports each signature written, from the
+            first one submitted. It must not be shared with the carver, which
+            runs at the same time.
+        manifest (FatXManifest): Hashes each signature as it is written.
+    """
+    def __init__(self, volume, path, workers=1, queue_size=64,
+                 progress=None, manifest=None):
+        self.volume = volume
+        self.path = path
+        self.manifest = manifest
+        self.queue = Queue(queue_size)
+        self.threads = []
+        self.progress = progress
+        self._started = False
+
+        image_path = getattr(volume.infile, 'name', None)
+        if workers > 0 and \
+                (image_path is None or not os.path.isfile(image_path)):
+            LOG.warning('Image is not a regular file, recovering on the '
+                        'searching thread.')
+            workers = 0
+
+        for _ in xrange(workers):
+            thread = Thread(target=self._work, args=(image_path,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self, image_path):
+        with open(image_path, 'rb') as infile:
+            while True:
+                task = self.queue.get()
+                try:
+                    if task is None:
+                        return
+                    self._write(task, infile)
+                finally:
+                    self.queue.task_done()
+
+    def _write(self, task, infile=None):
+        signature, whole_path = task
+        try:
+            written = signature.write(whole_path, infile, self.manifest)
+        except Exception:
+            # a worker that dies leaves the search blocked on a full queue,
+            # and lengths from unverified headers can be anything
+            LOG.exception('Failed to recover: %s', whole_path)
+            return
+        if self.progress is not None:
+            self.progress.update(written, 1)
+
+    def submit(self, signature):
+        """Queues a signature to be recovered.
+
+        The file name is generated here so that names are handed out in the
+        order signatures were found. Blocks while the queue is full.
+
+        Args:
+            signature (FatXSignature): Parsed signature to recover.
+        """
+        task = (signature, self.path + '/' + signature.get_file_name())
+        # started here so that nothing is reported before there is anything
+        if self.progress is not None and not self._started:
+            self.progress.start('extract')
+            self._started = True
+        if self.threads:
+            self.queue.put(task)
+        else:
+            self._write(task)
+
+    def close(self):
+        """Waits for every queued signature to be recovered."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.progress is not None and self._started:
+            self.progress.finish()
@@ -1,10 +1,125 @@
+from fatx.filesystem.constants import FATX_SECTOR_SIZE
+
+import multiprocessing
 import logging
 import time
+import os
 
 
 LOG = logging.getLogger('FATX.Analyzer')
 
 
+# Amount of data read from the volume at a time while searching.
+SEARCH_WINDOW_SIZE = 0x1000000
+
+# Search the whole volume.
+SCOPE_ALL = 'all'
+# Only search clusters that are marked free in the file allocation table.
+SCOPE_UNALLOCATED = 'unallocated'
+
+# Magics aligned to at least this many bytes are looked up in a prefix table
+# at each aligned offset instead of being searched for.
+PREFIX_TABLE_ALIGNMENT = FATX_SECTOR_SIZE
+
+
+def find_magics(data, size, magics, base=0):
+    """Finds the start of every file in a window of data by its magic.
+
+    Args:
+        data (str): Window of data to search through.
+        size (int): Only files starting before this position are returned.
+            Anything after it is overlap that is searched with the next
+            window.
+        magics ((str, int, int)[]): For each magic to look for, the magic
+            itself, its offset within the file and the alignment that files
+            must start on.
+        base (int): Offset of the window, which alignment is relative to.
+
+    Returns ((int, int)[]): Position of each file found and the index of the
+        magic it was found by, sorted by position.
+    """
+    hits = []
+    prefix_tables = {}
+    for index, (magic, magic_offset, alignment) in enumerate(magics):
+        if alignment >= PREFIX_TABLE_ALIGNMENT:
+            prefix_tables.setdefault((magic_offset, alignment), []).append(
+                (magic, index))
+            continue
+
+        end = size + magic_offset + len(magic) - 1
+        position = data.find(magic, magic_offset, end)
+        while position != -1:
+            start = position - magic_offset
+            if (base + start) % alignment == 0:
+                hits.append((start, index))
+            position = data.find(magic, position + 1, end)
+
+    for (magic_offset, alignment), entries in prefix_tables.items():
+        prefix_length = min([len(magic) for magic, _ in entries])
+        table = {}
+        for magic, index in entries:
+            table.setdefault(magic[:prefix_length], []).append((magic, index))
+
+        for start in xrange(-base % alignment, size, alignment):
+            position = start + magic_offset
+            candidates = table.get(data[position:position + prefix_length])
+            if candidates is not None:
+                for magic, index in candidates:
+                    if data.startswith(magic, position):
+                        hits.append((start, index))
+
+    hits.sort()
+    return hits
+
+
+def get_stride(signature, interval=None):
+    """Returns (int): Distance between the offsets a signature is looked for
+    at.
+
+    An interval chosen by the user is used as is, even below the alignment
+    that the signature declares, so files that do not start where they are
+    expected to can still be found. Without one, each signature is looked for
+    at every boundary it declares.
+
+    Args:
+        signature (type): FatXSignature subclass.
+        interval (int): Interval chosen by the user, if any.
+
+    A XEX that does not start on a sector boundary is only found at an
+    interval of 1:
+
+    >>> from fatx.analysis.signatures.xex import XEXSignature
+    >>> data = 'x' * 0x123 + XEXSignature.MAGIC
+    >>> magics = [(XEXSignature.MAGIC, 0, get_stride(XEXSignature, 1))]
+    >>> find_magics(data, len(data), magics, 0x30000)
+    [(291, 0)]
+    >>> magics = [(XEXSignature.MAGIC, 0, get_stride(XEXSignature))]
+    >>> find_magics(data, len(data), magics, 0x30000)
+    []
+    """
+    if interval is not None:
+        return interval
+    return signature.ALIGNMENT
+
+
+# Image file handle owned by a search worker process.
+_worker_image = None
+
+
+def _open_worker_image(path):
+    """Opens a private handle to the image in each search worker process."""
+    global _worker_image
+    _worker_image = open(path, 'rb')
+
+
+def _search_worker_window(task):
+    """Reads and searches a single window from within a worker process."""
+    offset, window, size, overlap, magics = task
+    _worker_image.seek(offset + window)
+    data = _worker_image.read(size + overlap)
+    return window, size, find_magics(data, size, magics, window)
+
+
 class FatXCarver:
     def __init__(self, volume):
         self.volume = volume
@@ -15,34 +130,180 @@ class FatXCarver:
         """ List of found signatures. """
         return self.found_signatures
 
-    def perform_signature_analysis(self, signatures, interval=0x200, length=0):
-        """ Searches for file signatures. """
+    def search_windows(self, windows, magics, overlap, processes=1):
+        """Searches each window for magics, optionally across processes.
+
+        Each worker process opens its own handle to the image. Results are
+        yielded in window order no matter which worker finishes first.
+
+        Args:
+            windows ((int, int)[]): Offset and size of each window.
+            magics ((str, int, int)[]): Magics as accepted by find_magics().
+            overlap (int): Bytes read past the end of each window.
+            processes (int): Number of worker processes to search with.
+
+        Returns: Generator of the offset and size of each window along with
+            the hits found in it.
+        """
+        path = getattr(self.volume.infile, 'name', None)
+        if processes > 1 and magics:
+            if path is not None and os.path.isfile(path):
+                offset = self.volume.byte_offset_to_physical_offset(
+                    self.volume.file_area_byte_offset)
+                tasks = ((offset, window, size, overlap, magics)
+                         for window, size in windows)
+                pool = multiprocessing.Pool(processes, _open_worker_image,
+                                            (path,))
+                try:
+                    for result in pool.imap(_search_worker_window, tasks):
+                        yield result
+                finally:
+                    pool.terminate()
+                    pool.join()
+                return
+            LOG.warning('Image is not a regular file, searching with a '
+                        'single process.')
+
+        for window, size in windows:
+            self.volume.seek_file_area(window)
+            data = self.volume.infile.read(size + overlap)
+            yield window, size, find_magics(data, size, magics, window)
+
+    def get_search_ranges(self, length, scope=SCOPE_ALL):
+        """Returns the ranges of the volume that a search should cover.
+
+        Args:
+            length (int): Only offsets below this are searched.
+            scope (str): SCOPE_ALL or SCOPE_UNALLOCATED.
+
+        Returns ((int, int)[]): Start and end offset of each range, relative
+            to the file area.
+        """
+        if scope == SCOPE_ALL:
+            return [(0, length)]
+
+        if scope != SCOPE_UNALLOCATED:
+            raise ValueError("Valid scopes are {} or {}.".format(
+                SCOPE_ALL, SCOPE_UNALLOCATED))
+
+        if self.volume.file_allocation_table is None:
+            raise ValueError("Volume must be mounted to search unallocated "
+                             "clusters.")
+
+        ranges = []
+        bytes_per_cluster = self.volume.bytes_per_cluster
+        for cluster, count in self.volume.get_free_cluster_runs():
+            start = (cluster - 1) * bytes_per_cluster
+            end = min(start + (count * bytes_per_cluster), length)
+            if start >= length:
+                break
+            ranges.append((start, end))
+        return ranges
+
+    def perform_signature_analysis(self, signatures, interval=None, length=0,
+                                   processes=1, scope=SCOPE_ALL,
+                                   callback=None, progress=None):
+        """ Searches for file signatures.
+
+        The volume is read in large windows which are searched for the magic
+        of every signature at once. Signatures are only parsed where their
+        magic was found. Signatures that do not declare a magic are tested at
+        every interval instead. Without an interval, each signature is looked
+        for at the alignment it declares.
+
+        Windows can be searched by several processes at once. Signatures are
+        still parsed in offset order by this process, so the names generated
+        for them do not depend on worker scheduling.
+
+        With SCOPE_UNALLOCATED only runs of free clusters are searched, which
+        skips data belonging to files that can be recovered conventionally.
+
+        If a callback is given, it is called with each signature as soon as
+        it has been parsed, e.g. FatXExtractor.submit to recover signatures
+        while the search continues.
+
+        If a FatXProgress is given, it reports each window searched.
+        """
         LOG.info('signature analysis has begun...')
         # Lets be reasonable
         # BYTE_SIZE    = 0x1     # very slow, you must be desperate?
         # SECTOR_SIZE  = 0x200   # slow, very effective
         # PAGE_SIZE    = 0x1000  # moderate speed, less effective
         # CLUSTER_SIZE = 0x4000  # high speed, least effective
-        if interval not in (1, 0x200, 0x1000, 0x4000):
-            return ValueError(
+        if interval not in (None, 1, 0x200, 0x1000, 0x4000):
+            raise ValueError(
                 "Valid intervals are 1, 0x200, 0x1000, or 0x4000.")
 
         if length == 0 or length > self.volume.length:
             length = self.volume.length
+        # only offsets that are a multiple of interval get tested
+        if interval is not None:
+            length -= length % interval
+
+        # signatures found at the same offset keep the order they were given
+        magics = []
+        owners = []
+        untested = []
+        for order, signature in enumerate(signatures):
+            alignment = get_stride(signature, interval)
+            if signature.MAGIC is None:
+                untested.append((order, signature, alignment))
+            else:
+                magics.append((signature.MAGIC,
+                               signature.MAGIC_OFFSET,
+                               alignment))
+                owners.append((order, signature))
+
+        # magics may extend past the end of a window
+        overlap = max([len(magic) + magic_offset
+                       for magic, magic_offset, _ in magics] or [1]) - 1
+
+        windows = []
+        for start, end in self.get_search_ranges(length, scope):
+            for window in xrange(start, end, SEARCH_WINDOW_SIZE):
+                windows.append((window, min(SEARCH_WINDOW_SIZE, end - window)))
+
+        metrics = self.volume.metrics
+        if progress is not None:
+            progress.start('carve',
+                           total_bytes=sum(size for _, size in windows))
 
         time0 = time.time()
-        for index in xrange(length / interval):
-            self.current_block = index
-            offset = index * interval
-            for signature in signatures:
-                test = signature(offset, self.volume)
-                # seek to test the data
-                self.volume.seek_file_area(offset)
-                if test.test():
-                    # seek to parse the data
+        with metrics.phase('carve'):
+            for window, size, hits in self.search_windows(windows, magics,
+                                                          overlap, processes):
+                self.current_block = window // (interval or 1)
+                metrics.count('bytes_searched', size)
+
+                found = []
+                for position, index in hits:
+                    order, signature = owners[index]
+                    found.append((window + position, order, signature))
+
+                for order, signature, alignment in untested:
+                    for offset in xrange(window + (-window % alignment),
+                                         window + size, alignment):
+                        test = signature(offset, self.volume)
+                        # signatures may also read the handle directly
+                        self.volume.seek_file_area(offset)
+                        if test.test():
+                            found.append((offset, order, signature))
+
+                found.sort()
+                for offset, _, signature in found:
+                    test = signature(offset, self.volume)
                     self.volume.seek_file_area(offset)
                     test.parse()
                     self.found_signatures.append(test)
+                    metrics.count('signatures_found')
                     LOG.info(str(test))
+                    if callback is not None:
+                        callback(test)
+
+                if progress is not None:
+                    progress.update(size, len(found))
+
+            if progress is not None:
+                progress.finish()
         time1 = time.time()
         LOG.info('analysis finished in %s', time1 - time0)
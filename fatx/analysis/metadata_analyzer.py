@@ -1,5 +1,7 @@
-from .orphan import FatXOrphan
+from .orphan import FatXOrphan, is_valid_file_name
+from fatx.filesystem.table import FatXDirentTable
 
+from datetime import date
 import logging
 import time
 import json
@@ -33,36 +35,79 @@ class FatXAnalyzer:
         """ Roots contains a list of linked orphans. """
         return self.roots
 
-    def perform_orphan_analysis(self, max_clusters=0):
-        """ Searches for FatXDirent structures. """
+    def get_table(self, use_numpy=True):
+        """ Metadata of every linked orphan as a table.
+
+        Args:
+            use_numpy (bool): Whether to use NumPy if it is installed.
+
+        Returns (FatXDirentTable):
+        """
+        with self.volume.metrics.phase('table_build'):
+            return FatXDirentTable.from_dirents(
+                self.roots, self.volume.ts_format.EPOCH, use_numpy)
+
+    def perform_orphan_analysis(self, max_clusters=0, progress=None):
+        """ Searches for FatXDirent structures.
+
+        Args:
+            max_clusters (int): Number of clusters to search through.
+            progress (FatXProgress): Reports the search and the linking.
+        """
         LOG.info('Orphan analysis has begun...')
         time0 = time.time()
-        self.recover_orphans(max_clusters)
+        self.recover_orphans(max_clusters, progress)
         time1 = time.time()
         LOG.info('Linking orphans...')
 
         # give them a home
         time2 = time.time()
-        self.link_orphans()
+        self.link_orphans(progress)
         time3 = time.time()
         LOG.info('and done. :)')
         LOG.info('Time to analyze partition: %i seconds', time1 - time0)
         LOG.info('Time to rebuild directories: %i seconds', time3 - time2)
 
     # TODO: optimize file reading
-    def recover_orphans(self, max_clusters=0):
+    def recover_orphans(self, max_clusters=0, progress=None):
         """ Begin search for orphaned dirents. """
+        with self.volume.metrics.phase('orphan_scan'):
+            self._recover_orphans(max_clusters, progress)
+
+    def _recover_orphans(self, max_clusters, progress):
         orphans = []
         if (max_clusters > self.volume.max_clusters or max_clusters == 0):
             max_clusters = self.volume.max_clusters
 
+        bytes_per_cluster = self.volume.bytes_per_cluster
+        if progress is not None:
+            progress.start('orphan_scan',
+                           total_bytes=(max_clusters - 1) * bytes_per_cluster)
+
+        # time stamps from the future are invalid
+        max_year = date.today().year
+
+        # Candidates surviving each check, counted in locals to keep the loop
+        # fast. Rejections per check are worked out from these at the end.
+        slots = 0
+        attributes_ok = 0
+        used_ok = 0
+        length_ok = 0
+        name_ok = 0
+        rejected = {}
+        found = 0
+
         for cluster in range(1, max_clusters):
             self.current_block = cluster
+            if progress is not None:
+                progress.update(bytes_per_cluster, len(orphans) - found)
+                found = len(orphans)
             cache = self.volume.read_cluster(cluster)
             if len(cache) != 0x4000:
                 LOG.warn("Failed to read cluster %i" % cluster)
                 continue
 
+            slots += 256
             for x in range(256):
                 offset = x * 0x40
 
@@ -72,18 +117,26 @@ class FatXAnalyzer:
                 # file attributes must be file or directory
                 if cache[offset+1] not in ('\x00', '\x10'):
                     continue
+                attributes_ok += 1
 
                 # DIRENT_NEVER_USED and DIRENT_NEVER_USED2
                 if name_len in ('\x00', '\x01', '\xff'):
                     continue
+                used_ok += 1
 
                 # if file is not deleted, ensure name length is less than max
                 if name_len != '\xE5' and name_len > '\x2A':
                     continue
+                length_ok += 1
+
+                if not is_valid_file_name(cache[offset+2:offset+0x2C]):
+                    continue
+                name_ok += 1
 
                 dirent = FatXOrphan(cache[offset:offset+0x40], self.volume)
 
-                if dirent.is_valid():
+                reason = dirent.get_invalid_reason(max_year)
+                if reason is None:
                     offset = self.volume.cluster_to_physical_offset(cluster) \
                              + offset
                     LOG.info("%#x: %s (cluster %i)",
@@ -91,6 +144,23 @@ class FatXAnalyzer:
                     dirent.set_cluster(cluster)
                     dirent.set_offset(offset)
                     orphans.append(dirent)
+                else:
+                    rejected[reason] = rejected.get(reason, 0) + 1
+
+        if progress is not None:
+            progress.update(0, len(orphans) - found)
+            progress.finish()
+
+        metrics = self.volume.metrics
+        metrics.count('dirent_candidates', slots)
+        metrics.count('dirents_decoded', name_ok)
+        metrics.count('orphans_found', len(orphans))
+        metrics.reject('attributes', slots - attributes_ok)
+        metrics.reject('never_used', attributes_ok - used_ok)
+        metrics.reject('file_name_length', used_ok - length_ok)
+        metrics.reject(FatXOrphan.RULE_FILE_NAME, length_ok - name_ok)
+        for reason, count in rejected.items():
+            metrics.reject(reason, count)
 
         self.orphanage = orphans
 
@@ -118,11 +188,23 @@ class FatXAnalyzer:
                     LOG.warning('%s already has a parent!', orphan.file_name)
                 orphan.set_parent(parent)
 
-    def link_orphans(self):
+    def link_orphans(self, progress=None):
         """ Link parent directories with their children. """
+        with self.volume.metrics.phase('link'):
+            self._link_orphans(progress)
+
+    def _link_orphans(self, progress):
+        if progress is not None:
+            progress.start('link', total_items=len(self.orphanage))
+
         for orphan in self.orphanage:
             if orphan.is_directory():
                 self.find_children(orphan)
+            if progress is not None:
+                progress.update(0, 1)
+
+        if progress is not None:
+            progress.finish()
 
         # find root directories
         for orphan in self.orphanage:
@@ -1,7 +1,8 @@
 from fatx.filesystem.dirent import FatXDirent
-from fatx.filesystem.constants import VALID_FILE_ATTRIBUTES
+from fatx.filesystem.timestamp import is_valid_time_stamp
+from fatx.filesystem.transfer import copy_extents, FatXSparseFile
 
-from datetime import date, datetime
+from datetime import date
 import logging
 import string
 import os
@@ -15,61 +16,81 @@ VALID_CHARS = set(string.ascii_letters +
                   '!#$%&\'()-.@[]^_`{}~ ' +
                   '\xff')
 
+# Maps every byte to '\x00' if it is allowed in a file name, '\x01' otherwise.
+FILE_NAME_TABLE = ''.join('\x00' if chr(c) in VALID_CHARS else '\x01'
+                          for c in range(256))
+
+
+def is_valid_file_name(file_name_bytes):
+    """Checks that every byte of a raw file name is a valid character.
+
+    Args:
+        file_name_bytes (str): The 42 file name bytes of a dirent.
+
+    Returns (bool):
+    """
+    return '\x01' not in file_name_bytes.translate(FILE_NAME_TABLE)
+
 
 class FatXOrphan(FatXDirent):
     """Representation of a dirent that has been been recovered by the analyzer.
     This class contains unconventional methods used to operate on recovered
     dirents.
     """
+    __slots__ = ('cluster', 'offset')
+
+    # Validation rules, in the order they are checked.
+    RULE_FIRST_CLUSTER = 'first_cluster'
+    RULE_FILE_NAME = 'file_name'
+    RULE_NO_TIME_STAMP = 'no_time_stamp'
+    RULE_TIME_STAMP = 'time_stamp'
+
     # @profile
-    def is_valid(self):
-        """Checks if this recovered dirent is actually valid."""
+    def get_invalid_reason(self, max_year=None):
+        """Checks if this recovered dirent is actually valid.
+
+        Args:
+            max_year (int): Latest year a time stamp may hold. Defaults to the
+                current year. Scans should compute this once and pass it in.
+
+        Returns (str): The first rule this dirent breaks, or None if it is
+            valid.
+        """
         # TODO: some valid dirents have invalid cluster indexes
         # TODO: warn user that the file will undoubtedly be corrupted
         # check if it points outside of the partition
         if self.first_cluster > self.volume.max_clusters:
-            return False
+            return self.RULE_FIRST_CLUSTER
 
         # validate file name bytes
-        if not all(c in VALID_CHARS for c in self.file_name_bytes):
-            return False
-
-        def is_valid_attributes(attr):
-            return (attr & ~VALID_FILE_ATTRIBUTES) == 0
+        if not is_valid_file_name(self.file_name_bytes):
+            return self.RULE_FILE_NAME
 
-        def is_valid_date(dt):
-            if dt is None:
-                # There has to be a date defined.
-                return False
+        # There has to be a date defined.
+        if self.is_end_of_stream():
+            return self.RULE_NO_TIME_STAMP
 
-            year = dt.year
+        if max_year is None:
+            max_year = date.today().year
 
-            if not (year <= date.today().year):
-                return False
+        # validate file time stamps
+        # TODO: check its not from the future
+        epoch = self.volume.ts_format.EPOCH
+        if (not is_valid_time_stamp(self.creation_time_i, epoch, max_year) or
+            not is_valid_time_stamp(self.last_write_time_i, epoch, max_year) or
+            not is_valid_time_stamp(self.last_access_time_i, epoch, max_year)):
+            return self.RULE_TIME_STAMP
 
-            # validate date
-            # TODO: check its not from the future
-            try:
-                datetime(
-                    year=year,
-                    month=dt.month,
-                    day=dt.day,
-                    hour=dt.hour,
-                    minute=dt.min,
-                    second=dt.sec
-                )
-            except ValueError:
-                return False
-
-            return True
+        return None
 
-        # validate file time stamps
-        if (not is_valid_date(self.creation_time) or
-            not is_valid_date(self.last_write_time) or
-            not is_valid_date(self.last_access_time)):
-            return False
+    def is_valid(self, max_year=None):
+        """Checks if this recovered dirent is actually valid.
 
-        return True
+        Args:
+            max_year (int): Latest year a time stamp may hold. Defaults to the
+                current year.
+        """
+        return self.get_invalid_reason(max_year) is None
 
     def set_cluster(self, cluster):
         """ This dirent resides in this cluster. """
@@ -82,7 +103,23 @@ class FatXOrphan(FatXDirent):
     def rescue_dir(self, path):
         pass
 
-    def recover(self, path):
+    def get_extents(self):
+        """Finds this file's data in the clusters following its first one,
+        since the file allocation table cannot be relied on.
+
+        Returns ((int, int)[]): Offset into the image and length of the data,
+            less than the file size if the image ends first.
+        """
+        offset = self.volume.cluster_to_physical_offset(self.first_cluster)
+        infile = self.volume.infile
+        infile.seek(0, 2)
+        length = max(0, min(self.file_size, infile.tell() - offset))
+        if length == 0:
+            return []
+        return [(offset, length)]
+
+    def recover(self, path, progress=None, manifest=None, dedupe=None,
+                sparse=True):
         """Extracts the file unconventionally by dumping sequential clusters
         since we cannot rely on the file allocation table.
 
@@ -90,9 +127,22 @@ class FatXOrphan(FatXDirent):
 
         Args:
             path (str): Output path.
+            progress (FatXProgress): Reports each file written and the bytes
+                copied for it. The caller starts and finishes the task.
+            manifest (FatXManifest): Hashes each file as it is written.
+            dedupe (FatXDeduplicator): Links or skips files whose content
+                was already extracted.
+            sparse (bool): Whether to leave blocks of zeros as holes. If not,
+                the kernel copies files straight from the image.
         """
         whole_path = path + '/' + self.file_name
-        self.volume.seek_to_cluster(self.first_cluster)
+        key = None
+        if dedupe is not None and self.is_file():
+            key = dedupe.get_key(self)
+            if dedupe.write_duplicate(key, whole_path, self, manifest):
+                if progress is not None:
+                    progress.update(0, 1)
+                return
         LOG.info('Recovering: %r', whole_path)
         if self.is_directory():
             if not os.path.exists(whole_path):
@@ -102,18 +152,22 @@ class FatXOrphan(FatXDirent):
                     LOG.exception('Failed to create directory: %s', whole_path)
                     return
             for dirent in self.children:
-                dirent.recover(whole_path)
+                dirent.recover(whole_path, progress, manifest, dedupe, sparse)
         else:
             try:
-                bufsize = 0x100000
-                remains = self.file_size
-
-                with open(whole_path, 'wb') as f:
-                    while remains > 0:
-                        read = min(remains, bufsize)
-                        remains -= read
-                        buf = self.volume.infile.read(read)
-                        f.write(buf)
+                if manifest is not None:
+                    f = manifest.open(whole_path, self)
+                elif sparse:
+                    f = FatXSparseFile(open(whole_path, 'wb'))
+                else:
+                    f = open(whole_path, 'wb')
+                with f:
+                    written = copy_extents(self.volume.infile,
+                                           self.get_extents(), f)
+                if dedupe is not None:
+                    dedupe.add(key, whole_path, getattr(f, 'entry', None))
+                if progress is not None:
+                    progress.update(written, 1)
             except (OSError, IOError, OverflowError):
                 LOG.exception('Failed to create file: %s', whole_path)
         try:
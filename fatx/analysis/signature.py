@@ -1,18 +1,34 @@
+from fatx.filesystem.constants import FATX_PAGE_SIZE
+from fatx.filesystem.transfer import copy_range
+
 import struct
 
 
+# Amount of data read from the start of a file for parsing its header. Reads
+# beyond this go to the volume instead.
+HEADER_WINDOW_SIZE = FATX_PAGE_SIZE
+
+
 class FatXSignature(object):
     """Base class used to create a file carving signature.
 
      To create a new signature, you must create a new class inheriting
-     FatXSignature. It is required that your new class implements both test()
-     and parse() methods.
+     FatXSignature. It is required that your new class implements parse() and
+     either declares MAGIC or implements test().
+
+     MAGIC holds the bytes that the file format can be identified by and
+     MAGIC_OFFSET is where they are found relative to the start of the file.
+     ALIGNMENT is the smallest boundary that files of this format are expected
+     to start on. It is only the default stride, an interval chosen by the
+     user replaces it. Declaring these lets the carver search for every
+     signature at once and only create signatures where their magic was
+     found.
 
      The test() method should check whether or not the data it is trying to
-     read does indeed contain the file format that should be looked for. An
-     example would be checking if the data contains a file's magic. If it is
-     suspected  to contain this type of file, then you would return True,
-     otherwise return False.
+     read does indeed contain the file format that should be looked for. By
+     default it checks for MAGIC. Only override it if the file format cannot
+     be identified by a magic. If it is suspected to contain this type of
+     file, then you would return True, otherwise return False.
 
      The parse() method is called after and only if test() returns True. This
      method handles reading the data in order to gain more information from it.
@@ -23,10 +39,21 @@ class FatXSignature(object):
      the length it has, e.g. zero length files will still be dumped, just as
      empty files.
 
+     Both methods should use seek() and the read methods of this class. The
+     first HEADER_WINDOW_SIZE bytes of the file are read once and parsed from
+     memory, only data beyond them is read from the volume. The volume's
+     handle is still positioned at the start of the file before test() and
+     parse() are called, so a signature may read it directly from there.
+     seek() only moves the position of the read methods, not the handle.
+
     Args:
         offset (int): offset into a volume that we will check
         volume (FatXVolume): volume we are searching through
     """
+    MAGIC = None
+    MAGIC_OFFSET = 0
+    ALIGNMENT = 1
+
     def __init__(self, offset, volume):
         self.length = 0
         self.name = None
@@ -34,19 +61,41 @@ class FatXSignature(object):
         self._endian = volume.endian_fmt
         self._offset = offset
         self._volume = volume
+        self._header = None
+        self._position = 0
 
     def test(self):
         """Test whether or not data at self.offset contains this file."""
-        raise NotImplementedError("Signature test not implemented!")
+        if self.MAGIC is None:
+            raise NotImplementedError("Signature test not implemented!")
+        self.seek(self.MAGIC_OFFSET)
+        return self.read(len(self.MAGIC)) == self.MAGIC
 
     def parse(self):
         """Extract required information from the file's format."""
         raise NotImplementedError("Signature parsing not implemented!")
 
     def seek(self, offset, whence=0):
-        """Seeks relative to the start of where we are searching from."""
-        offset += self._offset
-        self._volume.seek_file_area(offset, whence)
+        """Seeks relative to the start of where we are searching from.
+
+        Args:
+            offset (int): Offset to seek to.
+            whence (int): 0 to seek from the start of the file or 1 to seek
+                from the current position.
+        """
+        if whence == 1:
+            offset += self._position
+        elif whence != 0:
+            raise ValueError("Can only seek from the start or the current "
+                             "position.")
+        self._position = offset
+
+    def get_header(self):
+        """Returns the header window, reading it on first use."""
+        if self._header is None:
+            self._volume.seek_file_area(self._offset)
+            self._header = self._volume.infile.read(HEADER_WINDOW_SIZE)
+        return self._header
 
     def read(self, size):
         """Read data from the volume.
@@ -54,40 +103,70 @@ class FatXSignature(object):
         Args:
             size (int): How many bytes to read.
         """
+        header = self.get_header()
+        position = self._position
+        self._position += size
+        if position + size <= len(header):
+            self._volume.metrics.count('header_cache_hits')
+            return header[position:position + size]
+
+        # this is beyond the header window
+        self._volume.metrics.count('header_cache_misses')
+        self._volume.seek_file_area(self._offset + position)
         return self._volume.infile.read(size)
 
+    def _unpack(self, fmt, size):
+        """Unpacks a single value, straight from the header window if it is
+        inside of it."""
+        header = self.get_header()
+        position = self._position
+        if position + size <= len(header):
+            self._position += size
+            self._volume.metrics.count('header_cache_hits')
+            return struct.unpack_from(self._endian + fmt, header, position)[0]
+        return struct.unpack(self._endian + fmt, self.read(size))[0]
+
     def read_u8(self):
         """Utility method for reading a single Byte."""
-        return struct.unpack(self._endian + 'B', self.read(1))[0]
+        return self._unpack('B', 1)
 
     def read_u16(self):
         """Utility method for reading a single UInt16."""
-        return struct.unpack(self._endian + 'H', self.read(2))[0]
+        return self._unpack('H', 2)
 
     def read_u32(self):
         """Utility method for reading a single UInt32."""
-        return struct.unpack(self._endian + 'I', self.read(4))[0]
+        return self._unpack('I', 4)
 
     def read_u64(self):
         """Utility method for reading a single UInt64."""
-        return struct.unpack(self._endian + 'Q', self.read(8))[0]
+        return self._unpack('Q', 8)
 
     def read_float(self):
         """Utility method for reading a single Float."""
-        return struct.unpack(self._endian + 'f', self.read(4))[0]
+        return self._unpack('f', 4)
 
     def read_double(self):
         """Utility method for reading a single Double."""
-        return struct.unpack(self._endian + 'd', self.read(8))[0]
+        return self._unpack('d', 8)
 
     def read_cstring(self):
         """Utility method for reading a null terminated C string."""
         s = []
+        start = self._position
         while True:
-            c = self.read(1)
-            if c == chr(0):
-                return "".join(s)
-            s.append(c)
+            data = self.read(0x100)
+            end = data.find(chr(0))
+            if end != -1:
+                s.append(data[:end])
+                break
+            s.append(data)
+            if len(data) < 0x100:
+                # end of the image
+                break
+        s = "".join(s)
+        self._position = start + len(s) + 1
+        return s
 
     def read_wstring(self):
         """Utility method for reading a null terminated Unicode string."""
@@ -125,17 +204,48 @@ class FatXSignature(object):
             self.__class__.Unnamed_Counter += 1
         return file_name
 
-    def recover(self, path):
+    def write(self, path, infile=None, manifest=None):
+        """Dumps the file's data to path.
+
+        The data is streamed in chunks so that memory use stays constant no
+        matter what length the header claims.
+
+        Args:
+            path (str): Path of the file to create.
+            infile (file): Handle to the image to read from. Defaults to the
+                volume's handle. Threads that write while the volume is in use
+                must pass their own handle.
+            manifest (FatXManifest): Hashes the file as it is written.
+
+        Returns (int): Number of bytes written.
+        """
+        if infile is None:
+            infile = self._volume.infile
+
+        # lengths come from unverified headers, never read past the volume
+        start = self._volume.byte_offset_to_physical_offset(
+            self._volume.file_area_byte_offset + self._offset)
+        end = self._volume.byte_offset_to_physical_offset(self._volume.length)
+        length = max(0, min(self.length, end - start))
+
+        written = 0
+        if manifest is None:
+            f = open(path, 'wb')
+        else:
+            f = manifest.open(path, first_cluster=self._volume.
+                              byte_offset_to_cluster(self._offset))
+        with f:
+            if length != 0 and self.length < 0xffffffff:
+                written = copy_range(infile, start, length, f)
+        return written
+
+    def recover(self, path, manifest=None):
         """Unconventionally recovers the file. This will just read sequential
         data starting from where the file was suspected of starting.
         """
         file_name = self.get_file_name()
         whole_path = path + '/' + file_name
-        with open(whole_path, 'wb') as f:
-            if self.length != 0 and self.length < 0xffffffff:
-                self.seek(0)
-                data = self.read(self.length)
-                f.write(data)
+        self.write(whole_path, manifest=manifest)
 
     def __str__(self):
         return "{} at 0x{:x} of length 0x{:x}".format(self.__class__.__name__,
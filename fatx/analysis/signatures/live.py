@@ -1,11 +1,10 @@
 from ..signature import FatXSignature
+from fatx.filesystem.constants import FATX_SECTOR_SIZE
 
 
 class LiveSignature(FatXSignature):
-    def test(self):
-        if self.read(4) == 'LIVE':
-            return True
-        return False
+    MAGIC = 'LIVE'
+    ALIGNMENT = FATX_SECTOR_SIZE
 
     def parse(self):
         self.length = 0
\ No newline at end of file
@@ -1,12 +1,10 @@
 from ..signature import FatXSignature
+from fatx.filesystem.constants import FATX_SECTOR_SIZE
 
 
 class PDBSignature(FatXSignature):
-    def test(self):
-        magic = 'Microsoft C/C++ MSF 7.00\r\n\x1A\x44\x53\0\0\0'
-        if self.read(0x20) == magic:
-            return True
-        return False
+    MAGIC = 'Microsoft C/C++ MSF 7.00\r\n\x1A\x44\x53\0\0\0'
+    ALIGNMENT = FATX_SECTOR_SIZE
 
     def parse(self):
         self.set_endian('<')
@@ -2,10 +2,8 @@ from ..signature import FatXSignature
 
 
 class PESignature(FatXSignature):
-    def test(self):
-        if self.read(4) == 'MZ\x90\0':
-            return True
-        return False
+    MAGIC = 'MZ\x90\0'
+    ALIGNMENT = 1
 
     def parse(self):
         self.set_endian('<')
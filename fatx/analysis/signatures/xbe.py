@@ -1,12 +1,10 @@
 from ..signature import FatXSignature
+from fatx.filesystem.constants import FATX_SECTOR_SIZE
 
 
 class XBESignature(FatXSignature):
-    def test(self):
-        magic = self.read(4)
-        if magic == 'XBEH':
-            return True
-        return False
+    MAGIC = 'XBEH'
+    ALIGNMENT = FATX_SECTOR_SIZE
 
     def parse(self):
         # 0x104: BaseAddress
@@ -1,12 +1,11 @@
 from ..signature import FatXSignature
+from fatx.filesystem.constants import FATX_SECTOR_SIZE
 
 
 class XEXSignature(FatXSignature):
-    def test(self):
-        # TODO: add support for beta XEX's
-        if self.read(4) == 'XEX2':
-            return True
-        return False
+    # TODO: add support for beta XEX's
+    MAGIC = 'XEX2'
+    ALIGNMENT = FATX_SECTOR_SIZE
 
     def parse(self):
         self.seek(0x10)
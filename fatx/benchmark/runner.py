@@ -0,0 +1,416 @@
+from fatx.analysis.metadata_analyzer import FatXAnalyzer
+from fatx.analysis.file_carver import FatXCarver
+from fatx.drive.drive import FatXDrive, DRIVE_XBOX, \
+    x_signatures, x360_signatures
+from fatx.drive.generator import FatXDriveGenerator, \
+    LAYOUT_XBOX, LAYOUT_X360_DEVKIT, FILL_HEADER
+
+from Queue import Empty
+import multiprocessing
+import platform
+import tempfile
+import logging
+import shutil
+import time
+import json
+import sys
+import os
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is not reported there
+    resource = None
+
+
+LOG = logging.getLogger('FATX.Benchmark')
+
+# Seconds between checks that a benchmark's process is still alive.
+RESULT_POLL_INTERVAL = 1.0
+
+
+# Images that the benchmarks run on. Each is generated once per work
+# directory and reused by later runs.
+SCENARIOS = {
+    'small': dict(layout=LAYOUT_X360_DEVKIT, size=0x4000000, seed=0,
+                  depth=3, dirs_per_dir=4, files_per_dir=8,
+                  max_file_size=0x20000, fill=FILL_HEADER,
+                  fragmentation=0.02, damage='light'),
+    'default': dict(layout=LAYOUT_X360_DEVKIT, size=0x40000000, seed=0,
+                    depth=4, dirs_per_dir=4, files_per_dir=24,
+                    max_file_size=0x20000, fill=FILL_HEADER,
+                    fragmentation=0.02, damage='light'),
+    'large': dict(layout=LAYOUT_XBOX, size=0x200000000, seed=0,
+                  depth=5, dirs_per_dir=4, files_per_dir=16,
+                  max_file_size=0x40000, fill=FILL_HEADER,
+                  fragmentation=0.02, damage='heavy'),
+}
+
+# Throughput may drop by this fraction before it counts as a regression.
+DEFAULT_THRESHOLD = 0.10
+# Peak RSS may grow by this fraction before it counts as a regression.
+DEFAULT_RSS_THRESHOLD = 0.25
+
+
+class Stopwatch(object):
+    """Measures wall and CPU time between start() and stop()."""
+    def __init__(self):
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self._started = None
+
+    def start(self):
+        self._started = (time.time(), sum(os.times()[:2]))
+
+    def stop(self):
+        wall, cpu = self._started
+        self.seconds += time.time() - wall
+        self.cpu_seconds += sum(os.times()[:2]) - cpu
+
+
+def open_volume(image_path, index, mount=True):
+    """Opens the populated partition of a generated image.
+
+    Returns (FatXDrive, FatXVolume):
+    """
+    drive = FatXDrive(open(image_path, 'rb'))
+    volume = drive.get_partition(index)
+    if mount:
+        volume.mount()
+    return drive, volume
+
+
+def walk_dirents(dirents):
+    """Yields every dirent in a tree that is reachable by mounting."""
+    for dirent in dirents:
+        yield dirent
+        if dirent.is_directory() and not dirent.is_deleted():
+            for child in walk_dirents(dirent.children):
+                yield child
+
+
+def bench_mount(image_path, index, scratch, timer):
+    """FatXVolume.mount: FAT load and directory tree walk."""
+    drive, volume = open_volume(image_path, index, mount=False)
+    timer.start()
+    volume.mount()
+    timer.stop()
+    dirents = sum(1 for _ in walk_dirents(volume.get_root()))
+    return None, dirents
+
+
+def bench_read_file_allocation_table(image_path, index, scratch, timer):
+    """FatXVolume.read_file_allocation_table."""
+    drive, volume = open_volume(image_path, index)
+    timer.start()
+    fat = volume.read_file_allocation_table()
+    timer.stop()
+    return len(fat) * (2 if volume.fat16x else 4), len(fat)
+
+
+def bench_get_cluster_chain(image_path, index, scratch, timer):
+    """FatXVolume.get_cluster_chain for every allocated dirent."""
+    drive, volume = open_volume(image_path, index)
+    first_clusters = [dirent.first_cluster
+                      for dirent in walk_dirents(volume.get_root())
+                      if not dirent.is_deleted() and dirent.first_cluster != 0]
+    clusters = 0
+    timer.start()
+    for first_cluster in first_clusters:
+        clusters += len(volume.get_cluster_chain(first_cluster))
+    timer.stop()
+    return None, clusters
+
+
+def bench_dirent_recover(image_path, index, scratch, timer):
+    """FatXDirent.recover of the whole tree."""
+    drive, volume = open_volume(image_path, index)
+    path = os.path.join(scratch, 'recover')
+    os.makedirs(path)
+
+    # recover() prints every path it writes
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        timer.start()
+        for dirent in volume.get_root():
+            dirent.recover(path)
+        timer.stop()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    written = 0
+    files = 0
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            written += os.path.getsize(os.path.join(root, name))
+            files += 1
+    return written, files
+
+
+def bench_recover_orphans(image_path, index, scratch, timer):
+    """FatXAnalyzer.recover_orphans over every cluster."""
+    drive, volume = open_volume(image_path, index)
+    analyzer = FatXAnalyzer(volume)
+    timer.start()
+    analyzer.recover_orphans()
+    timer.stop()
+    scanned = (volume.max_clusters - 1) * volume.bytes_per_cluster
+    # every 64 byte slot is a dirent candidate
+    return scanned, scanned // 0x40
+
+
+def bench_link_orphans(image_path, index, scratch, timer):
+    """FatXAnalyzer.link_orphans of every recovered orphan."""
+    drive, volume = open_volume(image_path, index)
+    analyzer = FatXAnalyzer(volume)
+    analyzer.recover_orphans()
+    timer.start()
+    analyzer.link_orphans()
+    timer.stop()
+    return None, len(analyzer.get_orphanage())
+
+
+def bench_signature_analysis(image_path, index, scratch, timer):
+    """FatXCarver.perform_signature_analysis at a sector interval."""
+    drive, volume = open_volume(image_path, index)
+    if drive.mode == DRIVE_XBOX:
+        signatures = x_signatures
+    else:
+        signatures = x360_signatures
+    carver = FatXCarver(volume)
+    timer.start()
+    carver.perform_signature_analysis(signatures, interval=0x200)
+    timer.stop()
+    return volume.length, len(carver.get_valid_sigs())
+
+
+# Name and function of each benchmark, in the order that they run. Functions
+# take the image path, the populated partition index, a scratch directory and
+# a Stopwatch around the work being measured. They return the bytes processed
+# (or None) and the items processed.
+BENCHMARKS = [
+    ('mount', bench_mount),
+    ('read_file_allocation_table', bench_read_file_allocation_table),
+    ('get_cluster_chain', bench_get_cluster_chain),
+    ('dirent_recover', bench_dirent_recover),
+    ('recover_orphans', bench_recover_orphans),
+    ('link_orphans', bench_link_orphans),
+    ('signature_analysis', bench_signature_analysis),
+]
+
+
+def get_peak_rss():
+    """Returns (int): Peak resident set size of this process in bytes, or None
+    if it cannot be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return peak
+
+
+def _run_in_child(function, image_path, index, scratch, results):
+    """Runs a benchmark in a child process so that its peak RSS is its own."""
+    logging.getLogger('FATX').setLevel(logging.ERROR)
+    try:
+        timer = Stopwatch()
+        processed, items = function(image_path, index, scratch, timer)
+        results.put((timer.seconds, timer.cpu_seconds, processed, items,
+                     get_peak_rss()))
+    except Exception as e:
+        results.put(e)
+
+
+def _wait_for_result(child, results):
+    """Waits for a benchmark's result while checking that its process has not
+    died, such as by the OOM killer or a crash in C code."""
+    while True:
+        try:
+            return results.get(timeout=RESULT_POLL_INTERVAL)
+        except Empty:
+            if child.is_alive():
+                continue
+        # the result may have been queued just before the process exited
+        try:
+            return results.get(timeout=RESULT_POLL_INTERVAL)
+        except Empty:
+            raise RuntimeError("Benchmark process exited with code {} "
+                               "without a result.".format(child.exitcode))
+
+
+def run_benchmark(function, image_path, index, workdir):
+    """Runs a single benchmark once in its own process.
+
+    Returns (dict): Seconds, CPU seconds, bytes and items processed and peak
+        RSS.
+    """
+    scratch = tempfile.mkdtemp(dir=workdir)
+    try:
+        results = multiprocessing.Queue()
+        child = multiprocessing.Process(target=_run_in_child,
+                                        args=(function, image_path, index, scratch,
+                                              results))
+        child.start()
+        result = _wait_for_result(child, results)
+        child.join()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if isinstance(result, Exception):
+        raise result
+
+    seconds, cpu, processed, items, peak_rss = result
+    return dict(seconds=seconds, cpu_seconds=cpu, bytes=processed,
+                items=items, peak_rss=peak_rss)
+
+
+class FatXBenchmark(object):
+    """Runs the benchmarks on a generated image and compares their results
+    against a baseline.
+
+    Args:
+        workdir (str): Directory to keep generated images and scratch files
+            in.
+        scenario (str): Name of one of SCENARIOS.
+        repeat (int): Number of times each benchmark is run. The fastest run
+            is kept.
+    """
+    def __init__(self, workdir, scenario='default', repeat=3):
+        if scenario not in SCENARIOS:
+            raise ValueError("Unknown scenario: {}".format(scenario))
+        self.workdir = workdir
+        self.scenario = scenario
+        self.repeat = max(1, repeat)
+
+    def get_image(self):
+        """Generates the image for this scenario unless it already exists.
+
+        Returns (str, int): Path to the image and index of its populated
+            partition.
+        """
+        params = dict(SCENARIOS[self.scenario])
+        image_path = os.path.join(self.workdir,
+                                  'benchmark-{}.img'.format(self.scenario))
+        summary_path = image_path + '.json'
+
+        if os.path.exists(image_path) and os.path.exists(summary_path):
+            with open(summary_path, 'r') as f:
+                summary = json.load(f)
+            if summary.get('params') == params:
+                return image_path, summary['index']
+
+        LOG.info("Generating %s image...", self.scenario)
+        layout = params.pop('layout')
+        size = params.pop('size')
+        seed = params.pop('seed')
+        with open(image_path, 'wb+') as outfile:
+            drive = FatXDriveGenerator(outfile, layout, size)
+            summary = drive.generate(seed=seed, **params)
+
+        summary['params'] = SCENARIOS[self.scenario]
+        with open(summary_path, 'w') as f:
+            json.dump(summary, f)
+        return image_path, summary['index']
+
+    def run(self, names=None):
+        """Runs benchmarks.
+
+        Args:
+            names (str[]): Benchmarks to run. Defaults to all of them.
+
+        Returns (dict): Results, keyed by benchmark name, along with the
+            scenario and the platform they were measured on.
+        """
+        if not os.path.exists(self.workdir):
+            os.makedirs(self.workdir)
+        image_path, index = self.get_image()
+
+        benchmarks = {}
+        for name, function in BENCHMARKS:
+            if names and name not in names:
+                continue
+
+            best = None
+            peak_rss = None
+            for _ in xrange(self.repeat):
+                result = run_benchmark(function, image_path, index,
+                                       self.workdir)
+                if best is None or result['seconds'] < best['seconds']:
+                    best = result
+                if result['peak_rss'] is not None:
+                    peak_rss = max(peak_rss, result['peak_rss'])
+            best['peak_rss'] = peak_rss
+
+            seconds = max(best['seconds'], 1e-9)
+            best['items_per_sec'] = best['items'] / seconds
+            best['mb_per_sec'] = None
+            if best['bytes'] is not None:
+                best['mb_per_sec'] = best['bytes'] / seconds / 0x100000
+
+            LOG.info("%-28s %10.4f s  %s", name, best['seconds'],
+                     format_throughput(best))
+            benchmarks[name] = best
+
+        return dict(scenario=self.scenario,
+                    params=SCENARIOS[self.scenario],
+                    python=platform.python_version(),
+                    platform=platform.platform(),
+                    benchmarks=benchmarks)
+
+
+def format_throughput(result):
+    """Returns (str): Throughput of a single benchmark result."""
+    text = "{:12.1f} items/s".format(result['items_per_sec'])
+    if result['mb_per_sec'] is not None:
+        text += "  {:10.1f} MB/s".format(result['mb_per_sec'])
+    if result['peak_rss'] is not None:
+        text += "  {:8.1f} MB peak RSS".format(
+            result['peak_rss'] / float(0x100000))
+    return text
+
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD,
+                    rss_threshold=DEFAULT_RSS_THRESHOLD):
+    """Compares results against a baseline.
+
+    Throughput is compared in MB/s where a benchmark processes bytes and in
+    items/s otherwise.
+
+    Args:
+        results (dict): Results returned by FatXBenchmark.run().
+        baseline (dict): Results of an earlier run.
+        threshold (float): Fraction that throughput may drop by.
+        rss_threshold (float): Fraction that peak RSS may grow by.
+
+    Returns (str[]): Description of each regression.
+    """
+    if results['scenario'] != baseline['scenario']:
+        raise ValueError("Baseline was measured on the {} scenario, not {}."
+                         .format(baseline['scenario'], results['scenario']))
+
+    regressions = []
+    for name, result in sorted(results['benchmarks'].items()):
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            continue
+
+        metric = 'mb_per_sec' if result['mb_per_sec'] is not None \
+            else 'items_per_sec'
+        if before.get(metric) and \
+                result[metric] < before[metric] * (1 - threshold):
+            regressions.append(
+                "{}: {} dropped from {:.1f} to {:.1f} ({:+.1%})".format(
+                    name, metric, before[metric], result[metric],
+                    result[metric] / before[metric] - 1))
+
+        if before.get('peak_rss') and result['peak_rss'] is not None and \
+                result['peak_rss'] > before['peak_rss'] * (1 + rss_threshold):
+            regressions.append(
+                "{}: peak_rss grew from {} to {} ({:+.1%})".format(
+                    name, before['peak_rss'], result['peak_rss'],
+                    result['peak_rss'] / float(before['peak_rss']) - 1))
+    return regressions
@@ -1,5 +1,6 @@
 from fatx.filesystem.volume import FatXVolume
 from fatx.filesystem.constants import FATX_SIGNATURE
+from fatx.filesystem.metrics import FatXMetrics, FatXMeteredFile
 from fatx.analysis.signatures import *
 
 import logging
@@ -21,6 +22,24 @@ x_signatures = [
 DRIVE_XBOX = 0
 DRIVE_X360 = 1
 
+# Name, offset and length of each partition on an Original Xbox drive.
+XBOX_PARTITIONS = [
+    ("Partition5", 0x80000, 0x2ee00000),     # CACHE
+    ("Partition4", 0x2EE80000, 0x2ee00000),  # CACHE
+    ("Partition3", 0x5DC80000, 0x2ee00000),  # CACHE
+    ("Partition2", 0x8CA80000, 0x1f400000),  # SHELL
+    ("Partition1", 0xABE80000, 0x1312D6000)  # DATA
+]
+
+# Xbox 360 development drives start with this followed by a partition table.
+X360_DEVKIT_MAGIC = 0x20000
+
+# Fixed partitions of a retail Xbox 360 drive. Partition1 takes up the rest of
+# the drive.
+X360_SYSTEM_PARTITION_OFFSET = 0x120eb0000
+X360_SYSTEM_PARTITION_LENGTH = 0x10000000
+X360_DATA_PARTITION_OFFSET = 0x130eb0000
+
 LOG = logging.getLogger('FATX')
 
 
@@ -31,11 +50,19 @@ class FatXDrive(object):
 
     Args:
         fp (file): Image file object.
+        metrics (FatXMetrics): Metrics shared by every partition. If given,
+            reads and seeks on the image are counted into it as well.
     """
-    def __init__(self, fp):
+    def __init__(self, fp, metrics=None):
         def read_u32(f):
             return struct.unpack(self.byteorder + 'L', f.read(4))[0]
 
+        if metrics is None:
+            metrics = FatXMetrics()
+        else:
+            fp = FatXMeteredFile(fp, metrics)
+
+        self.metrics = metrics
         self.file = fp
         self.partitions = []
         self.mode = DRIVE_XBOX
@@ -46,18 +73,17 @@ class FatXDrive(object):
         LOG.debug("Drive Length: %016x", self.length)
 
         self.byteorder = '<'
-        fp.seek(0xABE80000)
-        if read_u32(fp) == FATX_SIGNATURE:
-            self.add_partition("Partition5", 0x80000, 0x2ee00000)  # CACHE
-            self.add_partition("Partition4", 0x2EE80000, 0x2ee00000)  # CACHE
-            self.add_partition("Partition3", 0x5DC80000, 0x2ee00000)  # CACHE
-            self.add_partition("Partition2", 0x8CA80000, 0x1f400000)  # SHELL
-            self.add_partition("Partition1", 0xABE80000, 0x1312D6000)  # DATA
+        fp.seek(XBOX_PARTITIONS[-1][1])
+        # images smaller than an Original Xbox drive cannot be one
+        if self.length >= XBOX_PARTITIONS[-1][1] + 4 and \
+                read_u32(fp) == FATX_SIGNATURE:
+            for name, offset, length in XBOX_PARTITIONS:
+                self.add_partition(name, offset, length)
         else:
             fp.seek(0)
             self.byteorder = '>'
             self.mode = DRIVE_X360
-            if read_u32(fp) == 0x20000:
+            if read_u32(fp) == X360_DEVKIT_MAGIC:
                 fp.seek(8)
                 # Partition1
                 data_offset = read_u32(fp) * 0x200
@@ -114,16 +140,20 @@ class FatXDrive(object):
                 # self.add_partition("DumpPartition", 0x100080000, 0x20E30000)
 
                 # SystemPartititon
-                self.add_partition("SystemPartition", 0x120eb0000, 0x10000000)
+                self.add_partition("SystemPartition",
+                                   X360_SYSTEM_PARTITION_OFFSET,
+                                   X360_SYSTEM_PARTITION_LENGTH)
 
                 # Partition1
                 # compute length of data partition
-                data_length = self.length - 0x130eb0000
-                self.add_partition("Partition1", 0x130eb0000, data_length)
+                data_length = self.length - X360_DATA_PARTITION_OFFSET
+                self.add_partition("Partition1", X360_DATA_PARTITION_OFFSET,
+                                   data_length)
 
     def add_partition(self, name, offset, length):
         # TODO: support other XBOX file systems?
-        fatx = FatXVolume(self.file, name, offset, length, self.byteorder)
+        fatx = FatXVolume(self.file, name, offset, length, self.byteorder,
+                          self.metrics)
         self.partitions.append(fatx)
 
     def get_partition(self, index):
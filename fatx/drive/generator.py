@@ -0,0 +1,537 @@
+from fatx.drive.drive import \
+    XBOX_PARTITIONS, \
+    X360_DEVKIT_MAGIC, \
+    X360_SYSTEM_PARTITION_OFFSET, \
+    X360_SYSTEM_PARTITION_LENGTH, \
+    X360_DATA_PARTITION_OFFSET
+from fatx.filesystem.constants import \
+    DIRENT_DELETED, \
+    FATX_FILE_NAME_LEN, \
+    FATX_MAX_DIRECTORY_SIZE, \
+    FATX_PAGE_SIZE, \
+    FATX_SECTOR_SIZE, \
+    FATX_SIGNATURE, \
+    FILE_ATTRIBUTE_DIRECTORY
+from fatx.filesystem.timestamp import DAYS_IN_MONTH
+
+from datetime import date
+import logging
+import random
+import struct
+import array
+import sys
+
+
+LOG = logging.getLogger('FATX.Generator')
+
+
+LAYOUT_XBOX = 'xbox'
+LAYOUT_X360 = 'x360'
+LAYOUT_X360_DEVKIT = 'x360-devkit'
+
+# How much of each file's contents is written.
+FILL_NONE = 'none'      # nothing, files read back as zeros
+FILL_HEADER = 'header'  # the first sector only
+FILL_FULL = 'full'      # every byte
+
+# Amount of damage done to a volume after its tree has been written.
+#   deleted_ratio: chance of a file or directory being deleted.
+#   zeroed_fat_ranges: number of ranges of the FAT that are zeroed.
+#   zeroed_fat_range_length: number of entries in each zeroed range.
+#   payloads: number of XBE/XEX/PE/PDB files left in unallocated clusters.
+DAMAGE_PROFILES = {
+    'none': dict(deleted_ratio=0.0,
+                 zeroed_fat_ranges=0,
+                 zeroed_fat_range_length=0,
+                 payloads=0),
+    'light': dict(deleted_ratio=0.05,
+                  zeroed_fat_ranges=2,
+                  zeroed_fat_range_length=64,
+                  payloads=8),
+    'heavy': dict(deleted_ratio=0.25,
+                  zeroed_fat_ranges=32,
+                  zeroed_fat_range_length=1024,
+                  payloads=64),
+}
+
+VALID_NAME_CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ' \
+                   '0123456789_-'
+
+
+def make_xbe(name, length):
+    """Builds an XBE header that XBESignature can parse."""
+    base_address = 0x10000
+    header = struct.pack('<4s', 'XBEH').ljust(0x104, '\0')
+    header += struct.pack('<L', base_address)
+    header = header.ljust(0x10c, '\0') + struct.pack('<L', length)
+    header = header.ljust(0x150, '\0')
+    header += struct.pack('<L', base_address + 0x200)
+    return header.ljust(0x200, '\0') + name.split('.')[0] + '.exe\0'
+
+
+def make_xex(name, length):
+    """Builds an XEX2 header that XEXSignature can parse."""
+    security_offset = 0x100
+    header = 'XEX2'.ljust(0x10, '\0')
+    header += struct.pack('>LL', security_offset, 1)
+    header += struct.pack('>LL', 0x000183FF, 0x80)
+    header = header.ljust(0x84, '\0') + name + '\0'
+    header = header.ljust(security_offset + 4, '\0')
+    return header + struct.pack('>L', length)
+
+
+def make_pe(name, length):
+    """Builds a PE header with one section that PESignature can parse."""
+    lfanew = 0x80
+    header = 'MZ\x90\0'.ljust(0x3C, '\0') + struct.pack('<L', lfanew)
+    header = header.ljust(lfanew, '\0') + 'PE\0\0'
+    header += struct.pack('<HH', 0x1F2, 1)
+    header = header.ljust(lfanew + 0xF8 + 0x10, '\0')
+    return header + struct.pack('<LL', length - 0x400, 0x400)
+
+
+def make_pdb(name, length):
+    """Builds an MSF 7.00 header that PDBSignature can parse."""
+    block_size = 0x400
+    header = 'Microsoft C/C++ MSF 7.00\r\n\x1A\x44\x53\0\0\0'
+    return header + struct.pack('<LLL', block_size, 0,
+                                (length + block_size - 1) // block_size)
+
+
+def make_live(name, length):
+    """Builds the start of an Xbox 360 LIVE package."""
+    return 'LIVE'
+
+
+# Payload builders and file extensions for each console.
+X_PAYLOADS = [(make_xbe, '.xbe'), (make_pe, '.dll'), (make_pdb, '.pdb')]
+X360_PAYLOADS = [(make_xex, '.xex'), (make_pe, '.dll'), (make_pdb, '.pdb'),
+                 (make_live, '')]
+
+
+class FatXVolumeGenerator(object):
+    """Writes a synthetic FATX volume into an image file.
+
+    The layout mirrors what FatXVolume.calculate_offsets() expects, so
+    FAT16X or FAT32X is chosen from the length and cluster size. Only the
+    header, FAT, directories and the requested amount of file contents are
+    written. Everything else is left as holes in the image.
+
+    Args:
+        fo (file): Image file opened for writing.
+        offset (int): Offset of this volume into the image file.
+        length (int): Length of this volume.
+        byteorder (str): Either '>' for big-endian or '<' for little endian.
+        sectors_per_cluster (int): Cluster size in sectors.
+        seed (int): Seed for the random generator so images are reproducible.
+    """
+    def __init__(self, fo, offset, length, byteorder,
+                 sectors_per_cluster=32, seed=0):
+        self.outfile = fo
+        self.offset = offset
+        self.length = length
+        self.endian_fmt = byteorder
+        self.random = random.Random(seed)
+        self.epoch = 2000 if byteorder == '<' else 1980
+
+        self.sectors_per_cluster = sectors_per_cluster
+        self.bytes_per_cluster = sectors_per_cluster * FATX_SECTOR_SIZE
+        self.max_clusters = (length // self.bytes_per_cluster) + 1
+        self.fat16x = self.max_clusters < 0xfff0
+        bytes_per_fat = self.max_clusters * (2 if self.fat16x else 4)
+        bytes_per_fat = (bytes_per_fat + (FATX_PAGE_SIZE - 1)) & \
+            ~(FATX_PAGE_SIZE - 1)
+        self.fat_byte_offset = 0x1000
+        self.file_area_byte_offset = self.fat_byte_offset + bytes_per_fat
+
+        self.fat = array.array('H' if self.fat16x else 'I',
+                               [0]) * self.max_clusters
+        self.end_of_chain = 0xffff if self.fat16x else 0xffffffff
+        self.fat[0] = 0xfff8 if self.fat16x else 0xfffffff8
+
+        # clusters whose data lies entirely within the volume
+        self.last_cluster = min(
+            self.max_clusters - 1,
+            (length - self.file_area_byte_offset) // self.bytes_per_cluster)
+        self.next_cluster = 1
+        self.fragmentation = 0.0
+        self.fill = FILL_HEADER
+        self.block = None
+
+        self.summary = dict(files=0, directories=0, deleted=0, bytes=0,
+                            payloads=[], zeroed_fat_ranges=[])
+
+    def cluster_to_physical_offset(self, cluster):
+        """Convert a cluster index to an offset into the image file."""
+        return (self.offset + self.file_area_byte_offset +
+                (self.bytes_per_cluster * (cluster - 1)))
+
+    def allocate(self, count):
+        """Allocates and chains count clusters.
+
+        Clusters are handed out in increasing order. With fragmentation,
+        free clusters are randomly skipped between them.
+
+        Returns (int[]): Allocated clusters.
+        """
+        chain = []
+        while len(chain) < count:
+            if self.next_cluster > self.last_cluster:
+                raise ValueError("Volume is full!")
+            if chain and self.random.random() < self.fragmentation:
+                self.next_cluster += self.random.randint(1, 16)
+                continue
+            chain.append(self.next_cluster)
+            self.next_cluster += 1
+
+        for cluster, next_cluster in zip(chain, chain[1:]):
+            self.fat[cluster] = next_cluster
+        if chain:
+            self.fat[chain[-1]] = self.end_of_chain
+        return chain
+
+    def free(self, chain):
+        """Marks each cluster of a chain as free, like deleting a file."""
+        for cluster in chain:
+            self.fat[cluster] = 0
+
+    def make_time_stamp(self):
+        """Returns a random packed time stamp that is not in the future."""
+        year = self.random.randint(0, min(127, date.today().year - 1 -
+                                          self.epoch))
+        month = self.random.randint(1, 12)
+        day = self.random.randint(1, DAYS_IN_MONTH[month])
+        return (year << 25) | (month << 21) | (day << 16) | \
+            (self.random.randint(0, 23) << 11) | \
+            (self.random.randint(0, 59) << 5) | \
+            self.random.randint(0, 29)
+
+    def make_name(self, prefix, index, extension=''):
+        """Returns a valid file name that is unique within a directory."""
+        suffix = ''.join(self.random.choice(VALID_NAME_CHARS)
+                         for _ in xrange(self.random.randint(0, 12)))
+        name = '{}{}_{}{}'.format(prefix, index, suffix, extension)
+        return name[:FATX_FILE_NAME_LEN]
+
+    def pack_dirent(self, name, attributes, first_cluster, file_size,
+                    deleted=False):
+        """Serializes a dirent."""
+        name_length = DIRENT_DELETED if deleted else len(name)
+        return struct.pack(self.endian_fmt + 'BB42sLLLLL',
+                           name_length, attributes,
+                           name.ljust(FATX_FILE_NAME_LEN, '\xff'),
+                           first_cluster, file_size,
+                           self.make_time_stamp(),
+                           self.make_time_stamp(),
+                           self.make_time_stamp())
+
+    def write_data(self, chain, data, file_size):
+        """Writes a file's contents into its clusters.
+
+        Args:
+            chain (int[]): Clusters of the file.
+            data (str): Data the file starts with, if any.
+            file_size (int): Total size of the file.
+        """
+        if self.fill == FILL_NONE and not data:
+            return
+        if self.fill == FILL_FULL:
+            remains = file_size
+        else:
+            remains = min(file_size, max(len(data), FATX_SECTOR_SIZE))
+
+        for cluster in chain:
+            if remains <= 0:
+                break
+            size = min(remains, self.bytes_per_cluster)
+            buf = data[:size]
+            data = data[size:]
+            if len(buf) < size:
+                buf += self.block[:size - len(buf)]
+            self.outfile.seek(self.cluster_to_physical_offset(cluster))
+            self.outfile.write(buf)
+            remains -= size
+
+    def create_file(self, name, file_size, deleted, data=''):
+        """Allocates and writes a file.
+
+        Returns (str): Serialized dirent for this file.
+        """
+        # empty files do not own any clusters
+        chain = self.allocate((file_size + self.bytes_per_cluster - 1) //
+                              self.bytes_per_cluster)
+        self.write_data(chain, data, file_size)
+        if deleted:
+            self.free(chain)
+            self.summary['deleted'] += 1
+        self.summary['files'] += 1
+        self.summary['bytes'] += file_size
+        first_cluster = chain[0] if chain else 0
+        return self.pack_dirent(name, 0, first_cluster, file_size, deleted)
+
+    def create_directory(self, name, depth, tree, deleted):
+        """Allocates and writes a directory and everything below it.
+
+        Returns (str): Serialized dirent for this directory.
+        """
+        chain = self.create_directory_stream(depth, tree, deleted)
+        if deleted:
+            self.free(chain)
+            self.summary['deleted'] += 1
+        self.summary['directories'] += 1
+        return self.pack_dirent(name, FILE_ATTRIBUTE_DIRECTORY, chain[0], 0,
+                                deleted)
+
+    def create_directory_stream(self, depth, tree, deleted=False):
+        """Writes the dirent stream of a directory along with its children.
+
+        The directory's clusters are allocated before its children's, the
+        way they would be on a console.
+
+        Returns (int[]): Clusters holding the dirent stream.
+        """
+        dirents_per_cluster = self.bytes_per_cluster // 0x40
+        num_dirs = tree['dirs_per_dir'] if depth < tree['depth'] else 0
+        num_files = tree['files_per_dir']
+        if tree['max_files'] is not None:
+            num_files = max(0, min(num_files, tree['max_files'] -
+                                   self.summary['files']))
+        num_entries = min(num_dirs + num_files,
+                          FATX_MAX_DIRECTORY_SIZE // 0x40)
+        chain = self.allocate(max(1, -(-num_entries // dirents_per_cluster)))
+
+        dirents = []
+        for index in xrange(num_entries):
+            child_deleted = deleted or \
+                self.random.random() < tree['deleted_ratio']
+            if index < num_dirs:
+                dirents.append(self.create_directory(
+                    self.make_name('dir', index), depth + 1, tree,
+                    child_deleted))
+            elif tree['max_files'] is not None and \
+                    self.summary['files'] >= tree['max_files']:
+                # subdirectories used up the rest of the files
+                break
+            else:
+                file_size = self.random.randint(tree['min_file_size'],
+                                                tree['max_file_size'])
+                dirents.append(self.create_file(
+                    self.make_name('file', index, '.bin'), file_size,
+                    child_deleted))
+
+        stream = ''.join(dirents)
+        for index, cluster in enumerate(chain):
+            data = stream[index * self.bytes_per_cluster:
+                          (index + 1) * self.bytes_per_cluster]
+            # mark the end of the dirent stream
+            data = data.ljust(self.bytes_per_cluster, '\xff')
+            self.outfile.seek(self.cluster_to_physical_offset(cluster))
+            self.outfile.write(data)
+        return chain
+
+    def create_payloads(self, count, payloads, max_size):
+        """Leaves files that carvers look for in unallocated clusters."""
+        for index in xrange(count):
+            make_payload, extension = self.random.choice(payloads)
+            name = self.make_name('payload', index, extension)
+            length = self.random.randint(0x1000, max(0x1000, max_size))
+            data = make_payload(name, length)
+            clusters = max(1, (length + self.bytes_per_cluster - 1) //
+                           self.bytes_per_cluster)
+            # skip a few clusters so payloads are not next to each other
+            self.next_cluster += self.random.randint(1, 8)
+            chain = self.allocate(clusters)
+            self.write_data(chain, data, length)
+            self.free(chain)
+            self.summary['payloads'].append(dict(
+                name=name,
+                offset=(chain[0] - 1) * self.bytes_per_cluster,
+                length=length))
+
+    def zero_fat_ranges(self, count, length):
+        """Zeroes random ranges of the FAT to break cluster chains."""
+        for _ in xrange(count):
+            if self.next_cluster <= 2:
+                break
+            start = self.random.randint(1, self.next_cluster - 1)
+            end = min(start + length, self.max_clusters)
+            self.fat[start:end] = array.array(self.fat.typecode,
+                                              [0]) * (end - start)
+            self.summary['zeroed_fat_ranges'].append((start, end - start))
+
+    def write_header(self, root_dir_first_cluster):
+        """Writes the volume header and the FAT."""
+        self.outfile.seek(self.offset)
+        self.outfile.write(struct.pack(self.endian_fmt + 'LLLL',
+                                       FATX_SIGNATURE,
+                                       self.random.getrandbits(32),
+                                       self.sectors_per_cluster,
+                                       root_dir_first_cluster))
+
+        fat = array.array(self.fat.typecode, self.fat)
+        if (self.endian_fmt == '<') != (sys.byteorder == 'little'):
+            fat.byteswap()
+        self.outfile.seek(self.offset + self.fat_byte_offset)
+        self.outfile.write(fat.tostring())
+
+    def generate(self, depth=3, dirs_per_dir=4, files_per_dir=16,
+                 max_files=None, min_file_size=0, max_file_size=0x100000,
+                 fill=FILL_HEADER, fragmentation=0.0, damage='none',
+                 payloads=None):
+        """Writes a directory tree and then damages the volume.
+
+        Args:
+            depth (int): Number of directory levels below the root.
+            dirs_per_dir (int): Number of subdirectories in each directory.
+            files_per_dir (int): Number of files in each directory.
+            max_files (int): Stop creating files after this many.
+            min_file_size (int): Smallest file size.
+            max_file_size (int): Largest file size.
+            fill (str): FILL_NONE, FILL_HEADER or FILL_FULL.
+            fragmentation (float): Chance of a gap between two clusters of a
+                file.
+            damage (str|dict): Name of one of DAMAGE_PROFILES or a dict like
+                them.
+            payloads (list): Payload builders and extensions to choose from.
+                Defaults to the ones for this volume's console.
+
+        Returns (dict): Counts of what was written, along with where each
+            payload and zeroed FAT range is.
+        """
+        if not isinstance(damage, dict):
+            damage = DAMAGE_PROFILES[damage]
+        if payloads is None:
+            payloads = X_PAYLOADS if self.endian_fmt == '<' else X360_PAYLOADS
+
+        self.fill = fill
+        self.fragmentation = fragmentation
+        self.block = ''.join(chr(self.random.getrandbits(8))
+                             for _ in xrange(self.bytes_per_cluster))
+
+        tree = dict(depth=depth, dirs_per_dir=dirs_per_dir,
+                    files_per_dir=files_per_dir, max_files=max_files,
+                    min_file_size=min_file_size, max_file_size=max_file_size,
+                    deleted_ratio=damage['deleted_ratio'])
+        root = self.create_directory_stream(0, tree)
+
+        self.create_payloads(damage['payloads'], payloads, max_file_size)
+        self.zero_fat_ranges(damage['zeroed_fat_ranges'],
+                             damage['zeroed_fat_range_length'])
+        self.write_header(root[0])
+
+        self.summary['clusters'] = self.next_cluster - 1
+        self.summary['fat16x'] = self.fat16x
+        LOG.info("Wrote %i files and %i directories (%i deleted)",
+                 self.summary['files'], self.summary['directories'],
+                 self.summary['deleted'])
+        return self.summary
+
+
+class FatXDriveGenerator(object):
+    """Creates a sparse drive image laid out the way FatXDrive expects.
+
+    Original Xbox and retail Xbox 360 drives use fixed partition offsets, so
+    they must be large enough to hold them. Development Xbox 360 drives carry
+    a partition table and can be any size.
+
+    Args:
+        fo (file): Image file opened for writing.
+        layout (str): LAYOUT_XBOX, LAYOUT_X360 or LAYOUT_X360_DEVKIT.
+        length (int): Length of the drive.
+    """
+    def __init__(self, fo, layout, length):
+        self.outfile = fo
+        self.layout = layout
+        self.length = length
+
+        if layout == LAYOUT_XBOX:
+            self.byteorder = '<'
+            self.partitions = list(XBOX_PARTITIONS)
+        elif layout == LAYOUT_X360:
+            self.byteorder = '>'
+            self.partitions = [
+                ("SystemPartition", X360_SYSTEM_PARTITION_OFFSET,
+                 X360_SYSTEM_PARTITION_LENGTH),
+                ("Partition1", X360_DATA_PARTITION_OFFSET,
+                 length - X360_DATA_PARTITION_OFFSET)]
+        elif layout == LAYOUT_X360_DEVKIT:
+            self.byteorder = '>'
+            # give the system partition a sixteenth, at least one cluster
+            system_length = max(length // 16, 0x100000) & ~0xfffff
+            data_offset = 0x80000 + system_length
+            self.partitions = [
+                ("SystemPartition", 0x80000, system_length),
+                ("Partition1", data_offset, length - data_offset)]
+        else:
+            raise ValueError("Unknown drive layout: {}".format(layout))
+
+        name, offset, last_length = self.partitions[-1]
+        if last_length <= 0 or offset + last_length > length:
+            raise ValueError("Drive is too small for the {} layout."
+                             .format(layout))
+
+    def write_partition_table(self):
+        """Sizes the image and writes a partition table if it has one."""
+        self.outfile.truncate(self.length)
+        if self.layout == LAYOUT_X360_DEVKIT:
+            (_, shell_offset, shell_length), \
+                (_, data_offset, data_length) = self.partitions
+            self.outfile.seek(0)
+            self.outfile.write(struct.pack('>LLLLLL', X360_DEVKIT_MAGIC, 0,
+                                           data_offset // 0x200,
+                                           data_length // 0x200,
+                                           shell_offset // 0x200,
+                                           shell_length // 0x200))
+
+    def get_volume(self, index, **kwargs):
+        """Returns a generator for a partition.
+
+        Args:
+            index (int): Partition index, counting from 1 like
+                FatXDrive.get_partition().
+            kwargs: Passed on to FatXVolumeGenerator.
+
+        Returns (FatXVolumeGenerator):
+        """
+        name, offset, length = self.partitions[index - 1]
+        return FatXVolumeGenerator(self.outfile, offset, length,
+                                   self.byteorder, **kwargs)
+
+    def generate(self, index=0, sectors_per_cluster=32, seed=0, **kwargs):
+        """Writes the partition table and a volume in every partition.
+
+        Only the selected partition is populated, the others are formatted
+        but left empty.
+
+        Args:
+            index (int): Partition to populate, counting from 1. Zero selects
+                the data partition, which is always listed last.
+            sectors_per_cluster (int): Cluster size in sectors.
+            seed (int): Seed for the random generator. Each partition adds its
+                index to it.
+            kwargs: Passed on to FatXVolumeGenerator.generate().
+
+        Returns (dict): Summary of the populated partition.
+        """
+        if index == 0:
+            index = len(self.partitions)
+
+        self.write_partition_table()
+
+        summary = None
+        for i, (name, offset, length) in enumerate(self.partitions):
+            if length == 0:
+                continue
+            volume = self.get_volume(i + 1,
+                                     sectors_per_cluster=sectors_per_cluster,
+                                     seed=seed + i)
+            if i + 1 != index:
+                volume.generate(depth=0, dirs_per_dir=0, files_per_dir=0)
+                continue
+
+            summary = volume.generate(**kwargs)
+            summary['partition'] = name
+            summary['index'] = index
+            summary['offset'] = offset
+            summary['length'] = length
+        return summary
@@ -0,0 +1,261 @@
+from fatx.filesystem.transfer import COPY_BUFFER_SIZE
+
+from datetime import datetime
+from threading import Lock
+import zipfile
+import tarfile
+import logging
+import struct
+import time
+import zlib
+
+
+LOG = logging.getLogger('FATX.FileSystem')
+
+ARCHIVE_TAR = 'tar'
+ARCHIVE_TAR_GZ = 'tar.gz'
+ARCHIVE_ZIP = 'zip'
+
+_EXTENSIONS = (('.tar.gz', ARCHIVE_TAR_GZ), ('.tgz', ARCHIVE_TAR_GZ),
+               ('.tar', ARCHIVE_TAR), ('.zip', ARCHIVE_ZIP))
+
+
+def get_archive_format(path):
+    """Returns (str): Archive format that a path's extension stands for, or
+    None if it is not one."""
+    for extension, archive_format in _EXTENSIONS:
+        if path.lower().endswith(extension):
+            return archive_format
+    return None
+
+
+def _get_date_time(time_stamp):
+    if time_stamp is None:
+        return None
+    try:
+        return datetime(year=time_stamp.year, month=time_stamp.month,
+                        day=time_stamp.day, hour=time_stamp.hour,
+                        minute=time_stamp.min, second=time_stamp.sec)
+    except ValueError:
+        return None
+
+
+class _ChunkReader(object):
+    """File object reading exactly size bytes out of chunks of data, padded
+    with zeros if the chunks run out early, as tarfile expects."""
+    def __init__(self, chunks, size):
+        self._chunks = iter(chunks)
+        self._chunk = ''
+        self._offset = 0
+        self._remains = size
+        self.padded = 0
+
+    def read(self, size):
+        size = min(size, self._remains)
+        self._remains -= size
+        pieces = []
+        while size > 0:
+            if self._offset >= len(self._chunk):
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    self.padded += size
+                    pieces.append('\0' * size)
+                    break
+                # only the part not read yet is sliced off, never the rest
+                self._chunk = chunk
+                self._offset = 0
+                continue
+            piece = self._chunk[self._offset:self._offset + size]
+            self._offset += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+        if len(pieces) == 1:
+            return pieces[0]
+        return ''.join(pieces)
+
+
+class FatXArchive(object):
+    """Writes recovered files straight into a tar or zip archive.
+
+    Each file's data is streamed into the archive from its clusters, so
+    there are no temporary files and memory use does not depend on the size
+    of the files. Last write times become the modification times of the
+    archive members. Members are written one at a time, so threads may share
+    an archive.
+
+    Args:
+        path (str): Archive to create.
+        archive_format (str): ARCHIVE_TAR, ARCHIVE_TAR_GZ or ARCHIVE_ZIP.
+            Defaults to the format the extension of path stands for.
+        compress (bool): Whether to deflate zip members. Tar archives are
+            compressed according to their format.
+    """
+    def __init__(self, path, archive_format=None, compress=False):
+        if archive_format is None:
+            archive_format = get_archive_format(path)
+        if archive_format not in (ARCHIVE_TAR, ARCHIVE_TAR_GZ, ARCHIVE_ZIP):
+            raise ValueError("Archives must be .tar, .tar.gz, .tgz or .zip.")
+
+        self.archive_format = archive_format
+        self.compress = compress
+        self.files = 0
+        self._lock = Lock()
+        self._tar = None
+        self._zip = None
+        if archive_format == ARCHIVE_ZIP:
+            self._zip = zipfile.ZipFile(path, 'w', allowZip64=True)
+        else:
+            mode = 'w:gz' if archive_format == ARCHIVE_TAR_GZ else 'w'
+            self._tar = tarfile.open(path, mode)
+
+    def add_directory(self, name, date_time=None):
+        """Adds an empty directory.
+
+        Args:
+            name (str): Path of the directory in the archive.
+            date_time (datetime): Modification time.
+        """
+        with self._lock:
+            if self._tar is not None:
+                info = tarfile.TarInfo(name)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                info.mtime = self._get_mtime(date_time)
+                self._tar.addfile(info)
+            else:
+                info = zipfile.ZipInfo(name.rstrip('/') + '/',
+                                       self._get_zip_date_time(date_time))
+                info.external_attr = (0o40755 << 16) | 0x10
+                self._zip.writestr(info, '')
+
+    def add_file(self, name, size, chunks, date_time=None):
+        """Adds a file, streaming its data into the archive.
+
+        Args:
+            name (str): Path of the file in the archive.
+            size (int): Size of the file.
+            chunks (iterable): The file's data, piece by piece. If it holds
+                less than size bytes, the rest is filled with zeros.
+            date_time (datetime): Modification time.
+
+        Returns (int): Number of bytes that had to be filled with zeros.
+        """
+        with self._lock:
+            if self._tar is not None:
+                padded = self._add_tar_file(name, size, chunks, date_time)
+            else:
+                padded = self._add_zip_file(name, size, chunks, date_time)
+            self.files += 1
+        if padded:
+            LOG.warning('%s is %d bytes short, filled it with zeros.',
+                        name, padded)
+        return padded
+
+    def _get_mtime(self, date_time):
+        if date_time is None:
+            return 0
+        return int(time.mktime(date_time.timetuple()))
+
+    def _get_zip_date_time(self, date_time):
+        # zip cannot hold times before 1980
+        if date_time is None or date_time.year < 1980:
+            return (1980, 1, 1, 0, 0, 0)
+        return date_time.timetuple()[:6]
+
+    def _add_tar_file(self, name, size, chunks, date_time):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mode = 0o644
+        info.mtime = self._get_mtime(date_time)
+        reader = _ChunkReader(chunks, size)
+        self._tar.addfile(info, reader)
+        return reader.padded
+
+    def _add_zip_file(self, name, size, chunks, date_time):
+        # zipfile cannot stream a member, so write it like ZipFile.write()
+        # does, with the sizes and CRC in a data descriptor after the data
+        archive = self._zip
+        info = zipfile.ZipInfo(name, self._get_zip_date_time(date_time))
+        info.external_attr = 0o100644 << 16
+        info.compress_type = zipfile.ZIP_DEFLATED if self.compress \
+            else zipfile.ZIP_STORED
+        info.flag_bits |= 0x08
+        info.header_offset = archive.fp.tell()
+        archive.fp.write(info.FileHeader(False))
+
+        compressor = None
+        if self.compress:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                          zlib.DEFLATED, -15)
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        reader = _ChunkReader(chunks, size)
+        while file_size < size:
+            chunk = reader.read(COPY_BUFFER_SIZE)
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            compress_size += len(chunk)
+            archive.fp.write(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            compress_size += len(chunk)
+            archive.fp.write(chunk)
+
+        info.CRC = crc & 0xffffffff
+        info.file_size = file_size
+        info.compress_size = compress_size
+        archive.fp.write(struct.pack('<4sLLL', 'PK\x07\x08', info.CRC,
+                                     compress_size, file_size))
+        archive.filelist.append(info)
+        archive.NameToInfo[name] = info
+        # the central directory is only written if the archive was changed
+        archive._didModify = True
+        return reader.padded
+
+    def add_dirent(self, dirent, path='', undelete=False, progress=None):
+        """Adds a dirent and everything below it, laid out the way
+        FatXDirent.recover() lays out files on disk.
+
+        Args:
+            dirent (FatXDirent): Dirent to add. Orphans are read from the
+                clusters following their first one.
+            path (str): Directory in the archive to add it to.
+            undelete (bool): Whether to add files marked as deleted.
+            progress (FatXProgress): Reports each file added and the bytes
+                read for it.
+        """
+        stack = [(dirent, path)]
+        while stack:
+            dirent, path = stack.pop()
+            if dirent.is_deleted() and not undelete:
+                continue
+            name = path + '/' + dirent.file_name if path else dirent.file_name
+            date_time = _get_date_time(dirent.last_write_time)
+            if dirent.is_directory():
+                self.add_directory(name, date_time)
+                stack.extend((child, name)
+                             for child in reversed(dirent.children))
+            else:
+                # a broken chain yields less than the file size, and the
+                # size has to be known before the data is streamed
+                size = dirent.get_data_size()
+                padded = self.add_file(name, size, dirent.iter_data(),
+                                       date_time)
+                if progress is not None:
+                    progress.update(size - padded, 1)
+
+    def close(self):
+        """Finishes the archive."""
+        if self._tar is not None:
+            self._tar.close()
+        else:
+            self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
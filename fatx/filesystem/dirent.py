@@ -1,3 +1,5 @@
+from fatx.filesystem.transfer import copy_extents, FatXSparseFile, \
+    COPY_BUFFER_SIZE
 from fatx.filesystem.constants import \
     DIRENT_DELETED, \
     DIRENT_NEVER_USED, \
@@ -14,13 +16,25 @@ import time
 import os
 
 
-class FatXDirent:
+# Shared by every dirent that is not a directory, which never has children.
+NO_CHILDREN = ()
+
+
+class FatXDirent(object):
     """Representation of directory entity which can be either a file or folder.
 
+    Orphan scans can create millions of these, so they keep to the fields
+    read from the volume. The file name and time stamps are decoded when they
+    are first used and directories cache their path for their children.
+
     Args:
         data (str): Serialized dirent read from the volume.
         volume (FatXVolume): Volume in which this dirent belongs to.
     """
+    __slots__ = ('file_name_length', 'file_attributes', 'file_name_bytes',
+                 'first_cluster', 'file_size', 'creation_time_i',
+                 'last_write_time_i', 'last_access_time_i',
+                 'children', 'parent', 'volume', '_file_name', '_full_path')
 
     def __init__(self, data, volume):
         (self.file_name_length,
@@ -32,29 +46,55 @@ class FatXDirent:
          self.last_write_time_i,
          self.last_access_time_i) = struct.unpack(volume.DIRENT_FORMAT, data)
 
-        self.children = []
+        if self.file_attributes & FILE_ATTRIBUTE_DIRECTORY:
+            self.children = []
+        else:
+            self.children = NO_CHILDREN
         self.parent = None
         self.volume = volume
-        self.file_name = ''
-        self.creation_time = None
-        self.last_write_time = None
-        self.last_access_time = None
+        self._file_name = None
+        self._full_path = None
 
+    def is_end_of_stream(self):
+        """Whether or not this dirent marks the end of a directory stream.
+
+        Returns (bool):
+        """
+        return (self.file_name_length == DIRENT_NEVER_USED or
+                self.file_name_length == DIRENT_NEVER_USED2)
+
+    @property
+    def file_name(self):
+        file_name = self._file_name
+        if file_name is None:
+            if self.is_end_of_stream():
+                file_name = ''
+            elif self.file_name_length == DIRENT_DELETED:
+                file_name = intern(self.file_name_bytes.split('\xff')[0])
+            else:
+                file_name = intern(
+                    self.file_name_bytes[:self.file_name_length])
+            self._file_name = file_name
+        return file_name
+
+    def _get_time_stamp(self, time_stamp):
         # Optimization: Avoid creating time stamp objects
         # Marks the end of a directory stream
-        if (self.file_name_length == DIRENT_NEVER_USED or
-                self.file_name_length == DIRENT_NEVER_USED2):
-            return
+        if self.is_end_of_stream():
+            return None
+        return self.volume.ts_format(time_stamp)
 
-        ts = volume.ts_format
-        self.creation_time = ts(self.creation_time_i)
-        self.last_write_time = ts(self.last_write_time_i)
-        self.last_access_time = ts(self.last_access_time_i)
+    @property
+    def creation_time(self):
+        return self._get_time_stamp(self.creation_time_i)
 
-        if self.file_name_length == DIRENT_DELETED:
-            self.file_name = self.file_name_bytes.split('\xff')[0]
-        else:
-            self.file_name = self.file_name_bytes[:self.file_name_length]
+    @property
+    def last_write_time(self):
+        return self._get_time_stamp(self.last_write_time_i)
+
+    @property
+    def last_access_time(self):
+        return self._get_time_stamp(self.last_access_time_i)
 
     @classmethod
     def from_file(cls, volume):
@@ -83,7 +123,7 @@ class FatXDirent:
             raise Exception("This dirent is not a directory!")
 
         for dirent in stream:
-            dirent.parent = self
+            dirent.set_parent(self)
             self.children.append(dirent)
 
     def add_child(self, child):
@@ -108,6 +148,14 @@ class FatXDirent:
             parent(FatXDirent): parent dirent.
         """
         self.parent = parent
+        self._forget_path()
+
+    def _forget_path(self):
+        """Drops the cached path of this dirent and everything below it."""
+        if self._full_path is not None:
+            self._full_path = None
+            for child in self.children:
+                child._forget_path()
 
     def has_parent(self):
         """Whether or not this dirent has a parent.
@@ -150,14 +198,22 @@ class FatXDirent:
 
         Returns (str): Path string excluding file name.
         """
-        ancestry = []
-        if self.parent is not None:
-            parent = self.parent
-            while parent is not None:
-                ancestry.append(parent.file_name)
-                parent = parent.parent
-
-        return '/'.join(reversed(ancestry))
+        if self.parent is None:
+            return ''
+        return self.parent._get_directory_path()
+
+    def _get_directory_path(self):
+        """Returns this directory's path in the form get_path() uses, cached
+        so that its children share it."""
+        path = self._full_path
+        if path is None:
+            if self.parent is None:
+                path = self.file_name
+            else:
+                path = self.parent._get_directory_path() + '/' + \
+                    self.file_name
+            self._full_path = path
+        return path
 
     def get_full_path(self):
         """Generate a full path string for this dirent.
@@ -168,6 +224,27 @@ class FatXDirent:
         """
         return '/'.join([self.get_path(), self.file_name])
 
+    def get_tree_size(self, undelete=False):
+        """Counts what recover() will write for this dirent and its children.
+
+        Args:
+            undelete (bool): Whether or not deleted files are counted.
+
+        Returns (int, int): Number of bytes and number of files.
+        """
+        if self.is_deleted() and not undelete:
+            return 0, 0
+        if not self.is_directory():
+            return self.get_data_size(), 1
+
+        total_bytes = 0
+        total_files = 0
+        for child in self.children:
+            child_bytes, child_files = child.get_tree_size(undelete)
+            total_bytes += child_bytes
+            total_files += child_files
+        return total_bytes, total_files
+
     ###########################################
     # TODO: need to move these to FatXVolume
     def _set_ts(self, path):
@@ -196,41 +273,112 @@ class FatXDirent:
         os.utime(path, (time.mktime(atime.timetuple()),
                         time.mktime(mtime.timetuple())))
 
-    def _write_file(self, path):
+    def iter_data(self, bufsize=COPY_BUFFER_SIZE):
+        """Reads this file's data from the extents get_extents() finds.
+
+        Args:
+            bufsize (int): Most data read at a time.
+
+        Returns (generator): Each piece of the data, in order.
+        """
+        infile = self.volume.infile
+        for offset, length in self.get_extents():
+            while length > 0:
+                # seek every time, others may use the handle in between
+                infile.seek(offset)
+                buf = infile.read(min(length, bufsize))
+                if not buf:
+                    break
+                yield buf
+                offset += len(buf)
+                length -= len(buf)
+
+    def get_data_size(self):
+        """Finds how much data this file has without reading it.
+
+        Returns (int): Number of bytes iter_data() yields, less than the file
+            size if the chain ends early.
+        """
+        return sum(length for _, length in self.get_extents())
+
+    def get_extents(self):
+        """Finds where this file's data is in the image by following its
+        chain through the file allocation table, without reading it.
+
+        Returns ((int, int)[]): Offset into the image and length of each run
+            of consecutive clusters, in file order.
+        """
         fat = self.volume.file_allocation_table
         max_cluster = 0xfff0 if self.volume.fat16x else 0xfffffff0
         cluster = self.first_cluster
-        with open(path, 'wb') as f:
-            bufsize = self.volume.bytes_per_cluster
-            remains = self.file_size
-            while cluster <= max_cluster:
-                buf = self.volume.read_cluster(cluster)
-                wlen = min(remains, bufsize)
-                f.write(buf[:wlen])
-                remains -= wlen
-                cluster = fat[cluster]
+        bufsize = self.volume.bytes_per_cluster
+        remains = self.file_size
+        extents = []
+        while cluster <= max_cluster and remains > 0:
+            length = min(remains, bufsize)
+            offset = self.volume.cluster_to_physical_offset(cluster)
+            if extents and extents[-1][0] + extents[-1][1] == offset:
+                extents[-1][1] += length
+            else:
+                extents.append([offset, length])
+            remains -= length
+            cluster = fat[cluster]
+        return [(offset, length) for offset, length in extents]
+
+    def _write_file(self, path, manifest=None, dedupe=None, sparse=True):
+        key = None
+        if dedupe is not None:
+            key = dedupe.get_key(self)
+            if dedupe.write_duplicate(key, path, self, manifest):
+                return 0
+
+        if manifest is not None:
+            f = manifest.open(path, self)
+        elif sparse:
+            f = FatXSparseFile(open(path, 'wb'))
+        else:
+            # the kernel copies the data unless it has to be looked at
+            f = open(path, 'wb')
+        with f:
+            written = copy_extents(self.volume.infile, self.get_extents(), f)
+        if dedupe is not None:
+            dedupe.add(key, path, getattr(f, 'entry', None))
 
         try:
             self._set_ts(path)
         except:
             print("Failed to set timestamps.")
+        return written
 
     def _write_dir(self, path):
         if not os.path.exists(path):
             os.makedirs(path)
 
-    def write(self, path):
+    def write(self, path, manifest=None, dedupe=None, sparse=True):
+        """Writes this dirent out, without its children.
+
+        Returns (int): Number of bytes copied from the image, which is zero
+            for a directory or a linked or skipped duplicate.
+        """
         if self.is_directory():
             self._write_dir(path)
-        else:
-            self._write_file(path)
+            return 0
+        return self._write_file(path, manifest, dedupe, sparse)
 
-    def recover(self, path, undelete=False):
+    def recover(self, path, undelete=False, progress=None, manifest=None,
+                dedupe=None, sparse=True):
         """Conventionally extract the file using the file allocation table.
 
         Args:
             path (str): Output path.
             undelete (bool): Whether or not recover deleted files.
+            progress (FatXProgress): Reports each file written and the bytes
+                copied for it. The caller starts and finishes the task.
+            manifest (FatXManifest): Hashes each file as it is written.
+            dedupe (FatXDeduplicator): Links or skips files whose content
+                was already extracted.
+            sparse (bool): Whether to leave blocks of zeros as holes. If not,
+                the kernel copies files straight from the image.
         """
         if (self.is_deleted() and
                 undelete is False):
@@ -248,11 +396,14 @@ class FatXDirent:
             # create directory
             self.write(whole_path)
             for dirent in self.children:
-                dirent.recover(whole_path, undelete)
+                dirent.recover(whole_path, undelete, progress, manifest,
+                               dedupe, sparse)
             self._set_ts(whole_path)
         else:
-            self.write(whole_path)
             # dump regular file
+            written = self.write(whole_path, manifest, dedupe, sparse)
+            if progress is not None:
+                progress.update(written, 1)
 
     ###########################################
 
@@ -0,0 +1,121 @@
+from fatx.filesystem.transfer import copy_extents
+
+import logging
+
+
+LOG = logging.getLogger('FATX.FileSystem')
+
+# Amount of the volume copied between progress reports.
+EXPORT_CHUNK_SIZE = 0x4000000
+
+
+class FatXVolumeExport(object):
+    """Writes a volume out of a drive image as an image of its own.
+
+    A full export copies the whole range of the volume in one sequential
+    pass. A trimmed export only copies the header, the file allocation table
+    and the clusters it marks as allocated, and leaves free clusters as holes
+    in a sparse file, so it takes up far less space. Whatever free clusters
+    hold, such as deleted files, is not kept. Both are as long as the volume,
+    or as much of it as the image holds.
+
+    Args:
+        volume (FatXVolume): Volume to export. It need not be mounted.
+    """
+    def __init__(self, volume):
+        self.volume = volume
+
+    def get_length(self):
+        """Returns (int): Length of the exported image, which is less than the
+        volume's if the image ends first."""
+        volume = self.volume
+        infile = volume.infile
+        infile.seek(0, 2)
+        return max(0, min(volume.length, infile.tell() - volume.offset))
+
+    def get_allocated_cluster_runs(self):
+        """Returns ((int, int)[]): First cluster and number of clusters of each
+        run of clusters that are not free."""
+        # the header and the table are all that is needed, not the tree
+        self.volume.load_file_allocation_table()
+        runs = []
+        cluster = 1
+        for first, count in self.volume.get_free_cluster_runs():
+            if first > cluster:
+                runs.append((cluster, first - cluster))
+            cluster = first + count
+        if cluster < self.volume.max_clusters:
+            runs.append((cluster, self.volume.max_clusters - cluster))
+        return runs
+
+    def get_ranges(self, trim=False):
+        """Finds what to copy.
+
+        Args:
+            trim (bool): Whether to leave out free clusters.
+
+        Returns ((int, int)[]): Offset into the volume and length of each
+            range to copy, in order.
+        """
+        length = self.get_length()
+        if not trim:
+            return [(0, length)] if length else []
+
+        volume = self.volume
+        self.volume.load_file_allocation_table()
+        bpc = volume.bytes_per_cluster
+        # the header and the file allocation table
+        ranges = [(0, volume.file_area_byte_offset)]
+        for cluster, count in self.get_allocated_cluster_runs():
+            offset = volume.file_area_byte_offset + (cluster - 1) * bpc
+            ranges.append((offset, count * bpc))
+
+        # the last clusters may reach past the end of the volume
+        clipped = []
+        for offset, size in ranges:
+            size = min(size, length - offset)
+            if size > 0:
+                clipped.append((offset, size))
+        return clipped
+
+    def write(self, path, trim=False, progress=None):
+        """Exports the volume.
+
+        Args:
+            path (str): Image file to create.
+            trim (bool): Whether to leave free clusters out as holes.
+            progress (FatXProgress): Reports the bytes copied.
+
+        Returns (int): Number of bytes copied.
+        """
+        volume = self.volume
+        ranges = self.get_ranges(trim)
+        length = self.get_length()
+        copied = 0
+        with volume.metrics.phase('export'):
+            if progress is not None:
+                progress.start('export',
+                               total_bytes=sum(size for _, size in ranges))
+            with open(path, 'wb') as outfile:
+                for offset, size in ranges:
+                    outfile.seek(offset)
+                    for start in xrange(offset, offset + size,
+                                        EXPORT_CHUNK_SIZE):
+                        count = min(EXPORT_CHUNK_SIZE, offset + size - start)
+                        extent = (volume.byte_offset_to_physical_offset(start),
+                                  count)
+                        written = copy_extents(volume.infile, [extent],
+                                               outfile)
+                        copied += written
+                        if progress is not None:
+                            progress.update(written)
+                        if written < count:
+                            break
+                # free clusters at the end are only holes once extended
+                outfile.truncate(length)
+            volume.metrics.count('bytes_exported', copied)
+            if progress is not None:
+                progress.finish()
+        LOG.info('Exported %d of %d bytes of %s.', copied, length,
+                 volume.name)
+        return copied
@@ -0,0 +1,239 @@
+from fatx.filesystem.constants import DIRENT_DELETED, FILE_ATTRIBUTE_DIRECTORY
+
+import fnmatch
+import bisect
+import array
+import json
+import sys
+import re
+import os
+
+
+# The index is saved little endian whatever the machine is.
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+# Files a name index is saved in, next to the table's.
+_INDEX_SCHEMA = 'name_index.json'
+
+
+class FatXNameIndex(object):
+    """Index of the names in a FatXDirentTable, for finding rows by name
+    without looking at every row.
+
+    Names are matched without regard to case. Each distinct name is kept once
+    in sorted order, so a glob only looks at the names starting with its
+    literal prefix and a regular expression only looks at each distinct name
+    once.
+
+    The index can be saved next to the table it was built from, so that it is
+    only built once per volume.
+
+    Args:
+        names (str[]): Name of each row, as in FatXDirentTable.names.
+    """
+    def __init__(self, names=()):
+        self.rows = {}
+        for row, name in enumerate(names):
+            name = name.lower()
+            rows = self.rows.get(name)
+            if rows is None:
+                self.rows[name] = [row]
+            else:
+                rows.append(row)
+        self.names = sorted(self.rows)
+
+    def save(self, directory):
+        """Writes the sorted names back to back with where each one ends, the
+        rows of each name one after another with where each name's rows end,
+        and a JSON schema describing them.
+
+        Args:
+            directory (str): Directory to write the files into, usually the
+                one FatXDirentTable.save() wrote the table into.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        name_ends = array.array('I')
+        rows = array.array('I')
+        row_ends = array.array('I')
+        end = 0
+        for name in self.names:
+            end += len(name)
+            name_ends.append(end)
+            rows.extend(self.rows[name])
+            row_ends.append(len(rows))
+
+        schema = dict(names=len(self.names), rows=len(rows),
+                      files=dict(names='name_index_names.bin'))
+        with open(os.path.join(directory, 'name_index_names.bin'), 'wb') as f:
+            f.write(''.join(self.names))
+        for key, data in (('name_ends', name_ends), ('rows', rows),
+                          ('row_ends', row_ends)):
+            path = 'name_index_' + key + '.bin'
+            if _BIG_ENDIAN:
+                data.byteswap()
+            with open(os.path.join(directory, path), 'wb') as f:
+                data.tofile(f)
+            schema['files'][key] = path
+
+        with open(os.path.join(directory, _INDEX_SCHEMA), 'w') as f:
+            json.dump(schema, f, indent=1, separators=(',', ': '))
+
+    @classmethod
+    def load(cls, directory):
+        """Reads an index written by save().
+
+        Returns (FatXNameIndex): The index, or None if none was saved there.
+        """
+        path = os.path.join(directory, _INDEX_SCHEMA)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            schema = json.load(f)
+
+        def read(key, count):
+            data = array.array('I')
+            with open(os.path.join(directory, schema['files'][key]),
+                      'rb') as f:
+                data.fromfile(f, count)
+            if _BIG_ENDIAN:
+                data.byteswap()
+            return data
+
+        name_ends = read('name_ends', schema['names'])
+        rows = read('rows', schema['rows'])
+        row_ends = read('row_ends', schema['names'])
+        with open(os.path.join(directory, schema['files']['names']),
+                  'rb') as f:
+            names = f.read()
+
+        index = cls()
+        name_start = 0
+        row_start = 0
+        for name_end, row_end in zip(name_ends, row_ends):
+            name = names[name_start:name_end]
+            index.names.append(name)
+            index.rows[name] = rows[row_start:row_end].tolist()
+            name_start = name_end
+            row_start = row_end
+        return index
+
+    def get(self, name):
+        """Returns (int[]): Rows with exactly this name."""
+        return self.rows.get(name.lower(), [])
+
+    def glob(self, pattern):
+        """Returns (int[]): Rows whose name matches a shell style pattern."""
+        pattern = pattern.lower()
+        prefix = re.split(r'[*?\[]', pattern, 1)[0]
+        if prefix == pattern:
+            return sorted(self.get(pattern))
+
+        rows = []
+        names = self.names
+        for i in xrange(bisect.bisect_left(names, prefix), len(names)):
+            name = names[i]
+            if not name.startswith(prefix):
+                break
+            if fnmatch.fnmatchcase(name, pattern):
+                rows.extend(self.rows[name])
+        rows.sort()
+        return rows
+
+    def search(self, pattern):
+        """Returns (int[]): Rows whose name contains a match of a regular
+        expression."""
+        search = re.compile(pattern, re.IGNORECASE).search
+        rows = []
+        for name in self.names:
+            if search(name):
+                rows.extend(self.rows[name])
+        rows.sort()
+        return rows
+
+
+class FatXQuery(object):
+    """Predicates on dirents, all of which a dirent must match to be found.
+
+    Predicates on metadata are run over whole table columns at once, the
+    name is looked up in a FatXNameIndex.
+
+    Args:
+        name (str): Shell style pattern, or regular expression if regex is
+            set, that the name must match.
+        regex (bool): Whether name is a regular expression.
+        min_size (int): Smallest file size.
+        max_size (int): Largest file size.
+        directories (bool): True to only find directories, False to only
+            find files.
+        attributes (int): Attribute bits that must all be set.
+        deleted (bool): True to only find deleted dirents, False to only find
+            dirents that are not.
+        newer (datetime.date): Last written on or after this date.
+        older (datetime.date): Last written before this date.
+    """
+    def __init__(self, name=None, regex=False, min_size=None, max_size=None,
+                 directories=None, attributes=0, deleted=None,
+                 newer=None, older=None):
+        self.name = name
+        self.regex = regex
+        self.min_size = min_size
+        self.max_size = max_size
+        self.directories = directories
+        self.attributes = attributes
+        self.deleted = deleted
+        self.newer = newer
+        self.older = older
+
+    def get_conditions(self, table):
+        """Returns ((str, str, int)[]): The metadata predicates as conditions
+        for FatXDirentTable.where()."""
+        conditions = []
+        if self.min_size is not None:
+            conditions.append(('size', '>=', self.min_size))
+        if self.max_size is not None:
+            conditions.append(('size', '<=', self.max_size))
+        if self.directories is not None:
+            conditions.append(('attributes',
+                               '&' if self.directories else '!&',
+                               FILE_ATTRIBUTE_DIRECTORY))
+        # test each bit on its own so that all of them must be set
+        for bit in xrange(8):
+            if self.attributes & (1 << bit):
+                conditions.append(('attributes', '&', 1 << bit))
+        if self.deleted is not None:
+            conditions.append(('name_length',
+                               '==' if self.deleted else '!=',
+                               DIRENT_DELETED))
+        if self.newer is not None:
+            conditions.append(('last_write_time', '>=', table.pack_time(
+                self.newer.year, self.newer.month, self.newer.day)))
+        if self.older is not None:
+            conditions.append(('last_write_time', '<', table.pack_time(
+                self.older.year, self.older.month, self.older.day)))
+        return conditions
+
+    def find(self, table, index=None):
+        """Finds the rows of a table that match.
+
+        Args:
+            table (FatXDirentTable): Table to search.
+            index (FatXNameIndex): Index of the table's names. Built if
+                needed and not given.
+
+        Returns (generator): Matching rows, in the order the tree is walked.
+        """
+        rows = None
+        if self.name is not None:
+            if index is None:
+                index = FatXNameIndex(table.names)
+            if self.regex:
+                rows = index.search(self.name)
+            else:
+                rows = index.glob(self.name)
+            if table.numpy is not None:
+                rows = table.numpy.array(rows, dtype='int64')
+
+        for row in table.where(self.get_conditions(table), rows):
+            yield row
@@ -0,0 +1,206 @@
+from fatx.filesystem.transfer import FatXSparseFile
+
+from threading import Thread
+from Queue import Queue
+import hashlib
+import csv
+
+
+# Digests computed for every file by default.
+HASH_ALGORITHMS = ('md5', 'sha1', 'sha256')
+
+
+def _format_time_stamp(time_stamp):
+    if time_stamp is None:
+        return ''
+    return '{:04}-{:02}-{:02} {:02}:{:02}:{:02}'.format(
+        time_stamp.year, time_stamp.month, time_stamp.day,
+        time_stamp.hour, time_stamp.min, time_stamp.sec)
+
+
+class _ManifestEntry(object):
+    # hashes are replaced by their hex digests once the file is complete
+    __slots__ = ('path', 'size', 'first_cluster', 'times', 'hashes',
+                 'original')
+
+    def __init__(self, path, first_cluster, times, hashes, original=None):
+        self.path = path
+        self.size = 0
+        self.first_cluster = first_cluster
+        self.times = times
+        self.hashes = hashes
+        self.original = original
+
+
+class FatXHashingFile(object):
+    """Output file that hands everything written to it to the hashing thread
+    of a manifest.
+
+    It has no fileno() so that copy_range() passes the data through write()
+    instead of having the kernel copy it unseen.
+
+    Args:
+        manifest (FatXManifest): Manifest that hashes the data.
+        path (str): Path of the file to create.
+        entry (_ManifestEntry): Entry that the hashes go into.
+    """
+    def __init__(self, manifest, path, entry):
+        self._file = FatXSparseFile(open(path, 'wb'))
+        self._queue = manifest.queue
+        self.entry = entry
+
+    def write(self, data):
+        self._file.write(data)
+        if data:
+            # buffers are reused once written, so hash a copy
+            if not isinstance(data, str):
+                data = str(data)
+            self._queue.put((self.entry, data))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        # tells the hashing thread that the file is complete
+        self._queue.put((self.entry, None))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FatXManifest(object):
+    """Manifest of extracted files with their hashes, computed from the data
+    as it is written rather than by reading the files back.
+
+    Hashing runs on a thread of its own, fed through a bounded queue, so that
+    writing only waits on hashing when the queue is full. The manifest is a
+    CSV file with one line per file, written once the file is closed. Files
+    hard linked to another instead of being written are listed with the
+    hashes of, and the path of, the file they are linked to.
+
+    Args:
+        path (str): Path of the manifest to write.
+        algorithms (str[]): Names of the hashlib digests to compute.
+        queue_size (int): Maximum number of chunks waiting to be hashed.
+    """
+    def __init__(self, path, algorithms=HASH_ALGORITHMS, queue_size=256):
+        self.algorithms = tuple(algorithms)
+        self.queue = Queue(queue_size)
+        self.files = 0
+        self.error = None
+
+        self._file = open(path, 'wb')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(['path', 'size', 'first_cluster'] +
+                              list(self.algorithms) +
+                              ['creation_time', 'last_write_time',
+                               'last_access_time', 'duplicate_of'])
+
+        self._thread = Thread(target=self._work)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _get_entry(self, path, dirent, first_cluster, hashes, original=None):
+        times = ('', '', '')
+        if dirent is not None:
+            first_cluster = dirent.first_cluster
+            times = (_format_time_stamp(dirent.creation_time),
+                     _format_time_stamp(dirent.last_write_time),
+                     _format_time_stamp(dirent.last_access_time))
+        return _ManifestEntry(path, first_cluster, times, hashes, original)
+
+    def open(self, path, dirent=None, first_cluster=None):
+        """Creates a file whose contents are hashed into this manifest.
+
+        Args:
+            path (str): Path of the file to create.
+            dirent (FatXDirent): Dirent the file is extracted from, for its
+                first cluster and time stamps.
+            first_cluster (int): First cluster of the data, when there is no
+                dirent.
+
+        Returns (FatXHashingFile):
+        """
+        entry = self._get_entry(path, dirent, first_cluster,
+                                [hashlib.new(algorithm)
+                                 for algorithm in self.algorithms])
+        return FatXHashingFile(self, path, entry)
+
+    def add_duplicate(self, path, original, dirent=None, first_cluster=None):
+        """Lists a file that has the same content as one already written
+        through this manifest.
+
+        Args:
+            path (str): Path of the file.
+            original (_ManifestEntry): Entry of the file written, as in
+                FatXHashingFile.entry.
+            dirent (FatXDirent): Dirent the file is extracted from.
+            first_cluster (int): First cluster of the data, when there is no
+                dirent.
+        """
+        entry = self._get_entry(path, dirent, first_cluster, None, original)
+        # queued after the original's last chunk, so its hashes are done
+        self.queue.put((entry, None))
+
+    def _work(self):
+        while True:
+            entry, data = self.queue.get()
+            if entry is None:
+                return
+            # after an error the queue is still emptied, so writers never
+            # block on it
+            if self.error is not None:
+                continue
+            try:
+                self._add(entry, data)
+            except Exception as e:
+                self.error = e
+
+    def _add(self, entry, data):
+        if data is not None:
+            entry.size += len(data)
+            for digest in entry.hashes:
+                digest.update(data)
+            return
+
+        original = entry.original
+        if original is None:
+            entry.hashes = [digest.hexdigest() for digest in entry.hashes]
+        else:
+            entry.size = original.size
+            entry.hashes = original.hashes
+
+        first_cluster = entry.first_cluster
+        self._writer.writerow(
+            [entry.path, entry.size,
+             '' if first_cluster is None else first_cluster] +
+            entry.hashes + list(entry.times) +
+            ['' if original is None else original.path])
+        self.files += 1
+
+    def close(self):
+        """Waits for every file to be hashed and closes the manifest.
+
+        Raises the first error the hashing thread ran into, such as the disk
+        being full.
+        """
+        if self._thread is None:
+            return
+        self.queue.put((None, None))
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,142 @@
+from contextlib import contextmanager
+import time
+import os
+
+
+class FatXMetrics(object):
+    """Counters and phase timings collected while working on a drive.
+
+    Counters are plain totals such as bytes read or dirents decoded.
+    Rejections count orphan candidates by the validation rule that rejected
+    them. Phases accumulate wall and CPU time each time they are entered.
+
+    Args:
+        profiler (FatXProfiler): If given, each phase is also profiled.
+    """
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+        self.counters = {}
+        self.rejections = {}
+        self.phases = {}
+        self.phase_order = []
+
+    def count(self, name, amount=1):
+        """Adds amount to a counter."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reject(self, rule, amount=1):
+        """Adds amount to the candidates rejected by a validation rule."""
+        if amount:
+            self.rejections[rule] = self.rejections.get(rule, 0) + amount
+
+    def add_phase_time(self, name, wall, cpu):
+        """Adds time spent in a phase."""
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = dict(wall=0.0, cpu=0.0, calls=0)
+            self.phase_order.append(name)
+        phase['wall'] += wall
+        phase['cpu'] += cpu
+        phase['calls'] += 1
+
+    @contextmanager
+    def phase(self, name):
+        """Times the code run inside of a with block as a phase.
+
+        CPU time is that of the whole process, so it includes any threads
+        working at the same time.
+
+        Args:
+            name (str): Name of the phase, e.g. 'fat_load' or 'orphan_scan'.
+        """
+        if self.profiler is not None:
+            self.profiler.start_phase(name)
+        wall = time.time()
+        cpu = sum(os.times()[:2])
+        try:
+            yield
+        finally:
+            self.add_phase_time(name,
+                                time.time() - wall,
+                                sum(os.times()[:2]) - cpu)
+            if self.profiler is not None:
+                self.profiler.stop_phase(name)
+
+    def to_dict(self):
+        """Returns (dict): Every metric, ready to be dumped as JSON."""
+        return dict(counters=dict(self.counters),
+                    rejections=dict(self.rejections),
+                    phases=[dict(self.phases[name], name=name)
+                            for name in self.phase_order])
+
+    def print_metrics(self):
+        """Print every metric."""
+        def print_aligned(header, value=''):
+            print("{:<26} {}".format(header, value))
+
+        print_aligned("Counters:")
+        for name, value in sorted(self.counters.items()):
+            print_aligned("  " + name, value)
+        print("")
+
+        if self.rejections:
+            print_aligned("Rejected Candidates:")
+            for rule, value in sorted(self.rejections.items()):
+                print_aligned("  " + rule, value)
+            print("")
+
+        print_aligned("Phases:", "{:>10} {:>10} {:>6}".format(
+            "Wall (s)", "CPU (s)", "Calls"))
+        for name in self.phase_order:
+            phase = self.phases[name]
+            print_aligned("  " + name, "{:>10.3f} {:>10.3f} {:>6}".format(
+                phase['wall'], phase['cpu'], phase['calls']))
+        print("")
+
+
+class FatXMeteredFile(object):
+    """Wraps an image file object, counting reads and seeks into metrics.
+
+    Everything other than read(), readinto() and seek() is passed through to
+    the wrapped file, including fileno(), so data the kernel copies straight
+    from the image is counted through count_copied() instead.
+
+    Args:
+        fo (file): Image file object.
+        metrics (FatXMetrics): Metrics to count into.
+    """
+    def __init__(self, fo, metrics):
+        self._file = fo
+        self._counters = metrics.counters
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        counters = self._counters
+        counters['read_calls'] = counters.get('read_calls', 0) + 1
+        counters['bytes_read'] = counters.get('bytes_read', 0) + len(data)
+        return data
+
+    def readinto(self, buf):
+        count = self._file.readinto(buf)
+        counters = self._counters
+        counters['read_calls'] = counters.get('read_calls', 0) + 1
+        counters['bytes_read'] = counters.get('bytes_read', 0) + (count or 0)
+        return count
+
+    def count_copied(self, count):
+        """Counts a range the kernel copied from the file as one read.
+
+        Args:
+            count (int): Number of bytes copied.
+        """
+        counters = self._counters
+        counters['read_calls'] = counters.get('read_calls', 0) + 1
+        counters['bytes_read'] = counters.get('bytes_read', 0) + count
+
+    def seek(self, offset, whence=0):
+        counters = self._counters
+        counters['seeks'] = counters.get('seeks', 0) + 1
+        return self._file.seek(offset, whence)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
@@ -0,0 +1,165 @@
+from fatx.filesystem.transfer import copy_range, FatXSparseFile
+
+from collections import OrderedDict
+import logging
+import os
+
+
+LOG = logging.getLogger('FATX.FileSystem')
+
+# Output files kept open at once while extents are written out of order.
+MAX_OPEN_FILES = 64
+
+
+class FatXOrderedExtractor(object):
+    """Extracts files reading the image in the order their data is stored.
+
+    Extracting file by file reads each file's clusters wherever they are,
+    so a fragmented volume makes the image seek back and forth. Instead, the
+    tree is created first and the extents of every file are gathered, then
+    all extents are read in one sweep by offset and written into their files
+    out of order, the way an elevator serves floors. Time stamps are set once
+    everything is written, since writing files changes the times of the
+    directories holding them.
+
+    Files end up exactly as FatXDirent.recover() and FatXOrphan.recover()
+    write them.
+
+    Args:
+        volume (FatXVolume): Volume the files are read from.
+        max_open_files (int): Output files kept open at once.
+        sparse (bool): Whether to leave blocks of zeros as holes. If not,
+            the kernel copies extents straight from the image.
+    """
+    def __init__(self, volume, max_open_files=MAX_OPEN_FILES, sparse=True):
+        self.volume = volume
+        self.max_open_files = max_open_files
+        self.sparse = sparse
+        self.directories = []   # (path, dirent) in the order created
+        self.files = []         # (path, dirent)
+        self.extents = []       # (offset, length, file index, file offset)
+        self._remaining = []    # extents left to write for each file
+        self._open_files = OrderedDict()
+
+    def add(self, dirent, path, undelete=False):
+        """Creates a dirent's directories and empty files, and plans reading
+        its data.
+
+        Args:
+            dirent (FatXDirent): Dirent to extract. Orphans are read from the
+                clusters following their first one.
+            path (str): Directory to extract it into.
+            undelete (bool): Whether to extract files marked as deleted.
+        """
+        stack = [(dirent, path)]
+        while stack:
+            dirent, path = stack.pop()
+            if dirent.is_deleted() and not undelete:
+                continue
+            whole_path = path + '/' + dirent.file_name
+            if dirent.is_directory():
+                if not os.path.exists(whole_path):
+                    try:
+                        os.makedirs(whole_path)
+                    except (OSError, IOError):
+                        LOG.exception('Failed to create directory: %s',
+                                      whole_path)
+                        continue
+                self.directories.append((whole_path, dirent))
+                stack.extend((child, whole_path)
+                             for child in reversed(dirent.children))
+            else:
+                self._add_file(dirent, whole_path)
+
+    def _add_file(self, dirent, path):
+        try:
+            open(path, 'wb').close()
+        except (OSError, IOError):
+            LOG.exception('Failed to create file: %s', path)
+            return
+        index = len(self.files)
+        self.files.append((path, dirent))
+        file_offset = 0
+        extents = dirent.get_extents()
+        for offset, length in extents:
+            self.extents.append((offset, length, index, file_offset))
+            file_offset += length
+        self._remaining.append(len(extents))
+
+    def _get_file(self, index):
+        f = self._open_files.pop(index, None)
+        if f is None:
+            if len(self._open_files) >= self.max_open_files:
+                self._open_files.popitem(last=False)[1].close()
+            f = open(self.files[index][0], 'r+b')
+            if self.sparse:
+                f = FatXSparseFile(f)
+        # most recently used last
+        self._open_files[index] = f
+        return f
+
+    def _close_file(self, index):
+        f = self._open_files.pop(index, None)
+        if f is not None:
+            f.close()
+
+    def _write_extent(self, offset, length, index, file_offset):
+        f = self._get_file(index)
+        f.seek(file_offset)
+        return copy_range(self.volume.infile, offset, length, f)
+
+    def _set_time_stamps(self, path, dirent):
+        try:
+            dirent._set_ts(path)
+        except (OSError, ValueError, OverflowError, AttributeError):
+            LOG.warning('Failed to set timestamps: %s', path)
+
+    def run(self, progress=None):
+        """Reads every planned extent in order of offset and writes it into
+        its file, then sets the time stamps.
+
+        Args:
+            progress (FatXProgress): Reports the bytes written, and each file
+                once all of it is written. The caller starts and finishes
+                the task.
+        """
+        extents = sorted(self.extents)
+        LOG.info('Extracting %d files from %d extents in order of offset.',
+                 len(self.files), len(extents))
+        # files without data are complete already
+        if progress is not None:
+            progress.update(0, self._remaining.count(0))
+
+        bpc = self.volume.bytes_per_cluster
+        seeks = 0
+        position = None
+        try:
+            for offset, length, index, file_offset in extents:
+                # skipping the unused end of a cluster is not a seek
+                if position is None or not 0 <= offset - position < bpc:
+                    seeks += 1
+                path = self.files[index][0]
+                try:
+                    written = self._write_extent(offset, length, index,
+                                                 file_offset)
+                except (OSError, IOError):
+                    LOG.exception('Failed to write file: %s', path)
+                    written = 0
+                position = offset + length
+                self._remaining[index] -= 1
+                if self._remaining[index] == 0:
+                    self._close_file(index)
+                if progress is not None:
+                    progress.update(written,
+                                    1 if self._remaining[index] == 0 else 0)
+        finally:
+            for index in list(self._open_files):
+                self._close_file(index)
+        self.volume.metrics.count('ordered_extents', len(extents))
+        self.volume.metrics.count('ordered_seeks', seeks)
+
+        for path, dirent in self.files:
+            self._set_time_stamps(path, dirent)
+        # deepest directories first, so setting them changes no parent
+        for path, dirent in reversed(self.directories):
+            self._set_time_stamps(path, dirent)
@@ -0,0 +1,194 @@
+from threading import Thread, Event
+import threading
+import cProfile
+import pstats
+import sys
+
+
+# Trace every function call with cProfile. Exact, but slows the run down.
+PROFILE_DETERMINISTIC = 'deterministic'
+# Look at the profiled thread's stack at an interval. Cheap enough to leave
+# running through scans that take hours.
+PROFILE_SAMPLING = 'sampling'
+
+
+def _get_function_name(code):
+    return "{}:{}({})".format(code.co_filename, code.co_firstlineno,
+                              code.co_name)
+
+
+class _Sampler(object):
+    """Samples the stack of a single thread from a background thread.
+
+    Args:
+        ident (int): Identifier of the thread to sample.
+        interval (float): Seconds between samples.
+    """
+    def __init__(self, ident, interval):
+        self.ident = ident
+        self.interval = interval
+        self.samples = 0
+        self.own = {}       # samples with the function on top of the stack
+        self.total = {}     # samples with the function anywhere on the stack
+        self.stacks = {}    # samples of each whole stack, outermost first
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(_get_function_name(frame.f_code))
+                frame = frame.f_back
+
+            self.samples += 1
+            self.own[stack[0]] = self.own.get(stack[0], 0) + 1
+            for name in set(stack):
+                self.total[name] = self.total.get(name, 0) + 1
+            stack = ';'.join(reversed(stack))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+
+class FatXProfiler(object):
+    """Profiles each phase timed by FatXMetrics separately.
+
+    Phases entered more than once add to the same profile. When a phase is
+    entered while another is being profiled, the outer phase is paused until
+    the inner one is done.
+
+    In deterministic mode each phase is written as a pstats file that can be
+    loaded with pstats or a viewer such as snakeviz. In sampling mode each
+    phase is written as collapsed stacks, one stack and its sample count per
+    line, which flame graph tools read.
+
+    Only the thread that enters a phase is profiled. Worker processes and
+    threads started during the phase are not.
+
+    Args:
+        prefix (str): Path prefix of the files written, e.g. 'profile/run'
+            writes 'profile/run.orphan_scan.pstats'.
+        mode (str): PROFILE_DETERMINISTIC or PROFILE_SAMPLING.
+        interval (float): Seconds between samples in sampling mode.
+    """
+    def __init__(self, prefix, mode=PROFILE_DETERMINISTIC, interval=0.005):
+        if mode not in (PROFILE_DETERMINISTIC, PROFILE_SAMPLING):
+            raise ValueError("Valid profile modes are {} or {}.".format(
+                PROFILE_DETERMINISTIC, PROFILE_SAMPLING))
+        self.prefix = prefix
+        self.mode = mode
+        self.interval = interval
+        self.profiles = {}
+        self.phase_order = []
+        self._active = []
+
+    def _get_profile(self, name):
+        profile = self.profiles.get(name)
+        if profile is None:
+            if self.mode == PROFILE_DETERMINISTIC:
+                profile = cProfile.Profile()
+            else:
+                profile = _Sampler(threading.current_thread().ident,
+                                   self.interval)
+            self.profiles[name] = profile
+            self.phase_order.append(name)
+        return profile
+
+    def _start(self, profile):
+        if self.mode == PROFILE_DETERMINISTIC:
+            profile.enable()
+        else:
+            profile.start()
+
+    def _stop(self, profile):
+        if self.mode == PROFILE_DETERMINISTIC:
+            profile.disable()
+        else:
+            profile.stop()
+
+    def start_phase(self, name):
+        """Starts profiling a phase, pausing the phase being profiled."""
+        if self._active:
+            self._stop(self._active[-1])
+        profile = self._get_profile(name)
+        self._active.append(profile)
+        self._start(profile)
+
+    def stop_phase(self, name):
+        """Stops profiling a phase, resuming the phase it interrupted."""
+        self._stop(self._active.pop())
+        if self._active:
+            self._start(self._active[-1])
+
+    def get_path(self, name):
+        """Returns (str): Path that a phase's profile is written to."""
+        extension = 'pstats' if self.mode == PROFILE_DETERMINISTIC \
+            else 'folded'
+        return "{}.{}.{}".format(self.prefix, name, extension)
+
+    def write(self):
+        """Writes the profile of each phase to its own file."""
+        for name in self.phase_order:
+            profile = self.profiles[name]
+            path = self.get_path(name)
+            if self.mode == PROFILE_DETERMINISTIC:
+                profile.dump_stats(path)
+            else:
+                with open(path, 'w') as f:
+                    for stack, count in sorted(profile.stacks.items()):
+                        f.write("{} {}\n".format(stack, count))
+
+    def get_top_functions(self, name, count=10):
+        """Returns the functions that a phase spent the most time in.
+
+        Args:
+            name (str): Name of the phase.
+            count (int): Maximum number of functions returned.
+
+        Returns ((str, float, float)[]): Name of each function with the time
+            spent in the function itself and the time spent in it including
+            what it called. Time is in seconds in deterministic mode and in
+            number of samples in sampling mode.
+        """
+        profile = self.profiles[name]
+        if self.mode == PROFILE_DETERMINISTIC:
+            stats = pstats.Stats(profile).stats
+            functions = [("{}:{}({})".format(*function), own, total)
+                         for function, (_, _, own, total, _)
+                         in stats.items()]
+        else:
+            functions = [(function, profile.own.get(function, 0), total)
+                         for function, total in profile.total.items()]
+        functions.sort(key=lambda function: function[1], reverse=True)
+        return functions[:count]
+
+    def print_summary(self, count=10):
+        """Print the top functions of each phase."""
+        if self.mode == PROFILE_DETERMINISTIC:
+            unit = 'seconds'
+            line = "  {:>10.3f} {:>10.3f}  {}"
+        else:
+            unit = 'samples'
+            line = "  {:>10} {:>10}  {}"
+
+        for name in self.phase_order:
+            print("Phase: {} ({})".format(name, self.get_path(name)))
+            print("  {:>10} {:>10}  {}".format("Own", "Total",
+                                               "Function (" + unit + ")"))
+            for function, own, total in self.get_top_functions(name, count):
+                print(line.format(own, total, function))
+            print("")
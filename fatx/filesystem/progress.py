@@ -0,0 +1,143 @@
+from threading import Lock
+import time
+import sys
+
+
+class FatXProgressEvent(object):
+    """Snapshot of the progress of a task, as handed to listeners.
+
+    Attributes:
+        task (str): Name of the task, e.g. 'orphan_scan' or 'extract'.
+        bytes_done (int): Bytes processed so far.
+        total_bytes (int): Bytes the task will process, or None if unknown.
+        items (int): Items found or written so far.
+        total_items (int): Items the task will go through, or None if
+            unknown.
+        elapsed (float): Seconds since the task started.
+        rate (float): Bytes processed per second.
+        eta (float): Seconds until the task is done, or None if unknown.
+        finished (bool): Whether this is the last event of the task.
+    """
+    def __init__(self, task, bytes_done, total_bytes, items, total_items,
+                 elapsed, finished):
+        self.task = task
+        self.bytes_done = bytes_done
+        self.total_bytes = total_bytes
+        self.items = items
+        self.total_items = total_items
+        self.elapsed = elapsed
+        self.finished = finished
+
+        self.rate = bytes_done / elapsed if elapsed > 0 else 0.0
+        self.eta = None
+        if finished:
+            self.eta = 0.0
+        elif total_bytes and bytes_done and self.rate > 0:
+            self.eta = (total_bytes - bytes_done) / self.rate
+        elif total_items and items:
+            self.eta = elapsed * (total_items - items) / float(items)
+
+    def get_fraction(self):
+        """Returns (float): How much of the task is done, between 0 and 1, or
+        None if the total is unknown."""
+        if self.total_bytes:
+            return min(1.0, self.bytes_done / float(self.total_bytes))
+        if self.total_items:
+            return min(1.0, self.items / float(self.total_items))
+        return None
+
+    def __str__(self):
+        fraction = self.get_fraction()
+        if self.total_bytes or self.bytes_done:
+            text = "{}: {:.1f} MB".format(self.task,
+                                          self.bytes_done / 1048576.0)
+            if fraction is not None:
+                text += " ({:.0%})".format(fraction)
+            text += ", {:.1f} MB/s, {} items".format(self.rate / 1048576.0,
+                                                     self.items)
+        else:
+            text = "{}: {} items".format(self.task, self.items)
+            if fraction is not None:
+                text += " ({:.0%})".format(fraction)
+        if self.finished:
+            text += ", done in {:.1f}s".format(self.elapsed)
+        elif self.eta is not None:
+            text += ", ETA {:.0f}s".format(self.eta)
+        return text
+
+
+class FatXProgress(object):
+    """Tracks the progress of one task at a time and reports it to a
+    listener.
+
+    Work is reported with update() as often as is convenient. The listener is
+    only called once every interval seconds and when a task finishes, so that
+    reporting from a hot loop costs no more than adding to two counters and
+    reading the clock. Updates may come from several threads.
+
+    Args:
+        listener (callable): Called with a FatXProgressEvent. It is called
+            from whichever thread did the work, so GUIs should hand events
+            over to their own thread.
+        interval (float): Minimum number of seconds between events.
+    """
+    def __init__(self, listener, interval=0.5):
+        self.listener = listener
+        self.interval = interval
+        self.task = None
+        self.total_bytes = None
+        self.total_items = None
+        self.bytes_done = 0
+        self.items = 0
+        self._started = 0.0
+        self._next_event = 0.0
+        self._lock = Lock()
+
+    def start(self, task, total_bytes=None, total_items=None):
+        """Starts tracking a new task.
+
+        Args:
+            task (str): Name of the task.
+            total_bytes (int): Bytes the task will process, if known.
+            total_items (int): Items the task will go through, if known.
+        """
+        self.task = task
+        self.total_bytes = total_bytes
+        self.total_items = total_items
+        self.bytes_done = 0
+        self.items = 0
+        self._started = time.time()
+        self._next_event = self._started + self.interval
+        self._emit(False)
+
+    def update(self, bytes_done=0, items=0):
+        """Reports work done since the last update.
+
+        Args:
+            bytes_done (int): Bytes processed.
+            items (int): Items found or written.
+        """
+        with self._lock:
+            self.bytes_done += bytes_done
+            self.items += items
+            if time.time() < self._next_event:
+                return
+            self._next_event = time.time() + self.interval
+        self._emit(False)
+
+    def finish(self):
+        """Reports that the current task is done."""
+        self._emit(True)
+
+    def _emit(self, finished):
+        self.listener(FatXProgressEvent(self.task,
+                                        self.bytes_done, self.total_bytes,
+                                        self.items, self.total_items,
+                                        time.time() - self._started,
+                                        finished))
+
+
+def print_progress(event, stream=sys.stderr):
+    """Listener that writes each event on its own line."""
+    stream.write(str(event) + '\n')
+    stream.flush()
@@ -0,0 +1,373 @@
+from fatx.filesystem.constants import DIRENT_DELETED, FILE_ATTRIBUTE_DIRECTORY
+
+import operator
+import array
+import json
+import csv
+import sys
+import os
+
+try:
+    import numpy
+except ImportError:
+    # columns are kept in arrays and queried with plain Python instead
+    numpy = None
+
+
+# Name and array typecode of each column, in the order they are stored.
+COLUMNS = [
+    ('parent', 'i'),            # row of the parent directory, -1 at the root
+    ('top_level', 'i'),         # row of the root level ancestor, or itself
+    ('name_length', 'B'),
+    ('attributes', 'B'),
+    ('first_cluster', 'I'),
+    ('size', 'I'),
+    ('creation_time', 'I'),     # time stamps are kept packed, which
+    ('last_write_time', 'I'),   # sorts them in time order
+    ('last_access_time', 'I'),
+    ('cluster', 'i'),           # cluster an orphan was found in, or -1
+]
+
+# Flat files are little endian whatever the machine is.
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+class FatXDirentTable(object):
+    """Metadata of every dirent of a tree, stored column by column.
+
+    Queries run over whole columns at once instead of walking
+    FatXDirent.children. With NumPy installed the columns are NumPy arrays
+    and queries are vectorized, otherwise they are arrays queried in plain
+    Python. Either way the methods take and return the same things, with
+    rows being NumPy arrays or lists of row numbers respectively.
+
+    Rows are numbered in the order the tree is walked, so a directory always
+    comes before its children.
+
+    A table built from a volume keeps FatXVolume.get_identity() in identity,
+    which is saved along with it so a saved table can be checked against
+    the volume before it is used instead of the volume.
+
+    Args:
+        epoch (int): Year that time stamp years are relative to.
+        use_numpy (bool): Whether to use NumPy if it is installed.
+    """
+    def __init__(self, epoch, use_numpy=True):
+        self.epoch = epoch
+        self.numpy = numpy if use_numpy else None
+        self.columns = dict((name, array.array(typecode))
+                            for name, typecode in COLUMNS)
+        self.names = []
+        self.identity = None
+        self._paths = {}
+
+    @classmethod
+    def from_dirents(cls, dirents, epoch, use_numpy=True):
+        """Builds a table from a tree of dirents.
+
+        Args:
+            dirents (FatXDirent[]): Dirents at the root of the tree, such as
+                FatXVolume.get_root() or FatXAnalyzer.get_roots().
+            epoch (int): Year that time stamp years are relative to.
+            use_numpy (bool): Whether to use NumPy if it is installed.
+
+        Returns (FatXDirentTable):
+        """
+        table = cls(epoch, use_numpy)
+        columns = table.columns
+        appends = [columns[name].append for name, _ in COLUMNS]
+        names = table.names
+
+        # (dirent, parent row, top level row)
+        stack = [(dirent, -1, None) for dirent in reversed(dirents)]
+        while stack:
+            dirent, parent, top_level = stack.pop()
+            row = len(names)
+            if top_level is None:
+                top_level = row
+            for append, value in zip(appends, (
+                    parent, top_level,
+                    dirent.file_name_length, dirent.file_attributes,
+                    dirent.first_cluster, dirent.file_size,
+                    dirent.creation_time_i, dirent.last_write_time_i,
+                    dirent.last_access_time_i,
+                    getattr(dirent, 'cluster', -1))):
+                append(value)
+            names.append(dirent.file_name)
+
+            for child in reversed(dirent.children):
+                stack.append((child, row, top_level))
+
+        table._finish()
+        return table
+
+    def _finish(self):
+        if self.numpy is not None:
+            for name, typecode in COLUMNS:
+                self.columns[name] = self.numpy.array(
+                    self.columns[name], dtype=self.numpy.dtype(typecode))
+
+    def __len__(self):
+        return len(self.names)
+
+    def column(self, name):
+        """Returns a whole column.
+
+        Returns (numpy.ndarray|array.array):
+        """
+        return self.columns[name]
+
+    def all_rows(self):
+        """Returns every row number."""
+        if self.numpy is not None:
+            return self.numpy.arange(len(self))
+        return range(len(self))
+
+    def pack_time(self, year, month=1, day=1, hour=0, minute=0, second=0):
+        """Packs a date the way time stamp columns store it, for comparing
+        against them.
+
+        Returns (int):
+        """
+        return ((year - self.epoch) << 25 | month << 21 | day << 16 |
+                hour << 11 | minute << 5 | second // 2)
+
+    def match(self, column, op, value, rows=None):
+        """Finds the rows whose column compares to value.
+
+        Args:
+            column (str): Name of the column.
+            op (str): One of ==, !=, <, <=, >, >=, or & to test that any of
+                the bits in value are set and !& to test that none are.
+            value (int): Value to compare against.
+            rows: Only these rows are looked at. Defaults to all of them.
+
+        Returns: Rows that match, in the order they were given.
+        """
+        data = self.columns[column]
+        if self.numpy is not None:
+            if rows is None:
+                rows = self.all_rows()
+            data = data[rows]
+            if op == '&':
+                mask = (data & value) != 0
+            elif op == '!&':
+                mask = (data & value) == 0
+            else:
+                mask = _OPERATORS[op](data, value)
+            return rows[mask]
+
+        if rows is None:
+            rows = self.all_rows()
+        if op == '&':
+            return [row for row in rows if data[row] & value]
+        if op == '!&':
+            return [row for row in rows if not data[row] & value]
+        compare = _OPERATORS[op]
+        return [row for row in rows if compare(data[row], value)]
+
+    def where(self, conditions, rows=None):
+        """Finds the rows that match every condition.
+
+        Args:
+            conditions ((str, str, int)[]): Column, op and value of each
+                condition, as taken by match().
+            rows: Only these rows are looked at. Defaults to all of them.
+
+        Returns: Rows that match.
+        """
+        for column, op, value in conditions:
+            rows = self.match(column, op, value, rows)
+        return rows if rows is not None else self.all_rows()
+
+    def files(self, rows=None):
+        """Returns the rows that are files."""
+        return self.match('attributes', '!&', FILE_ATTRIBUTE_DIRECTORY, rows)
+
+    def directories(self, rows=None):
+        """Returns the rows that are directories."""
+        return self.match('attributes', '&', FILE_ATTRIBUTE_DIRECTORY, rows)
+
+    def deleted(self, rows=None):
+        """Returns the rows that were deleted."""
+        return self.match('name_length', '==', DIRENT_DELETED, rows)
+
+    def sort(self, column, rows=None, reverse=False):
+        """Orders rows by a column.
+
+        Returns: The rows, sorted.
+        """
+        if rows is None:
+            rows = self.all_rows()
+        data = self.columns[column]
+        if self.numpy is not None:
+            order = self.numpy.argsort(data[rows], kind='mergesort')
+            if reverse:
+                order = order[::-1]
+            return rows[order]
+        return sorted(rows, key=data.__getitem__, reverse=reverse)
+
+    def sum_by(self, column, key, rows=None):
+        """Adds up a column for each distinct value of another.
+
+        For example sum_by('size', 'top_level', table.files()) gives the total
+        size of the files under each root level entry.
+
+        Returns (dict): Total for each value of key.
+        """
+        if rows is None:
+            rows = self.all_rows()
+        values = self.columns[column]
+        keys = self.columns[key]
+        if self.numpy is not None:
+            groups, inverse = self.numpy.unique(keys[rows],
+                                                return_inverse=True)
+            totals = self.numpy.bincount(
+                inverse, weights=values[rows].astype('float64'))
+            return dict((int(group), int(total))
+                        for group, total in zip(groups, totals))
+
+        totals = {}
+        for row in rows:
+            group = keys[row]
+            totals[group] = totals.get(group, 0) + values[row]
+        return totals
+
+    def get_path(self, row):
+        """Returns (str): Full path of a row, e.g. /Content/0000/file."""
+        parent = int(self.columns['parent'][row])
+        name = self.names[row]
+        if parent == -1:
+            return '/' + name
+
+        path = self._paths.get(parent)
+        if path is None:
+            path = self._paths[parent] = self.get_path(parent)
+        return path + '/' + name
+
+    def format_time(self, value):
+        """Returns (str): A packed time stamp as YYYY-MM-DD hh:mm:ss."""
+        return '{:04}-{:02}-{:02} {:02}:{:02}:{:02}'.format(
+            ((value & 0xFE000000) >> 25) + self.epoch,
+            (value & 0x1E00000) >> 21,
+            (value & 0x1F0000) >> 16,
+            (value & 0xF800) >> 11,
+            (value & 0x7E0) >> 5,
+            (value & 0x1F) * 2)
+
+    def export_csv(self, path, rows=None):
+        """Writes rows as CSV, one line per dirent.
+
+        Args:
+            path (str): File to write.
+            rows: Rows to write. Defaults to all of them.
+        """
+        if rows is None:
+            rows = self.all_rows()
+        columns = self.columns
+        time_columns = ('creation_time', 'last_write_time', 'last_access_time')
+        with open(path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['row', 'path'] + [name for name, _ in COLUMNS])
+            for row in rows:
+                line = [int(row), self.get_path(row)]
+                for name, _ in COLUMNS:
+                    value = int(columns[name][row])
+                    if name in time_columns:
+                        value = self.format_time(value)
+                    line.append(value)
+                writer.writerow(line)
+
+    def save(self, directory):
+        """Writes the table as flat files: one raw little endian file per
+        column, the names back to back with a column of where each ends, and
+        a JSON schema describing them.
+
+        Columns can be loaded back with load(), or straight into NumPy with
+        numpy.fromfile(path, dtype='<' + typecode).
+
+        Args:
+            directory (str): Directory to write the files into.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        schema = dict(epoch=self.epoch, rows=len(self), columns=[],
+                      identity=self.identity)
+        for name, typecode in COLUMNS:
+            data = array.array(typecode, self.columns[name])
+            if _BIG_ENDIAN:
+                data.byteswap()
+            with open(os.path.join(directory, name + '.bin'), 'wb') as f:
+                data.tofile(f)
+            schema['columns'].append(dict(name=name, typecode=typecode,
+                                          file=name + '.bin'))
+
+        # names are stored back to back, with where each one ends
+        ends = array.array('I')
+        end = 0
+        for name in self.names:
+            end += len(name)
+            ends.append(end)
+        if _BIG_ENDIAN:
+            ends.byteswap()
+        with open(os.path.join(directory, 'name_ends.bin'), 'wb') as f:
+            ends.tofile(f)
+        with open(os.path.join(directory, 'names.bin'), 'wb') as f:
+            f.write(''.join(self.names))
+        schema['names'] = dict(file='names.bin', ends='name_ends.bin')
+
+        with open(os.path.join(directory, 'schema.json'), 'w') as f:
+            json.dump(schema, f, indent=1, separators=(',', ': '))
+
+    @classmethod
+    def load(cls, directory, use_numpy=True):
+        """Reads a table written by save().
+
+        Returns (FatXDirentTable):
+        """
+        with open(os.path.join(directory, 'schema.json'), 'r') as f:
+            schema = json.load(f)
+
+        table = cls(schema['epoch'], use_numpy)
+        table.identity = schema.get('identity')
+        for column in schema['columns']:
+            data = array.array(str(column['typecode']))
+            with open(os.path.join(directory, column['file']), 'rb') as f:
+                data.fromfile(f, schema['rows'])
+            if _BIG_ENDIAN:
+                data.byteswap()
+            table.columns[column['name']] = data
+
+        ends = array.array('I')
+        with open(os.path.join(directory, schema['names']['ends']), 'rb') as f:
+            ends.fromfile(f, schema['rows'])
+        if _BIG_ENDIAN:
+            ends.byteswap()
+        with open(os.path.join(directory, schema['names']['file']), 'rb') as f:
+            names = f.read()
+        start = 0
+        for end in ends:
+            table.names.append(intern(names[start:end]))
+            start = end
+
+        table._finish()
+        return table
+
+    def export(self, path, rows=None):
+        """Writes rows as CSV if path ends in .csv, otherwise writes the whole
+        table as flat files into the directory at path.
+        """
+        if path.lower().endswith('.csv'):
+            self.export_csv(path, rows)
+        else:
+            self.save(path)
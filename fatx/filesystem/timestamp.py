@@ -30,6 +30,9 @@ class FatXTimeStamp(object):
     This handles extraction of each bitfield member of the timestamp."""
     __slots__ = ('time',)
 
+    # Year that the 7 bit year field is relative to.
+    EPOCH = 0
+
     def __init__(self, time_stamp):
         self.time = time_stamp
 
@@ -92,10 +95,11 @@ class X360TimeStamp(FatXTimeStamp):
     """Representation of an Xbox 360 time stamp.
 
     The Xbox 360 timestamps contains years offset from 1980."""
+    EPOCH = 1980
 
     @property
     def year(self):
-        _year = (((self.time & 0xFE000000) >> 25) + 1980)
+        _year = (((self.time & 0xFE000000) >> 25) + self.EPOCH)
         return _year
 
 
@@ -103,8 +107,54 @@ class XTimeStamp(FatXTimeStamp):
     """Representation of an Original Xbox time stamp.
 
     The Original Xbox contains years offset from 2000."""
+    EPOCH = 2000
 
     @property
     def year(self):
-        _year = (((self.time & 0xFE000000) >> 25) + 2000)
+        _year = (((self.time & 0xFE000000) >> 25) + self.EPOCH)
         return _year
+
+
+# Number of days in each month of a common year, indexed by month.
+DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def is_valid_time_stamp(time_stamp, epoch, max_year):
+    """Checks whether a packed time stamp holds a valid date and time.
+
+    This works directly on the bitfields so that no time stamp or datetime
+    objects have to be created. It accepts the same values that constructing
+    a datetime from the unpacked fields would.
+
+    Args:
+        time_stamp (int): Packed time stamp as stored in a dirent.
+        epoch (int): Year that the year field is relative to.
+        max_year (int): Latest year that is accepted.
+
+    Returns (bool):
+    """
+    year = (time_stamp >> 25) + epoch
+    if year > max_year:
+        return False
+
+    month = (time_stamp >> 21) & 0xF
+    if month == 0 or month > 12:
+        return False
+
+    day = (time_stamp >> 16) & 0x1F
+    if day == 0:
+        return False
+    if day > DAYS_IN_MONTH[month]:
+        # February 29th is only valid on leap years.
+        if month != 2 or day != 29:
+            return False
+        if year % 4 != 0 or (year % 100 == 0 and year % 400 != 0):
+            return False
+
+    # hour <= 23, minute <= 59, seconds <= 58
+    if (time_stamp & 0xF800) > 0xB800 or \
+            (time_stamp & 0x7E0) > 0x760 or \
+            (time_stamp & 0x1F) > 29:
+        return False
+
+    return True
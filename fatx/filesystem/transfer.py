@@ -0,0 +1,365 @@
+from threading import Thread
+from Queue import Queue
+import errno
+import stat
+import sys
+import os
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+
+# Amount of data copied at a time when copying through a buffer.
+COPY_BUFFER_SIZE = 0x100000
+
+# Buffers read_ahead() cycles through, so reading stays ahead of writing.
+READ_AHEAD_BUFFERS = 3
+
+# Smallest run of zeros left as a hole by FatXSparseFile, a file system block.
+SPARSE_BLOCK_SIZE = 0x1000
+
+_ZEROS = buffer('\0' * SPARSE_BLOCK_SIZE)
+
+# Errors meaning the kernel cannot copy between these two files.
+_KERNEL_COPY_ERRORS = (errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                       errno.EOPNOTSUPP, errno.EBADF)
+
+
+def _get_libc_copies():
+    """Python 2 has neither os.copy_file_range() nor os.sendfile(), so they
+    are called in the C library instead."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except (OSError, TypeError):
+        return []
+
+    def check(result):
+        if result < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return result
+
+    copies = []
+    copy_file_range = getattr(libc, 'copy_file_range', None)
+    if copy_file_range is not None:
+        copy_file_range.argtypes = (ctypes.c_int,
+                                    ctypes.POINTER(ctypes.c_int64),
+                                    ctypes.c_int, ctypes.c_void_p,
+                                    ctypes.c_size_t, ctypes.c_uint)
+        copy_file_range.restype = ctypes.c_ssize_t
+
+        def libc_copy_file_range(src, dst, count, offset_src):
+            offset = ctypes.c_int64(offset_src)
+            return check(copy_file_range(src, ctypes.byref(offset), dst,
+                                         None, count, 0))
+        copies.append(libc_copy_file_range)
+
+    sendfile = getattr(libc, 'sendfile64', None)
+    if sendfile is not None:
+        sendfile.argtypes = (ctypes.c_int, ctypes.c_int,
+                             ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t)
+        sendfile.restype = ctypes.c_ssize_t
+
+        def libc_sendfile(src, dst, count, offset_src):
+            offset = ctypes.c_int64(offset_src)
+            return check(sendfile(dst, src, ctypes.byref(offset), count))
+        copies.append(libc_sendfile)
+    return copies
+
+
+def _get_kernel_copies():
+    """Returns (function[]): Ways for the kernel to copy from one file to the
+    position of another, best first, called as
+    kernel_copy(src, dst, count, offset_src)."""
+    if not sys.platform.startswith('linux'):
+        return []
+    copies = []
+    if hasattr(os, 'copy_file_range'):
+        copies.append(os.copy_file_range)
+    if hasattr(os, 'sendfile'):
+        copies.append(lambda src, dst, count, offset_src:
+                      os.sendfile(dst, src, offset_src, count))
+    if not copies and ctypes is not None:
+        copies = _get_libc_copies()
+    return copies
+
+
+_KERNEL_COPIES = _get_kernel_copies()
+
+
+def _copy_range_kernel(infile, offset, length, outfile):
+    """Copies a range without passing the data through Python.
+
+    Only a regular file is copied from, so that a block device is still read
+    through the buffered path. copy_file_range() is tried first, since it
+    works between any two regular files on recent kernels, then sendfile().
+
+    Returns (int): Number of bytes copied, or None if the kernel cannot copy
+        between these files and nothing was copied.
+    """
+    if not _KERNEL_COPIES:
+        return None
+    try:
+        src = infile.fileno()
+        dst = outfile.fileno()
+        if not stat.S_ISREG(os.fstat(src).st_mode):
+            return None
+    except (AttributeError, ValueError, IOError, OSError):
+        return None
+
+    start = outfile.tell()
+    outfile.flush()
+    for kernel_copy in _KERNEL_COPIES:
+        os.lseek(dst, start, os.SEEK_SET)
+        copied = 0
+        try:
+            while copied < length:
+                count = kernel_copy(src, dst,
+                                    min(length - copied, 0x40000000),
+                                    offset + copied)
+                if count == 0:
+                    break
+                copied += count
+        except OSError as e:
+            if copied == 0 and e.errno in _KERNEL_COPY_ERRORS:
+                continue
+            raise
+        # the file object does not know the kernel moved its position
+        outfile.seek(start + copied)
+        # nor does a metered image know the kernel read from it
+        count_copied = getattr(infile, 'count_copied', None)
+        if count_copied is not None:
+            count_copied(copied)
+        return copied
+    return None
+
+
+def copy_range(infile, offset, length, outfile, bufsize=COPY_BUFFER_SIZE):
+    """Copies length bytes starting at offset in infile to outfile.
+
+    The data is copied a chunk at a time, so memory use does not depend on
+    length. Where the platform supports it, the kernel copies the data
+    directly between the two files. That needs outfile to be a real file, so
+    a FatXSparseFile is always copied to through a buffer.
+
+    Args:
+        infile (file): File to copy from.
+        offset (int): Offset in infile to start copying from.
+        length (int): Number of bytes to copy.
+        outfile (file): File to copy to, at its current position.
+        bufsize (int): Size of each chunk when copying through a buffer.
+
+    Returns (int): Number of bytes copied. This is less than length if the
+        end of infile was reached.
+    """
+    copied = _copy_range_kernel(infile, offset, length, outfile)
+    if copied is not None:
+        return copied
+
+    copied = 0
+    infile.seek(offset)
+    while copied < length:
+        buf = infile.read(min(length - copied, bufsize))
+        if not buf:
+            break
+        outfile.write(buf)
+        copied += len(buf)
+    return copied
+
+
+def copy_extents(infile, extents, outfile):
+    """Copies extents of infile one after another to outfile.
+
+    Each extent is copied by the kernel where it can be, otherwise the
+    extents are read ahead of writing them.
+
+    Args:
+        infile (file): File to copy from.
+        extents ((int, int)[]): Offset and length of each range to copy.
+        outfile (file): File to copy to, at its current position.
+
+    Returns (int): Number of bytes copied. An extent is cut short where the
+        end of infile is reached.
+    """
+    copied = 0
+    for index, (offset, length) in enumerate(extents):
+        count = _copy_range_kernel(infile, offset, length, outfile)
+        if count is None:
+            for buf in read_ahead(infile, extents[index:]):
+                outfile.write(buf)
+                copied += len(buf)
+            break
+        copied += count
+    return copied
+
+
+def _read_chunk(infile, buf, size):
+    """Reads up to size bytes into the start of buf.
+
+    Returns (int): Number of bytes read.
+    """
+    readinto = getattr(infile, 'readinto', None)
+    if readinto is not None:
+        return readinto(memoryview(buf)[:size]) or 0
+    data = infile.read(size)
+    buf[:len(data)] = data
+    return len(data)
+
+
+def _read_extents(infile, extents, free, full, bufsize):
+    try:
+        for offset, length in extents:
+            infile.seek(offset)
+            remains = length
+            while remains > 0:
+                buf = free.get()
+                if buf is None:
+                    # the caller stopped iterating
+                    return
+                size = min(remains, bufsize)
+                count = _read_chunk(infile, buf, size)
+                full.put((buf, count, None))
+                remains -= count
+                if count < size:
+                    # end of the image
+                    break
+    except Exception as e:
+        full.put((None, 0, e))
+    finally:
+        full.put(None)
+
+
+def read_ahead(infile, extents, bufsize=COPY_BUFFER_SIZE,
+               buffers=READ_AHEAD_BUFFERS):
+    """Reads extents of infile on a thread of its own, so that the next chunk
+    is read while the caller writes the current one.
+
+    Chunks are read into a small ring of reusable buffers. Each chunk is only
+    valid until the next one is asked for, so anything kept must be copied.
+    Nothing else may use infile until iterating is done. Data that fits in
+    one buffer is read without a thread.
+
+    Args:
+        infile (file): File to read from.
+        extents ((int, int)[]): Offset and length of each range to read.
+        bufsize (int): Size of each buffer.
+        buffers (int): Number of buffers in the ring, at least two.
+
+    Returns (generator): buffer of each chunk of data, in order. A range is
+        cut short where the end of infile is reached.
+    """
+    if sum(length for _, length in extents) <= bufsize:
+        buf = bytearray(bufsize)
+        for offset, length in extents:
+            infile.seek(offset)
+            count = _read_chunk(infile, buf, length)
+            if count:
+                yield buffer(buf, 0, count)
+        return
+
+    free = Queue()
+    full = Queue()
+    for _ in xrange(max(2, buffers)):
+        free.put(bytearray(bufsize))
+    thread = Thread(target=_read_extents,
+                    args=(infile, extents, free, full, bufsize))
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = full.get()
+            if item is None:
+                break
+            buf, count, error = item
+            if error is not None:
+                raise error
+            if count:
+                yield buffer(buf, 0, count)
+            free.put(buf)
+    finally:
+        free.put(None)
+        thread.join()
+
+
+class FatXSparseFile(object):
+    """Output file that seeks over blocks of zeros instead of writing them,
+    so that they become holes in a sparse file.
+
+    Blocks are aligned to the position in the file. Whether a block is all
+    zeros is found by comparing it to a block of zeros, which costs far less
+    than writing it. The file always ends up as long as everything written
+    to it, even when it ends in a hole.
+
+    Every block has to be looked at, so it has no fileno() and the kernel
+    never copies into it.
+
+    Args:
+        fo (file): File opened for writing.
+        block_size (int): Size of the blocks looked at, at most
+            SPARSE_BLOCK_SIZE.
+    """
+    def __init__(self, fo, block_size=SPARSE_BLOCK_SIZE):
+        self._file = fo
+        self.block_size = min(block_size, SPARSE_BLOCK_SIZE)
+        self._position = fo.tell()
+        self._end = self._position
+        self.skipped = 0
+
+    def _is_zero(self, view, start, end):
+        return buffer(view, start, end - start) == \
+            buffer(_ZEROS, 0, end - start)
+
+    def write(self, data):
+        view = buffer(data)
+        length = len(view)
+        block = self.block_size
+        start = 0
+        while start < length:
+            # the first block may end early to align the rest
+            end = min(length, start + block - (self._position + start) % block)
+            zero = self._is_zero(view, start, end)
+            while end < length:
+                next_end = min(length, end + block)
+                if self._is_zero(view, end, next_end) != zero:
+                    break
+                end = next_end
+            if zero:
+                self._file.seek(end - start, 1)
+                self.skipped += end - start
+            else:
+                self._file.write(buffer(view, start, end - start))
+            start = end
+        self._position += length
+        self._end = max(self._end, self._position)
+
+    def seek(self, offset, whence=0):
+        self._file.seek(offset, whence)
+        self._position = self._file.tell()
+
+    def tell(self):
+        return self._position
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        # a hole at the end is only part of the file once it is extended
+        self._file.seek(0, 2)
+        if self._file.tell() < self._end:
+            self._file.truncate(self._end)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
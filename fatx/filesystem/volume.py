@@ -1,5 +1,7 @@
 from fatx.filesystem.dirent import FatXDirent
 from fatx.filesystem.timestamp import XTimeStamp, X360TimeStamp
+from fatx.filesystem.metrics import FatXMetrics
+from fatx.filesystem.table import FatXDirentTable
 from fatx.filesystem.constants import \
     FATX_SIGNATURE, \
     FATX_PAGE_SIZE, \
@@ -7,8 +9,13 @@ from fatx.filesystem.constants import \
     DIRENT_NEVER_USED, \
     DIRENT_NEVER_USED2
 
+import itertools
+import hashlib
 import struct
 import logging
+import array
+import sys
+import os
 
 
 LOG = logging.getLogger("FATX.FileSystem")
@@ -35,9 +42,11 @@ class FatXVolume(object):
         offset (int): Offset of this volume into the image file.
         length (int): Length of this volume.
         byteorder (str): Either '>' for big-endian or '<' for little endian.
+        metrics (FatXMetrics): Metrics to count into. Defaults to metrics of
+            this volume's own.
     """
 
-    def __init__(self, fo, name, offset, length, byteorder):
+    def __init__(self, fo, name, offset, length, byteorder, metrics=None):
         LOG.debug("Partition Offset: %016x", offset)
         LOG.debug("Partition Length: %016x", length)
 
@@ -49,12 +58,14 @@ class FatXVolume(object):
         self.offset = offset
         self.length = length
         self.endian_fmt = byteorder
+        self.metrics = metrics if metrics is not None else FatXMetrics()
         self.FATX_FORMAT = self.endian_fmt + 'LLLL'
         self.DIRENT_FORMAT = self.endian_fmt + 'BB42sLLLLL'
         # Original Xbox is little endian and Xbox 360 is big endian.
         self.ts_format = XTimeStamp if byteorder == '<' else X360TimeStamp
 
         self._root = []
+        self._table = None
         self.file_allocation_table = None
 
         self.signature = ""
@@ -73,15 +84,20 @@ class FatXVolume(object):
     def __del__(self):
         self.infile.close()
 
-    def mount(self):
-        """Loads the FATX file system."""
+    def mount(self, progress=None):
+        """Loads the FATX file system.
+
+        Args:
+            progress (FatXProgress): Reports the directory tree walk.
+        """
         LOG.info("Mounting %s", self.name)
 
-        # read volume metadata
-        self.read_volume_metadata()
+        with self.metrics.phase('mount'):
+            # read volume metadata
+            self.read_volume_metadata()
 
-        # calculate file allocation and file area offsets
-        self.calculate_offsets()
+            # calculate file allocation and file area offsets
+            self.calculate_offsets()
 
         if self.debug_log_enabled:
             LOG.debug("Bytes Per Cluster: %08x", self.bytes_per_cluster)
@@ -90,13 +106,22 @@ class FatXVolume(object):
             LOG.debug("FILE Area Byte Offset: %08x", self.file_area_byte_offset)
 
         # get file allocation table (int[])
-        self.file_allocation_table = self.read_file_allocation_table()
+        with self.metrics.phase('fat_load'):
+            self.file_allocation_table = self.read_file_allocation_table()
 
-        self._root = self.read_directory_stream(
-            self.cluster_to_physical_offset(self.root_dir_first_cluster))
+        with self.metrics.phase('tree_walk'):
+            if progress is not None:
+                progress.start('tree_walk')
 
-        # for each dirent in root, populate children
-        self.populate_dirent_stream(self._root)
+            self._root = self.read_directory_stream(
+                self.cluster_to_physical_offset(self.root_dir_first_cluster))
+
+            # for each dirent in root, populate children
+            self.populate_dirent_stream(self._root, progress)
+
+            if progress is not None:
+                progress.update(self.bytes_per_cluster, len(self._root))
+                progress.finish()
 
     def read_volume_metadata(self):
         """Reads and verifies the FATX volume header."""
@@ -134,6 +159,64 @@ class FatXVolume(object):
         fat_table = self.infile.read(fat_length)
         return [entry for entry in struct.unpack(fat_format, fat_table)]
 
+    def load_file_allocation_table(self):
+        """Reads the volume header and the file allocation table, but not the
+        directory tree, unless they are loaded already."""
+        if self.file_allocation_table is not None:
+            return
+        self.read_volume_metadata()
+        self.calculate_offsets()
+        with self.metrics.phase('fat_load'):
+            self.file_allocation_table = self.read_file_allocation_table()
+
+    def get_identity(self):
+        """Describes this volume as it is now, so that data saved from it can
+        be checked before it is used again.
+
+        The geometry and serial number are the same for every image of a
+        drive, so the image file's path, size and modification time and a
+        digest of the file allocation table are part of it too.
+
+        Returns (dict): Identity that can be stored as JSON.
+        """
+        self.load_file_allocation_table()
+        fat = array.array('I', self.file_allocation_table)
+        identity = dict(offset=self.offset, length=self.length,
+                        serial_number=self.serial_number,
+                        bytes_per_cluster=self.bytes_per_cluster,
+                        max_clusters=self.max_clusters,
+                        fat_sha1=hashlib.sha1(fat.tostring()).hexdigest())
+
+        path = getattr(self.infile, 'name', None)
+        if isinstance(path, basestring) and os.path.isfile(path):
+            path = os.path.abspath(path)
+            if isinstance(path, str):
+                # compares equal to the path loaded back from JSON
+                path = path.decode(sys.getfilesystemencoding() or 'utf-8',
+                                   'replace')
+            stat = os.stat(path)
+            identity.update(image=path, image_size=stat.st_size,
+                            image_mtime=int(stat.st_mtime))
+        return identity
+
+    def get_free_cluster_runs(self):
+        """Finds every run of consecutive free clusters in the file allocation
+        table.
+
+        Returns ((int, int)[]): First cluster and number of clusters of each
+            run.
+        """
+        runs = []
+        cluster = 1
+        # index 0 of the file allocation table does not map to a cluster
+        entries = itertools.islice(self.file_allocation_table, 1, None)
+        for allocated, run in itertools.groupby(entries, bool):
+            count = len(list(run))
+            if not allocated:
+                runs.append((cluster, count))
+            cluster += count
+        return runs
+
     def is_valid_cluster(self, cluster):
         """Returns whether or not cluster index is within bounds of the
         volume.
@@ -149,6 +232,22 @@ class FatXVolume(object):
         """
         return self._root
 
+    def get_table(self, use_numpy=True):
+        """Returns the metadata of every dirent on this volume as a table. It
+        is built from the mounted tree the first time it is asked for.
+
+        Args:
+            use_numpy (bool): Whether to use NumPy if it is installed.
+
+        Returns (FatXDirentTable):
+        """
+        if self._table is None:
+            with self.metrics.phase('table_build'):
+                self._table = FatXDirentTable.from_dirents(
+                    self._root, self.ts_format.EPOCH, use_numpy)
+            self._table.identity = self.get_identity()
+        return self._table
+
     def seek_file_area(self, offset, whence=0):
         """Seek relative to file_area_byte_offset."""
         # if offset > (self.length - self.file_area_byte_offset):
@@ -273,12 +372,13 @@ class FatXVolume(object):
         # offset of file area
         self.file_area_byte_offset = self.fat_byte_offset + bytes_per_fat
 
-    def populate_dirent_stream(self, stream):
+    def populate_dirent_stream(self, stream, progress=None):
         """Iterates dirent's from a dirent stream and populates directories
         with its child dirents.
 
         Args:
             stream (FatXDirent[]): dirent stream
+            progress (FatXProgress): Reports each directory cluster read.
         """
         for dirent in stream:
             LOG.info("%s", dirent.get_full_path())
@@ -304,8 +404,11 @@ class FatXVolume(object):
                         self.cluster_to_physical_offset(cluster))
 
                     dirent.add_dirent_stream_to_this_directory(dirent_stream)
+                    if progress is not None:
+                        progress.update(self.bytes_per_cluster,
+                                        len(dirent_stream))
                     # TODO: populate_children()
-                    self.populate_dirent_stream(dirent_stream)
+                    self.populate_dirent_stream(dirent_stream, progress)
 
     def read_directory_stream(self, offset):
         """Reads and unpacks the dirent stream into a list of FatXDirent's.
@@ -335,6 +438,7 @@ class FatXVolume(object):
 
             stream.append(dirent)
 
+        self.metrics.count('dirents_decoded', len(stream))
         return stream
 
     def print_volume_metadata(self):
@@ -1,6 +1,18 @@
 from fatx.drive.drive import FatXDrive
+from fatx.filesystem.metrics import FatXMetrics
+from fatx.filesystem.profiler import FatXProfiler, PROFILE_DETERMINISTIC, PROFILE_SAMPLING
+from fatx.filesystem.progress import FatXProgress, print_progress
+from fatx.filesystem.table import FatXDirentTable
+from fatx.filesystem.manifest import FatXManifest
+from fatx.filesystem.archive import FatXArchive
+from fatx.filesystem.ordered import FatXOrderedExtractor
+from fatx.analysis.cluster_hash import FatXClusterHashes, FatXDeduplicator, DEDUPE_LINK, DEDUPE_SKIP
+from fatx.filesystem.find import FatXQuery, FatXNameIndex
+from fatx.filesystem.constants import DIRENT_DELETED
+from datetime import datetime
 
 import argparse
+import json
 import os
 import logging
 import sys
@@ -11,23 +23,50 @@ LOG = logging.getLogger('FATX')
 
 def main(arg):
     # TODO: have the option to specify a custom range
+    metrics = None
+    profiler = None
+    if arg.profile:
+        profiler = FatXProfiler(arg.profile, arg.profile_mode, arg.profile_interval)
+    if arg.stats or arg.stats_file or profiler is not None:
+        metrics = FatXMetrics(profiler)
+
+    progress = None
+    if arg.progress:
+        progress = FatXProgress(print_progress)
+
     with open(arg.inputfile, 'rb') as infile:
-        drive = FatXDrive(infile)
+        drive = FatXDrive(infile, metrics)
 
         if arg.print_drive:
             print("Partitions:")
             drive.print_partitions()
 
-        if arg.print_files or arg.print_partition or arg.recover:
+        fatx = None
+        if arg.print_files or arg.print_partition or arg.recover or arg.export_table or arg.find is not None:
             if not arg.index:
-                raise Exception("Must specify a partition index in order to print its contents (--index).")
+                raise Exception("Must specify a partition index in order to read it (--index).")
 
             fatx = drive.get_partition(arg.index)
-            fatx.mount()
 
+        table = index = None
+        if arg.find is not None:
+            table, index = load_find_index(arg, fatx)
+
+        # mounted once for everything that needs it
+        if arg.print_files or arg.print_partition or arg.recover or arg.export_table or \
+                (arg.find is not None and table is None):
+            fatx.mount(progress)
+
+        if arg.find is not None:
+            find_files(arg, drive, fatx, table, index)
+
+        if arg.print_files or arg.print_partition or arg.recover or arg.export_table:
             if arg.print_partition:
                 fatx.print_volume_metadata()
 
+            if arg.export_table:
+                fatx.get_table().export(arg.export_table)
+
             if arg.print_files or arg.recover:
                 root_dir = fatx.get_root()
 
@@ -37,15 +76,117 @@ def main(arg):
                     if arg.print_files:
                         for dirent in root_dir:
                             dirent.print_dirent("root:")
-                    if arg.recover:
+                    if arg.recover and arg.archive:
+                        if arg.manifest or arg.dedupe:
+                            raise Exception("--archive cannot be used with --manifest or --dedupe.")
+
+                        with drive.metrics.phase('extract'):
+                            if progress is not None:
+                                sizes = [dirent.get_tree_size(arg.undelete) for dirent in root_dir]
+                                progress.start('extract',
+                                               total_bytes=sum(size for size, _ in sizes),
+                                               total_items=sum(files for _, files in sizes))
+                            with FatXArchive(arg.archive, compress=arg.compress) as archive:
+                                for dirent in root_dir:
+                                    archive.add_dirent(dirent, '', arg.undelete, progress)
+                            if progress is not None:
+                                progress.finish()
+                    elif arg.recover:
                         if not arg.outpath:
                             raise Exception("Must specify an output path (--output).")
 
+                        if arg.ordered and (arg.manifest or arg.dedupe):
+                            raise Exception("--ordered writes files out of order and cannot be used with "
+                                            "--manifest or --dedupe.")
+
                         if not os.path.exists(arg.outpath):
                             os.makedirs(arg.outpath)
 
-                        for dirent in root_dir:
-                            dirent.recover(arg.outpath, arg.undelete)
+                        manifest = FatXManifest(arg.manifest) if arg.manifest else None
+                        dedupe = None
+                        if arg.dedupe:
+                            hashes = FatXClusterHashes(fatx)
+                            hashes.build_or_load(arg.hash_cache, progress)
+                            dedupe = FatXDeduplicator(hashes, arg.dedupe)
+                        with drive.metrics.phase('extract'):
+                            if progress is not None:
+                                sizes = [dirent.get_tree_size(arg.undelete) for dirent in root_dir]
+                                progress.start('extract',
+                                               total_bytes=sum(size for size, _ in sizes),
+                                               total_items=sum(files for _, files in sizes))
+                            if arg.ordered:
+                                extractor = FatXOrderedExtractor(fatx, sparse=not arg.no_sparse)
+                                for dirent in root_dir:
+                                    extractor.add(dirent, arg.outpath, arg.undelete)
+                                extractor.run(progress)
+                            else:
+                                for dirent in root_dir:
+                                    dirent.recover(arg.outpath, arg.undelete, progress, manifest, dedupe,
+                                                   not arg.no_sparse)
+                            if manifest is not None:
+                                manifest.close()
+                            if progress is not None:
+                                progress.finish()
+                        if dedupe is not None:
+                            LOG.info("%d duplicate files (%d bytes) were %s.", dedupe.duplicates,
+                                     dedupe.bytes_saved, "linked" if arg.dedupe == DEDUPE_LINK else "skipped")
+
+    if metrics is not None:
+        print_stats(arg, metrics)
+    if profiler is not None:
+        profiler.write()
+        print("Profile:")
+        profiler.print_summary()
+
+
+def load_find_index(arg, volume):
+    if not arg.find_index or not os.path.exists(os.path.join(arg.find_index, 'schema.json')):
+        return None, None
+
+    table = FatXDirentTable.load(arg.find_index)
+    if table.identity != volume.get_identity():
+        LOG.warning("The table in %s is not of this partition or it has changed since, building it again.",
+                    arg.find_index)
+        return None, None
+    return table, FatXNameIndex.load(arg.find_index)
+
+
+def find_files(arg, drive, volume, table=None, index=None):
+    if table is None:
+        table = volume.get_table()
+        if arg.find_index:
+            table.save(arg.find_index)
+    if index is None:
+        index = FatXNameIndex(table.names)
+        if arg.find_index:
+            index.save(arg.find_index)
+
+    directories = None
+    if arg.find_type:
+        directories = arg.find_type == 'd'
+    deleted = None
+    if arg.find_deleted:
+        deleted = arg.find_deleted == 'only'
+
+    query = FatXQuery(arg.find, arg.find_regex, arg.find_min_size, arg.find_max_size,
+                      directories, arg.find_attributes, deleted, arg.find_newer, arg.find_older)
+    with drive.metrics.phase('find'):
+        for row in query.find(table, index):
+            line = "{:>10} {} {}".format(int(table.column('size')[row]),
+                                         table.format_time(int(table.column('last_write_time')[row])),
+                                         table.get_path(row))
+            if table.column('name_length')[row] == DIRENT_DELETED:
+                line += " (deleted)"
+            print(line)
+
+
+def print_stats(arg, metrics):
+    if arg.stats:
+        print("Statistics:")
+        metrics.print_metrics()
+    if arg.stats_file:
+        with open(arg.stats_file, 'w') as f:
+            json.dump(metrics.to_dict(), f, indent=1, separators=(',', ': '))
 
 
 if __name__ == "__main__":
@@ -59,6 +200,47 @@ if __name__ == "__main__":
     parser.add_argument("-r", "--recover", help="Recover files.", action="store_true")
     parser.add_argument("-u", "--undelete", help="Recover files marked as deleted.", action="store_true")
     parser.add_argument("-v", "--verbosity", help="Verbose level.", type=str, default="NOTSET")
+    parser.add_argument("--archive", help="Recover files into a .tar, .tar.gz, .tgz or .zip archive instead "
+                                          "of a directory.", type=str)
+    parser.add_argument("--compress", help="Deflate files recovered into a zip archive.", action="store_true")
+    parser.add_argument("--ordered", help="Read the data of all files in the order it is stored in the image, "
+                                          "which is faster on fragmented volumes and spinning disks.",
+                        action="store_true")
+    parser.add_argument("--no-sparse", help="Write blocks of zeros instead of leaving holes. Only with this does the "
+                                            "kernel copy files straight from the image, otherwise every block is "
+                                            "read to look for zeros.", action="store_true")
+    parser.add_argument("--manifest", help="Write the size and MD5, SHA-1 and SHA-256 of each recovered file "
+                                           "to this CSV file.", type=str)
+    parser.add_argument("--dedupe", help="Hard link or skip files whose content was already recovered.",
+                        choices=(DEDUPE_LINK, DEDUPE_SKIP))
+    parser.add_argument("--hash-cache", help="File to keep cluster hashes for --dedupe in between runs.", type=str)
+    parser.add_argument("--export-table", help="Write metadata of every file to a .csv file, or to flat "
+                                               "column files in a directory.", type=str)
+    parser.add_argument("--find", help="Print files whose name matches this pattern, e.g. '*.xex'.", type=str)
+    parser.add_argument("--find-regex", help="Match names with --find as a regular expression.",
+                        action="store_true")
+    parser.add_argument("--find-min-size", help="Only find files at least this big.", type=lambda x: int(x, 0))
+    parser.add_argument("--find-max-size", help="Only find files at most this big.", type=lambda x: int(x, 0))
+    parser.add_argument("--find-type", help="Only find files (f) or directories (d).", choices=('f', 'd'))
+    parser.add_argument("--find-attributes", help="Only find files with all of these attribute bits set.",
+                        type=lambda x: int(x, 0), default=0)
+    parser.add_argument("--find-deleted", help="Only find deleted files, or exclude them.",
+                        choices=('only', 'exclude'))
+    parser.add_argument("--find-newer", help="Only find files written on or after this date (YYYY-MM-DD).",
+                        type=lambda x: datetime.strptime(x, '%Y-%m-%d').date())
+    parser.add_argument("--find-older", help="Only find files written before this date (YYYY-MM-DD).",
+                        type=lambda x: datetime.strptime(x, '%Y-%m-%d').date())
+    parser.add_argument("--find-index", help="Directory of a table written by --export-table to search. Built from "
+                                             "the partition and saved there if missing or of another partition.",
+                        type=str)
+    parser.add_argument("--progress", help="Report progress, throughput and ETA on stderr.", action="store_true")
+    parser.add_argument("--stats", help="Print I/O counters and time spent in each phase.", action="store_true")
+    parser.add_argument("--stats-file", help="Write I/O counters and phase times to this JSON file.", type=str)
+    parser.add_argument("--profile", help="Profile each phase, writing files that start with this path.", type=str)
+    parser.add_argument("--profile-mode", help="Trace every call or sample the stack (default is deterministic).",
+                        choices=(PROFILE_DETERMINISTIC, PROFILE_SAMPLING), default=PROFILE_DETERMINISTIC)
+    parser.add_argument("--profile-interval", help="Seconds between samples (default is 0.005).",
+                        type=float, default=0.005)
     args = parser.parse_args()
 
     log_verbosity = [v for k, v in logging.__dict__.items() if k.startswith(args.verbosity.upper())][0]
@@ -0,0 +1,80 @@
+from fatx.benchmark.runner import FatXBenchmark, SCENARIOS, BENCHMARKS, \
+    DEFAULT_THRESHOLD, DEFAULT_RSS_THRESHOLD, compare_results
+
+import argparse
+import tempfile
+import logging
+import json
+import sys
+import os
+
+
+LOG = logging.getLogger('FATX')
+
+# Baseline committed alongside the sources.
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'benchmarks', 'baseline.json')
+
+
+def main_benchmark(arg):
+    benchmark = FatXBenchmark(arg.workdir, arg.scenario, arg.repeat)
+    results = benchmark.run(arg.benchmark)
+
+    if arg.outputfile:
+        with open(arg.outputfile, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True,
+                      separators=(',', ': '))
+
+    if not arg.compare:
+        return 0
+
+    if not os.path.exists(arg.compare):
+        LOG.warning("No baseline at %s.", arg.compare)
+        return 0
+
+    with open(arg.compare, 'r') as f:
+        baseline = json.load(f)
+
+    if baseline['scenario'] != results['scenario']:
+        LOG.warning("Baseline was measured on the %s scenario, not comparing.",
+                    baseline['scenario'])
+        return 0
+
+    regressions = compare_results(results, baseline,
+                                  arg.threshold, arg.rss_threshold)
+    for regression in regressions:
+        LOG.error("Regression in %s", regression)
+    if regressions:
+        return 1
+
+    LOG.info("No regressions against %s.", arg.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark FATX analysis on generated images.")
+    parser.add_argument("-w", "--workdir", help="Directory to keep generated images in.", type=str,
+                        default=os.path.join(tempfile.gettempdir(), 'fatx-benchmark'))
+    parser.add_argument("-s", "--scenario", help="Image to benchmark on (default is default).",
+                        choices=sorted(SCENARIOS.keys()), default='default')
+    parser.add_argument("-b", "--benchmark", help="Benchmark to run, may be given more than once "
+                                                  "(default is all).",
+                        choices=[name for name, _ in BENCHMARKS], action='append')
+    parser.add_argument("-r", "--repeat", help="Runs of each benchmark, the fastest is kept (default is 3).",
+                        type=int, default=3)
+    parser.add_argument("-o", "--outputfile", help="Write results to this JSON file.", type=str)
+    parser.add_argument("-c", "--compare", help="Baseline JSON file to compare against.", type=str,
+                        default=DEFAULT_BASELINE)
+    parser.add_argument("-t", "--threshold", help="Allowed drop in throughput (default is {}).".format(
+                        DEFAULT_THRESHOLD), type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("-m", "--rss-threshold", help="Allowed growth of peak RSS (default is {}).".format(
+                        DEFAULT_RSS_THRESHOLD), type=float, default=DEFAULT_RSS_THRESHOLD)
+    args = parser.parse_args()
+
+    _stream = logging.StreamHandler(sys.stdout)
+    _stream.setLevel(logging.INFO)
+    _stream.setFormatter(logging.Formatter('%(levelname).4s: %(message)s'))
+    LOG.setLevel(logging.INFO)
+    LOG.addHandler(_stream)
+
+    sys.exit(main_benchmark(args))
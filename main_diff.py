@@ -0,0 +1,92 @@
+from fatx.drive.drive import FatXDrive
+from fatx.analysis.cluster_hash import FatXClusterHashes
+from fatx.analysis.diff import FatXDiff
+from fatx.filesystem.metrics import FatXMetrics
+
+import argparse
+import logging
+import csv
+import sys
+import os
+
+
+LOG = logging.getLogger('FATX')
+
+
+def get_hashes(arg, volume):
+    cache = None
+    hashes = FatXClusterHashes(volume)
+    if arg.hash_cache:
+        if not os.path.exists(arg.hash_cache):
+            os.makedirs(arg.hash_cache)
+        cache = hashes.get_cache_path(arg.hash_cache)
+    hashes.build_or_load(cache)
+    return hashes
+
+
+def main_diff(arg):
+    metrics = FatXMetrics()
+    with open(arg.old, 'rb') as old_file, open(arg.new, 'rb') as new_file:
+        old_drive = FatXDrive(old_file, metrics)
+        new_drive = FatXDrive(new_file, metrics)
+        old = old_drive.get_partition(arg.index)
+        new = new_drive.get_partition(arg.index)
+        old.mount()
+        new.mount()
+
+        old_hashes = None
+        new_hashes = None
+        if arg.content:
+            old_hashes = get_hashes(arg, old)
+            new_hashes = get_hashes(arg, new)
+
+        diff = FatXDiff(old, new, old_hashes, new_hashes, arg.undelete)
+        counts = {}
+        writer = None
+        if arg.outputfile:
+            outfile = open(arg.outputfile, 'wb')
+            writer = csv.writer(outfile)
+            writer.writerow(['change', 'path', 'reasons'])
+
+        for change, path, reasons in diff.compare():
+            counts[change] = counts.get(change, 0) + 1
+            if writer is not None:
+                writer.writerow([change, path, ' '.join(reasons)])
+            elif reasons:
+                print("{:<9} {} ({})".format(change, path, ', '.join(reasons)))
+            else:
+                print("{:<9} {}".format(change, path))
+
+        if writer is not None:
+            outfile.close()
+
+    print("{} added, {} removed, {} modified.".format(counts.get('added', 0),
+                                                     counts.get('removed', 0),
+                                                     counts.get('modified', 0)))
+    if arg.stats:
+        print("Statistics:")
+        metrics.print_metrics()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two images of the same drive.")
+    parser.add_argument("-a", "--old", help="Earlier image file.", type=str, required=True)
+    parser.add_argument("-b", "--new", help="Later image file.", type=str, required=True)
+    parser.add_argument("-n", "--index", help="Partition index.", type=int, required=True)
+    parser.add_argument("-c", "--content", help="Also compare the content of clusters by their hashes.",
+                        action="store_true")
+    parser.add_argument("--hash-cache", help="Directory to keep cluster hashes in between runs.", type=str)
+    parser.add_argument("-u", "--undelete", help="Include files marked as deleted.", action="store_true")
+    parser.add_argument("-o", "--outputfile", help="Write changes to this CSV file instead.", type=str)
+    parser.add_argument("--stats", help="Print I/O counters and time spent in each phase.", action="store_true")
+    args = parser.parse_args()
+
+    _stream = logging.StreamHandler(sys.stdout)
+    _stream.setLevel(logging.INFO)
+    _stream.setFormatter(logging.Formatter('%(levelname).4s: %(message)s'))
+    LOG.setLevel(logging.INFO)
+    LOG.addHandler(_stream)
+    # mounting logs every path it finds
+    logging.getLogger('FATX.FileSystem').setLevel(logging.WARNING)
+
+    main_diff(args)
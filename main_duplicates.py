@@ -0,0 +1,99 @@
+from fatx.drive.drive import FatXDrive
+from fatx.analysis.cluster_hash import FatXClusterHashes
+from fatx.filesystem.metrics import FatXMetrics
+
+import argparse
+import logging
+import struct
+import csv
+import sys
+import os
+
+
+LOG = logging.getLogger('FATX')
+
+
+def get_partitions(arg, drive):
+    if arg.index:
+        return arg.index
+    return range(1, len(drive.partitions) + 1)
+
+
+def main_duplicates(arg):
+    metrics = FatXMetrics()
+    groups = {}     # key -> [(image, index, path, size)]
+    files = []
+    for image in arg.inputfile:
+        infile = open(image, 'rb')
+        files.append(infile)
+        drive = FatXDrive(infile, metrics)
+        for index in get_partitions(arg, drive):
+            volume = drive.get_partition(index)
+            try:
+                volume.mount()
+            except (ValueError, struct.error, IndexError, MemoryError):
+                LOG.info("Skipping partition %d of %s, it does not hold a FATX volume.", index, image)
+                continue
+
+            cache = None
+            hashes = FatXClusterHashes(volume)
+            if arg.hash_cache:
+                if not os.path.exists(arg.hash_cache):
+                    os.makedirs(arg.hash_cache)
+                cache = hashes.get_cache_path(arg.hash_cache)
+            hashes.build_or_load(cache)
+
+            for dirent, key in hashes.get_tree_keys(volume.get_root(), arg.undelete):
+                groups.setdefault(key, []).append((image, index, dirent.get_full_path(), dirent.file_size))
+
+    duplicates = [locations for locations in groups.values() if len(locations) > 1]
+    duplicates.sort(key=lambda locations: locations[0][3] * (len(locations) - 1), reverse=True)
+
+    redundant = 0
+    across = 0
+    for locations in duplicates:
+        size = locations[0][3]
+        redundant += size * (len(locations) - 1)
+        if len(set((image, index) for image, index, _, _ in locations)) > 1:
+            across += 1
+
+    if arg.outputfile:
+        with open(arg.outputfile, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['group', 'image', 'partition', 'path', 'size'])
+            for group, locations in enumerate(duplicates):
+                for image, index, path, size in locations:
+                    writer.writerow([group, image, index, path, size])
+    else:
+        for locations in duplicates:
+            print("{} copies of {} bytes:".format(len(locations), locations[0][3]))
+            for image, index, path, _ in locations:
+                print("  {}:{}:{}".format(image, index, path))
+
+    print("{} files with duplicates, {} of them across partitions or images, {} redundant bytes.".format(
+        len(duplicates), across, redundant))
+
+    for infile in files:
+        infile.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report files with the same content across partitions and images.")
+    parser.add_argument("-i", "--inputfile", help="Input image file, may be given more than once.", type=str,
+                        action='append', required=True)
+    parser.add_argument("-n", "--index", help="Partition index, may be given more than once "
+                                              "(default is every partition).", type=int, action='append')
+    parser.add_argument("-u", "--undelete", help="Include files marked as deleted.", action="store_true")
+    parser.add_argument("-c", "--hash-cache", help="Directory to keep cluster hashes in between runs.", type=str)
+    parser.add_argument("-o", "--outputfile", help="Write duplicates to this CSV file instead.", type=str)
+    args = parser.parse_args()
+
+    _stream = logging.StreamHandler(sys.stdout)
+    _stream.setLevel(logging.INFO)
+    _stream.setFormatter(logging.Formatter('%(levelname).4s: %(message)s'))
+    LOG.setLevel(logging.INFO)
+    LOG.addHandler(_stream)
+    # mounting logs every path it finds
+    logging.getLogger('FATX.FileSystem').setLevel(logging.WARNING)
+
+    main_duplicates(args)
@@ -0,0 +1,59 @@
+from fatx.drive.drive import FatXDrive
+from fatx.filesystem.export import FatXVolumeExport
+from fatx.filesystem.metrics import FatXMetrics
+from fatx.filesystem.progress import FatXProgress, print_progress
+
+import argparse
+import logging
+import sys
+
+
+LOG = logging.getLogger('FATX')
+
+
+def main_export(arg):
+    metrics = FatXMetrics()
+    progress = None
+    if arg.progress:
+        progress = FatXProgress(print_progress)
+
+    with open(arg.inputfile, 'rb') as infile:
+        drive = FatXDrive(infile, metrics)
+        if not arg.index:
+            drive.print_partitions()
+            return
+        volume = drive.get_partition(arg.index)
+
+        export = FatXVolumeExport(volume)
+        copied = export.write(arg.outputfile, arg.trim, progress)
+        length = export.get_length()
+        if length < volume.length:
+            LOG.warning("The image ends 0x%x bytes before the end of the partition.", volume.length - length)
+
+    print("Wrote {} of {} bytes to {}.".format(copied, length, arg.outputfile))
+    if arg.stats:
+        print("Statistics:")
+        metrics.print_metrics()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a partition as an image of its own.")
+    parser.add_argument("-i", "--inputfile", help="Input image file.", type=str, required=True)
+    parser.add_argument("-n", "--index", help="Partition index. Without it the partitions are printed.", type=int)
+    parser.add_argument("-o", "--outputfile", help="Image file to write.", type=str)
+    parser.add_argument("-t", "--trim", help="Only copy the header, the file allocation table and allocated "
+                                             "clusters, leaving free clusters as holes.", action="store_true")
+    parser.add_argument("--progress", help="Report progress, throughput and ETA on stderr.", action="store_true")
+    parser.add_argument("--stats", help="Print I/O counters and time spent in each phase.", action="store_true")
+    args = parser.parse_args()
+
+    if args.index and not args.outputfile:
+        parser.error("Must specify an output file (--outputfile).")
+
+    _stream = logging.StreamHandler(sys.stdout)
+    _stream.setLevel(logging.INFO)
+    _stream.setFormatter(logging.Formatter('%(levelname).4s: %(message)s'))
+    LOG.setLevel(logging.INFO)
+    LOG.addHandler(_stream)
+
+    main_export(args)
@@ -0,0 +1,77 @@
+from fatx.drive.generator import FatXDriveGenerator, DAMAGE_PROFILES, \
+    LAYOUT_XBOX, LAYOUT_X360, LAYOUT_X360_DEVKIT, \
+    FILL_NONE, FILL_HEADER, FILL_FULL
+
+import argparse
+import logging
+import json
+import sys
+
+
+LOG = logging.getLogger('FATX')
+
+
+def main_generate(arg):
+    with open(arg.outputfile, 'wb+') as outfile:
+        drive = FatXDriveGenerator(outfile, arg.layout, arg.size)
+        summary = drive.generate(index=arg.index,
+                                 sectors_per_cluster=arg.sectors_per_cluster,
+                                 seed=arg.seed,
+                                 depth=arg.depth,
+                                 dirs_per_dir=arg.dirs,
+                                 files_per_dir=arg.files,
+                                 max_files=arg.max_files,
+                                 min_file_size=arg.min_size,
+                                 max_file_size=arg.max_size,
+                                 fill=arg.fill,
+                                 fragmentation=arg.fragmentation,
+                                 damage=arg.damage)
+        print(json.dumps(summary, indent=1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic FATX drive images.")
+    parser.add_argument("-o", "--outputfile", help="Image file to create.", type=str, required=True)
+    parser.add_argument("-l", "--layout", help="Drive layout (default is x360-devkit).",
+                        choices=(LAYOUT_XBOX, LAYOUT_X360, LAYOUT_X360_DEVKIT), default=LAYOUT_X360_DEVKIT)
+    parser.add_argument("-s", "--size", help="Size of the drive image.",
+                        type=lambda x: int(x, 0), default=0x10000000)
+    parser.add_argument("-n", "--index", help="Partition index to fill (default is the data partition).",
+                        type=int, default=0)
+    parser.add_argument("-c", "--sectors-per-cluster", help="Cluster size in sectors (default is 32).",
+                        type=int, default=32)
+    parser.add_argument("--depth", help="Directory levels below the root.", type=int, default=3)
+    parser.add_argument("--dirs", help="Subdirectories per directory.", type=int, default=4)
+    parser.add_argument("--files", help="Files per directory.", type=int, default=16)
+    parser.add_argument("--max-files", help="Maximum number of files.", type=int, default=None)
+    parser.add_argument("--min-size", help="Smallest file size.", type=lambda x: int(x, 0), default=0)
+    parser.add_argument("--max-size", help="Largest file size.", type=lambda x: int(x, 0), default=0x100000)
+    parser.add_argument("--fill", help="How much of each file to write (default is header).",
+                        choices=(FILL_NONE, FILL_HEADER, FILL_FULL), default=FILL_HEADER)
+    parser.add_argument("--fragmentation", help="Chance of a gap between clusters of a file.",
+                        type=float, default=0.0)
+    parser.add_argument("--damage", help="Damage profile (default is none).",
+                        choices=sorted(DAMAGE_PROFILES.keys()), default='none')
+    parser.add_argument("--seed", help="Random seed.", type=int, default=0)
+    parser.add_argument("-v", "--verbosity", help="Verbose level.", type=str, default="NOTSET")
+    args = parser.parse_args()
+
+    log_verbosity = [v for k, v in logging.__dict__.items() if k.startswith(args.verbosity.upper())][0]
+
+    _stream = logging.StreamHandler(sys.stdout)
+    _stream.setLevel(logging.INFO)
+    _stream.setFormatter(logging.Formatter('%(levelname).4s: %(message)s'))
+
+    if log_verbosity != logging.NOTSET:
+        _file = logging.FileHandler('log.txt', 'w', 'utf-8')
+        _file.setLevel(logging.DEBUG)
+        _file.setFormatter(
+            logging.Formatter('%(module)s::%(funcName)s::%(lineno)d %(levelname).4s %(asctime)s - %(message)s'))
+        LOG.setLevel(log_verbosity)
+        LOG.addHandler(_file)
+    else:
+        LOG.setLevel(logging.INFO)
+
+    LOG.addHandler(_stream)
+
+    main_generate(args)
@@ -12,6 +12,7 @@ except ImportError:
 from fatx.drive.drive import FatXDrive, x_signatures, x360_signatures
 from fatx.analysis.metadata_analyzer import FatXAnalyzer
 from fatx.analysis.file_carver import FatXCarver
+from fatx.filesystem.progress import FatXProgress
 import os
 import sys
 import threading
@@ -42,6 +43,9 @@ class DrivePanel(ttk.Frame):
         self.analyzer = None
         self.timer0 = None
         self.timer1 = None
+        # latest event from the worker thread, shown by show_progress()
+        self.progress = FatXProgress(self.set_progress_event)
+        self.progress_event = None
 
         self.pack()
         tree_columns = ('filesize', 'attr', 'cdate', 'mdate', 'adate')
@@ -95,31 +99,58 @@ class DrivePanel(ttk.Frame):
         self.tree.item(partition_node, open=False)
         collapse_node(partition_node)
 
-    def recover_progress(self):
-        file_name = self.thread.current_file[1]
-        label_text = 'Recovering: {}'.format(file_name)
-        self.progress_label_text.set(label_text)
-        self.progress_bar['value'] = self.thread.current_file[0]
+    def set_progress_event(self, event):
+        # called from the worker thread, Tk may only be used from this one
+        self.progress_event = event
+
+    def show_progress(self, on_done):
+        """Shows the latest progress event until the worker thread is done.
+
+        Args:
+            on_done (callable): Called once the worker thread has finished.
+        """
+        event = self.progress_event
+        if event is not None:
+            self.progress_label_text.set(str(event))
+            fraction = event.get_fraction()
+            self.progress_bar['value'] = fraction * 1000 if fraction else 0
         if self.thread.is_alive():
-            self.after(100, self.recover_progress)
+            self.after(100, self.show_progress, on_done)
         else:
             self.progress_label_text.set('')
             self.progress_bar['value'] = 0
+            self.progress_event = None
             self.timer1 = time.time()
-            print('Dump completed in {} seconds'.format(self.timer1 - self.timer0))
-            self.master.bell()
+            on_done()
+
+    def start_thread(self, thread, on_done):
+        self.thread = thread
+        self.progress_bar['maximum'] = 1000
+        self.progress_event = None
+        self.timer0 = time.time()
+        self.thread.start()
+        self.show_progress(on_done)
+
+    def recover_done(self):
+        print('Dump completed in {} seconds'.format(self.timer1 - self.timer0))
+        self.master.bell()
 
     class RecoverPartition(threading.Thread):
-        def __init__(self, partition, directory):
+        def __init__(self, partition, directory, progress):
             threading.Thread.__init__(self)
             self.partition = partition
             self.directory = directory
-            self.current_file = (0, '')
+            self.progress = progress
 
         def run(self):
-            for x, dirent in enumerate(self.partition.get_root()):
-                self.current_file = (x, dirent.file_name)
-                dirent.recover(self.directory)
+            root = self.partition.get_root()
+            sizes = [dirent.get_tree_size() for dirent in root]
+            self.progress.start('extract',
+                                total_bytes=sum(size for size, _ in sizes),
+                                total_items=sum(files for _, files in sizes))
+            for dirent in root:
+                dirent.recover(self.directory, progress=self.progress)
+            self.progress.finish()
 
     def recover_partition(self):
         if self.thread is not None and self.thread.is_alive():
@@ -133,38 +164,25 @@ class DrivePanel(ttk.Frame):
         if directory == '':
             return
 
-        self.thread = self.RecoverPartition(partition, directory)
-        self.progress_bar['maximum'] = len(partition.get_root())
-        self.timer0 = time.time()
-        self.thread.start()
-        self.recover_progress()
+        self.start_thread(self.RecoverPartition(partition, directory, self.progress),
+                          self.recover_done)
 
-    def orphan_scanner_progress(self):
-        cluster = self.analyzer.current_block
-        label_text = "Cluster {}/{}".format(cluster, self.progress_bar['maximum'])
-        self.progress_label_text.set(label_text)
-        self.progress_bar['value'] = cluster
-        if self.thread.is_alive():
-            self.after(100, self.orphan_scanner_progress)
-        else:
-            # self.tree.configure(state='normal')
-            self.progress_label_text.set('')
-            self.progress_bar['value'] = 0
-            self.timer1 = time.time()
-            print('analysis completed in {} seconds.'.format(self.timer1 - self.timer0))
-            self.master.bell()
-            panel = RecoverPanel(self.master, 0)
-            self.master.add(panel, text='Analysis results')
-            orphans = self.analyzer.get_roots()
-            panel.add_orphans(orphans)
+    def orphan_scanner_done(self):
+        print('analysis completed in {} seconds.'.format(self.timer1 - self.timer0))
+        self.master.bell()
+        panel = RecoverPanel(self.master, 0)
+        self.master.add(panel, text='Analysis results')
+        orphans = self.analyzer.get_roots()
+        panel.add_orphans(orphans)
 
     class OrphanScanner(threading.Thread):
-        def __init__(self, analyzer):
+        def __init__(self, analyzer, progress):
             threading.Thread.__init__(self)
             self.analyzer = analyzer
+            self.progress = progress
 
         def run(self):
-            self.analyzer.perform_orphan_analysis()
+            self.analyzer.perform_orphan_analysis(progress=self.progress)
             self.analyzer.save_roots('data')
 
     def run_orphan_scanner(self):
@@ -176,45 +194,33 @@ class DrivePanel(ttk.Frame):
         partition = self.partition_nodes[partition_node]
         self.analyzer = FatXAnalyzer(partition)
 
-        self.thread = self.OrphanScanner(self.analyzer)
-        self.progress_bar['maximum'] = self.analyzer.volume.max_clusters
         # self.tree.state(('disabled',))
-        self.timer0 = time.time()
-        self.thread.start()
-        self.orphan_scanner_progress()
-        pass
-
-    def signature_scanner_progress(self):
-        cluster = self.analyzer.current_block
-        label_text = "Block {}/{}".format(cluster, self.progress_bar['maximum'])
-        self.progress_label_text.set(label_text)
-        self.progress_bar['value'] = cluster
-        if self.thread.is_alive():
-            self.after(100, self.signature_scanner_progress)
-        else:
-            # self.tree.configure(state='normal')
-            self.progress_label_text.set('')
-            self.progress_bar['value'] = 0
-            self.timer1 = time.time()
-            print('analysis completed in {} seconds.'.format(self.timer1 - self.timer0))
-            self.master.bell()
-            panel = RecoverPanel(self.master, 1)
-            self.master.add(panel, text='Analysis results')
-            orphans = self.analyzer.get_valid_sigs()
-            panel.add_entries(orphans)
+        self.start_thread(self.OrphanScanner(self.analyzer, self.progress),
+                          self.orphan_scanner_done)
+
+    def signature_scanner_done(self):
+        # self.tree.configure(state='normal')
+        print('analysis completed in {} seconds.'.format(self.timer1 - self.timer0))
+        self.master.bell()
+        panel = RecoverPanel(self.master, 1)
+        self.master.add(panel, text='Analysis results')
+        orphans = self.analyzer.get_valid_sigs()
+        panel.add_entries(orphans)
 
     class SignatureScanner(threading.Thread):
-        def __init__(self, analyzer, signatures, interval=0x200, length=0):
+        def __init__(self, analyzer, signatures, progress, interval=0x200, length=0):
             threading.Thread.__init__(self)
             self.analyzer = analyzer
             self.signatures = signatures
+            self.progress = progress
             self.interval = interval
             self.length = length
 
         def run(self):
             self.analyzer.perform_signature_analysis(signatures=self.signatures,
                                                      interval=self.interval,
-                                                     length=self.length)
+                                                     length=self.length,
+                                                     progress=self.progress)
 
     def run_signature_scanner(self):
         if self.thread is not None and self.thread.is_alive():
@@ -227,12 +233,8 @@ class DrivePanel(ttk.Frame):
         # TODO: this is nasty, don't do this
         signatures = x360_signatures if self.analyzer.volume.endian_fmt == '>' else x_signatures
 
-        self.thread = self.SignatureScanner(self.analyzer, signatures=signatures)
-        self.progress_bar['maximum'] = self.analyzer.volume.length / 0x200  # TODO: analyzer.get_interval()
-        self.timer0 = time.time()
-        self.thread.start()
-        self.signature_scanner_progress()
-        pass
+        self.start_thread(self.SignatureScanner(self.analyzer, signatures, self.progress),
+                          self.signature_scanner_done)
 
     def open_context_menu(self, event):
         item = self.tree.identify('row', event.x, event.y)
@@ -1,10 +1,19 @@
 import argparse
+import json
 import sys
 import os
 import logging
 
 from fatx.analysis.metadata_analyzer import FatXAnalyzer
-from fatx.analysis.file_carver import FatXCarver
+from fatx.analysis.file_carver import FatXCarver, SCOPE_ALL, SCOPE_UNALLOCATED
+from fatx.analysis.extractor import FatXExtractor
+from fatx.analysis.cluster_hash import FatXClusterHashes, FatXDeduplicator, DEDUPE_LINK, DEDUPE_SKIP
+from fatx.filesystem.metrics import FatXMetrics
+from fatx.filesystem.profiler import FatXProfiler, PROFILE_DETERMINISTIC, PROFILE_SAMPLING
+from fatx.filesystem.progress import FatXProgress, print_progress
+from fatx.filesystem.manifest import FatXManifest
+from fatx.filesystem.archive import FatXArchive
+from fatx.filesystem.ordered import FatXOrderedExtractor
 from fatx.drive.drive import FatXDrive, \
     DRIVE_X360, DRIVE_XBOX, x360_signatures, x_signatures
 
@@ -13,37 +22,98 @@ LOG = logging.getLogger('FATX')
 
 
 def main_recover(arg):
+    metrics = None
+    profiler = None
+    if arg.profile:
+        profiler = FatXProfiler(arg.profile, arg.profile_mode, arg.profile_interval)
+    if arg.stats or arg.stats_file or profiler is not None:
+        metrics = FatXMetrics(profiler)
+
+    progress = None
+    if arg.progress:
+        progress = FatXProgress(print_progress)
+
+    # checked before the manifest is created, so none is left behind empty
+    if arg.recover and arg.scan_orphans and arg.archive and (arg.manifest or arg.dedupe):
+        raise Exception("--archive cannot be used with --manifest or --dedupe.")
+    if arg.recover and arg.scan_orphans and arg.ordered and (arg.manifest or arg.dedupe):
+        raise Exception("--ordered writes files out of order and cannot be used with "
+                        "--manifest or --dedupe.")
+
+    manifest = None
+    if arg.manifest and arg.recover:
+        manifest = FatXManifest(arg.manifest)
+
     with open(arg.inputfile, 'rb') as infile:
-        drive = FatXDrive(infile)
+        drive = FatXDrive(infile, metrics)
         basename = os.path.basename(arg.inputfile)
 
         if drive is not None:
             volume = drive.get_partition(arg.index)
-            volume.mount()
+            volume.mount(progress)
 
             # orphan scanner will look for anything that looks
             # like a valid DIRENT entry for complete file info
             if arg.scan_orphans:
-                if arg.recover and not arg.outputpath:
+                if arg.recover and not arg.outputpath and not arg.archive:
                     raise Exception("Must supply output path if recovering files! (--outputpath)")
 
                 analyzer = FatXAnalyzer(volume)
-                analyzer.perform_orphan_analysis(max_clusters=arg.so_length)
+                analyzer.perform_orphan_analysis(max_clusters=arg.so_length, progress=progress)
                 analyzer.save_roots(basename)
                 roots = analyzer.get_roots()
                 for root in roots:
                     root.print_dirent('.')
 
-                if arg.recover:
+                if arg.so_table:
+                    analyzer.get_table().export(arg.so_table)
+
+                if arg.recover and arg.archive:
+                    with drive.metrics.phase('extract'):
+                        if progress is not None:
+                            sizes = [root.get_tree_size(True) for root in roots]
+                            progress.start('extract',
+                                           total_bytes=sum(size for size, _ in sizes),
+                                           total_items=sum(files for _, files in sizes))
+                        with FatXArchive(arg.archive, compress=arg.compress) as archive:
+                            for root in roots:
+                                archive.add_dirent(root, 'cluster' + str(root.cluster), True, progress)
+                        if progress is not None:
+                            progress.finish()
+                elif arg.recover:
                     if not os.path.exists(args.outputpath):
                         os.mkdir(args.outputpath)
 
-                    for root in roots:
-                        root_dir = args.outputpath + '/cluster' + str(root.cluster)
-                        if not os.path.exists(root_dir):
-                            os.mkdir(root_dir)
-
-                        root.recover(root_dir)
+                    dedupe = None
+                    if arg.dedupe:
+                        hashes = FatXClusterHashes(volume)
+                        hashes.build_or_load(arg.hash_cache, progress)
+                        dedupe = FatXDeduplicator(hashes, arg.dedupe)
+
+                    with drive.metrics.phase('extract'):
+                        if progress is not None:
+                            sizes = [root.get_tree_size(True) for root in roots]
+                            progress.start('extract',
+                                           total_bytes=sum(size for size, _ in sizes),
+                                           total_items=sum(files for _, files in sizes))
+                        extractor = FatXOrderedExtractor(volume, sparse=not arg.no_sparse) if arg.ordered else None
+                        for root in roots:
+                            root_dir = args.outputpath + '/cluster' + str(root.cluster)
+                            if not os.path.exists(root_dir):
+                                os.mkdir(root_dir)
+
+                            if extractor is not None:
+                                # orphans are recovered whether deleted or not
+                                extractor.add(root, root_dir, True)
+                            else:
+                                root.recover(root_dir, progress, manifest, dedupe, not arg.no_sparse)
+                        if extractor is not None:
+                            extractor.run(progress)
+                        if progress is not None:
+                            progress.finish()
+                    if dedupe is not None:
+                        LOG.info("%d duplicate files (%d bytes) were %s.", dedupe.duplicates,
+                                 dedupe.bytes_saved, "linked" if arg.dedupe == DEDUPE_LINK else "skipped")
 
             # signature scanner will go through blocks of data
             # testing various signatures to see if they match
@@ -51,19 +121,57 @@ def main_recover(arg):
                 if arg.recover and not arg.outputpath:
                     raise Exception("Must supply output path if recovering files! (--outputpath)")
 
+                # recover signatures while the search continues
+                extractor = None
+                if arg.recover:
+                    if not os.path.exists(arg.outputpath):
+                        os.makedirs(arg.outputpath)
+                    # the extractor runs alongside the carver, so it reports on its own
+                    extract_progress = FatXProgress(print_progress) if progress is not None else None
+                    extractor = FatXExtractor(volume, arg.outputpath, workers=arg.ss_workers,
+                                              progress=extract_progress, manifest=manifest)
+
                 analyzer = FatXCarver(volume)
+                callback = extractor.submit if extractor is not None else None
                 if drive.mode == DRIVE_XBOX:
                     analyzer.perform_signature_analysis(x_signatures,
                                                         interval=arg.ss_interval,
-                                                        length=arg.ss_length)
+                                                        length=arg.ss_length,
+                                                        processes=arg.ss_processes,
+                                                        scope=arg.ss_scope,
+                                                        callback=callback,
+                                                        progress=progress)
                 elif drive.mode == DRIVE_X360:
                     analyzer.perform_signature_analysis(x360_signatures,
                                                         interval=arg.ss_interval,
-                                                        length=arg.ss_length)
+                                                        length=arg.ss_length,
+                                                        processes=arg.ss_processes,
+                                                        scope=arg.ss_scope,
+                                                        callback=callback,
+                                                        progress=progress)
 
-                if arg.recover:
-                    for find in analyzer.found_signatures:
-                        find.recover(arg.outputpath)
+                if extractor is not None:
+                    with drive.metrics.phase('extract'):
+                        extractor.close()
+
+    if manifest is not None:
+        manifest.close()
+
+    if metrics is not None:
+        print_stats(arg, metrics)
+    if profiler is not None:
+        profiler.write()
+        print("Profile:")
+        profiler.print_summary()
+
+
+def print_stats(arg, metrics):
+    if arg.stats:
+        print("Statistics:")
+        metrics.print_metrics()
+    if arg.stats_file:
+        with open(arg.stats_file, 'w') as f:
+            json.dump(metrics.to_dict(), f, indent=1, separators=(',', ': '))
 
 
 if __name__ == "__main__":
@@ -80,12 +188,43 @@ if __name__ == "__main__":
     parser.add_argument("-so", "--scan-orphans", help="Use orphan scanner.", action="store_true")
     parser.add_argument("-son", "--so-length", help="Number of clusters to search through.",
                         type=lambda x: int(x, 0), default=0)
+    parser.add_argument("-sot", "--so-table", help="Write metadata of recovered orphans to a .csv file, or to "
+                                                   "flat column files in a directory.", type=str)
 
     parser.add_argument("-ss", "--scan-signatures", help="Use signature scanner.", action="store_true")
     parser.add_argument("-ssx", "--ss-interval", help="Interval for finding signatures (default is 0x200).",
                         type=lambda x: int(x, 0), default=0x1000)
     parser.add_argument("-ssl", "--ss-length", help="Maximum amount of data to search through.",
                         type=lambda x: int(x, 0), default=0)
+    parser.add_argument("-ssp", "--ss-processes", help="Number of processes to search with (default is 1).",
+                        type=int, default=1)
+    parser.add_argument("-sss", "--ss-scope", help="Search all clusters or only unallocated ones (default is all).",
+                        choices=(SCOPE_ALL, SCOPE_UNALLOCATED), default=SCOPE_ALL)
+    parser.add_argument("-ssw", "--ss-workers", help="Number of threads recovering signatures during the search "
+                                                     "(default is 1).",
+                        type=int, default=1)
+
+    parser.add_argument("--archive", help="Recover orphans into a .tar, .tar.gz, .tgz or .zip archive instead "
+                                          "of a directory.", type=str)
+    parser.add_argument("--compress", help="Deflate files recovered into a zip archive.", action="store_true")
+    parser.add_argument("--ordered", help="Read the data of all orphans in the order it is stored in the image.",
+                        action="store_true")
+    parser.add_argument("--no-sparse", help="Write blocks of zeros instead of leaving holes. Only with this does the "
+                                            "kernel copy orphans straight from the image, otherwise every block is "
+                                            "read to look for zeros.", action="store_true")
+    parser.add_argument("--dedupe", help="Hard link or skip orphans whose content was already recovered.",
+                        choices=(DEDUPE_LINK, DEDUPE_SKIP))
+    parser.add_argument("--hash-cache", help="File to keep cluster hashes for --dedupe in between runs.", type=str)
+    parser.add_argument("--manifest", help="Write the size and MD5, SHA-1 and SHA-256 of each recovered file "
+                                           "to this CSV file.", type=str)
+    parser.add_argument("--progress", help="Report progress, throughput and ETA on stderr.", action="store_true")
+    parser.add_argument("--stats", help="Print I/O counters and time spent in each phase.", action="store_true")
+    parser.add_argument("--stats-file", help="Write I/O counters and phase times to this JSON file.", type=str)
+    parser.add_argument("--profile", help="Profile each phase, writing files that start with this path.", type=str)
+    parser.add_argument("--profile-mode", help="Trace every call or sample the stack (default is deterministic).",
+                        choices=(PROFILE_DETERMINISTIC, PROFILE_SAMPLING), default=PROFILE_DETERMINISTIC)
+    parser.add_argument("--profile-interval", help="Seconds between samples (default is 0.005).",
+                        type=float, default=0.005)
 
     args = parser.parse_args()
 